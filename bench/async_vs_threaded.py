@@ -0,0 +1,79 @@
+"""Сравнение режимов BOT_MODE=polling и BOT_MODE=async на локальной заглушке Telegram API.
+
+Запуск из корня репозитория:
+    python -m bench.async_vs_threaded --students 200 --latency 0.05
+"""
+import argparse
+import os
+import tempfile
+import threading
+import time
+
+from bench.fake_telegram import FakeTelegramServer, callback_update, text_update
+
+# Каждый студент открывает помощь, выбирает карточку и переходит к следующей:
+# sendMessage + (sendMessage, sendMessage, answerCallbackQuery) + (sendPhoto, answerCallbackQuery)
+SCENARIO = [
+    (text_update, "Помощь"),
+    (callback_update, "part_1_2"),
+    (callback_update, "next_1"),
+]
+CALLS_PER_STUDENT = 6
+
+
+def run_mode(mode: str, students: int, latency: float) -> float:
+    from telebot import apihelper, asyncio_helper
+
+    from bot.main import AsyncFeedbackBot, FeedbackBot
+
+    server = FakeTelegramServer(latency=latency).start()
+    apihelper.API_URL = server.api_url
+    asyncio_helper.API_URL = server.api_url
+
+    bot = (AsyncFeedbackBot if mode == "async" else FeedbackBot)("123:fake")
+    for student in range(1, students + 1):
+        for make_update, payload in SCENARIO:
+            server.push_update(make_update(student, payload))
+
+    result = {}
+
+    def watch():
+        started = time.perf_counter()
+        result["ok"] = server.wait_calls(students * CALLS_PER_STUDENT, timeout=600)
+        result["elapsed"] = time.perf_counter() - started
+        bot.stop()
+
+    watcher = threading.Thread(target=watch, daemon=True)
+    watcher.start()
+    bot.run()
+    watcher.join()
+    server.stop()
+    if not result["ok"]:
+        raise RuntimeError(f"{mode}: бот не обработал все апдейты за отведённое время")
+    return result["elapsed"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--students", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=0.05, help="задержка заглушки API на вызов, сек.")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench-")
+    os.environ.setdefault("DB_URL", f"sqlite:///{os.path.join(workdir, 'bench.db')}")
+    os.environ["MEDIA_CACHE_PATH"] = os.path.join(workdir, "media_cache.json")
+    os.environ["JOURNAL_DIR"] = os.path.join(workdir, "journal")
+    # Заглушка не вводит флуд-лимитов, сравниваем сами режимы, а не планировщик отправки
+    os.environ.setdefault("OUTBOUND_GLOBAL_RATE", "1000000")
+    os.environ.setdefault("OUTBOUND_GLOBAL_BURST", "1000000")
+    os.environ.setdefault("OUTBOUND_CHAT_BURST", "1000000")
+
+    calls = args.students * CALLS_PER_STUDENT
+    for mode in ("polling", "async"):
+        elapsed = run_mode(mode, args.students, args.latency)
+        print(f"{mode:8} {args.students} студентов, {calls} вызовов API: "
+              f"{elapsed:.2f} с, {calls / elapsed:.0f} вызовов/с")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""Рассылка всем студентам через локальную заглушку Telegram API с общим флуд-лимитом.
+
+Рассылку, как и в боте, отправляет поток Broadcaster.watch через общий планировщик, пока тот же
+планировщик отвечает пользователям. После --interrupt-after доставленных сообщений бот «останавливается»,
+новый запуск продолжает рассылку сам. В конце проверяется, что каждый студент получил сообщение ровно
+один раз, а те, кто заблокировал бота, отмечены ошибкой; при нарушении код выхода 1.
+По умолчанию - временная SQLite, для Postgres укажите DB_URL:
+    python -m bench.broadcast --students 2000 --global-limit 30
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+from telebot import TeleBot, apihelper
+
+from bench.fake_telegram import FakeTelegramServer
+
+# Чаты пользователей, которым бот отвечает во время рассылки, не пересекаются со студентами
+REPLY_CHATS = 10 ** 6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--students", type=int, default=2000)
+    parser.add_argument("--global-limit", type=int, default=30, help="сообщений боту за секунду в заглушке")
+    parser.add_argument("--latency", type=float, default=0.02, help="задержка заглушки API на вызов, сек.")
+    parser.add_argument("--blocked", type=float, default=0.02, help="доля студентов, заблокировавших бота")
+    parser.add_argument("--interrupt-after", type=int, default=500)
+    parser.add_argument("--page-size", type=int, default=500)
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--reply-rate", type=float, default=5, help="ответов пользователям в секунду во время рассылки")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench-")
+    os.environ.setdefault("DB_URL", f"sqlite:///{os.path.join(workdir, 'bench.db')}")
+    from bot.broadcast import Broadcaster
+    from bot.outbound import OutboundScheduler
+    from db.database import db
+    from db.migrations import migrate
+
+    migrate(db)
+    with db.unit_of_work() as session:
+        session.execute(db.statements.upsert_students, [
+            {"id": student, "name": f"Student{student}"} for student in range(1, args.students + 1)
+        ])
+    blocked = set(range(1, args.students + 1, max(1, round(1 / args.blocked)))) if args.blocked else set()
+    server = FakeTelegramServer(latency=args.latency, global_limit=(args.global_limit, 1.0), blocked=blocked).start()
+    apihelper.API_URL = server.api_url
+    bot = TeleBot("123:fake", threaded=False)
+
+    broadcast_id, replies, failed = None, [], False
+    for interrupt in (True, False):
+        scheduler = OutboundScheduler(global_rate=args.global_limit * 0.9, workers=args.workers)
+        scheduler.start()
+        broadcaster = Broadcaster(db, bot, scheduler, page_size=args.page_size)
+        broadcast_id = broadcast_id or broadcaster.create("Игра начинается через 10 минут")
+        finished = threading.Event()
+        if interrupt:
+            def stop_after(method, params, broadcaster=broadcaster, stopped=finished):
+                if server.calls["sendMessage"] >= args.interrupt_after and not stopped.is_set():
+                    stopped.set()
+                    broadcaster.stop()
+
+            server.on_call(stop_after)
+        started = time.perf_counter()
+        broadcaster.watch(interval=0.1)
+        # Пока идёт рассылка, бот отвечает пользователям через тот же планировщик
+        while not finished.is_set():
+            chat = REPLY_CHATS + len(replies)
+            replies.append(scheduler.submit(bot.send_message, (chat, "Ответ"), chat_id=chat))
+            finished.wait(1 / args.reply_rate)
+            if broadcast_id in broadcaster.reports:
+                finished.set()
+        broadcaster.close()
+        scheduler.close()
+        report = broadcaster.reports.get(broadcast_id, {"sent": 0, "failed": 0, "finished": False})
+        wait = scheduler.stats()["wait"]["normal"]
+        print(f"{'первый запуск' if interrupt else 'продолжение':14} доставлено {report['sent']}, "
+              f"ошибок {report['failed']}, {time.perf_counter() - started:.1f} с, завершена: {report['finished']}; "
+              f"ответов пользователям {wait['count']}, ожидание в среднем {wait['seconds_avg'] * 1000:.0f} мс, "
+              f"максимум {wait['seconds_max'] * 1000:.0f} мс")
+        failed = failed or (not interrupt and not report["finished"])
+    server.stop()
+
+    received = {chat: methods.count("sendMessage") for chat, methods in server.chat_log.items() if chat < REPLY_CHATS}
+    duplicates = sum(1 for count in received.values() if count > 1)
+    missing = sum(1 for student in range(1, args.students + 1) if student not in blocked and student not in received)
+    lost_replies = sum(1 for reply in replies if reply.exception() is not None)
+    print(f"Статусы: {broadcaster.status(broadcast_id)}, ответов 429: {sum(server.rejected.values())}")
+    print(f"Получили дважды: {duplicates}, не получили: {missing}, заблокировали бота: {len(blocked)}, "
+          f"не доставлено ответов пользователям: {lost_replies}")
+    if failed or duplicates or missing or lost_replies:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
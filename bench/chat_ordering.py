@@ -0,0 +1,101 @@
+"""Порядок обработки апдейтов внутри чата: пул TeleBot против ChatExecutor.
+
+Каждый студент дважды быстро нажимает на части первой карточки и сразу переходит к следующей.
+При обработке по порядку в чат уходят ровно текст выбранной части, кнопка "Продолжить" и
+следующая карточка; лишние или переставленные сообщения - следствие гонки обработчиков.
+Запуск из корня репозитория:
+    python -m bench.chat_ordering --students 2000 --latency 0.01
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+from bench.fake_telegram import FakeTelegramServer, callback_update
+
+SCENARIO = ["part_1_1", "part_1_2", "next_1"]
+EXPECTED = ["sendMessage", "sendMessage", "sendPhoto"]
+# Ответы на три нажатия + три сообщения в чат
+CALLS_PER_STUDENT = 6
+
+
+def run_variant(variant: str, students: int, latency: float, workers: int) -> dict:
+    from telebot import TeleBot, apihelper
+
+    from bot.main import FeedbackBot
+
+    class PooledFeedbackBot(FeedbackBot):
+        """Как было раньше: обработчики выполняет собственный пул потоков TeleBot"""
+
+        def create_bot(self, token: str):
+            return TeleBot(token, threaded=True, num_threads=workers)
+
+        def wrap(self, handler):
+            return handler
+
+    server = FakeTelegramServer(latency=latency).start()
+    apihelper.API_URL = server.api_url
+    bot = (PooledFeedbackBot if variant == "TeleBot" else FeedbackBot)("123:fake")
+    for student in range(1, students + 1):
+        for data in SCENARIO:
+            server.push_update(callback_update(student, data))
+
+    result = {}
+
+    def watch():
+        started = time.perf_counter()
+        result["ok"] = server.wait_calls(students * CALLS_PER_STUDENT, timeout=600)
+        result["elapsed"] = time.perf_counter() - started
+        # Даём дойти лишним сообщениям, если обработчики гонялись
+        time.sleep(0.5)
+        bot.stop()
+
+    watcher = threading.Thread(target=watch, daemon=True)
+    watcher.start()
+    bot.run()
+    watcher.join()
+    server.stop()
+    if not result["ok"]:
+        raise RuntimeError(f"{variant}: бот не обработал все апдейты за отведённое время")
+    result["broken"] = sum(1 for student in range(1, students + 1) if server.chat_log[student] != EXPECTED)
+    result["executor"] = bot.executor.stats()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--students", type=int, default=2000)
+    parser.add_argument("--latency", type=float, default=0.01, help="задержка заглушки API на вызов, сек.")
+    parser.add_argument("--workers", type=int, default=16)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench-")
+    os.environ.setdefault("DB_URL", f"sqlite:///{os.path.join(workdir, 'bench.db')}")
+    os.environ["MEDIA_CACHE_PATH"] = os.path.join(workdir, "media_cache.json")
+    os.environ["JOURNAL_DIR"] = os.path.join(workdir, "journal")
+    os.environ["HANDLER_WORKERS"] = str(args.workers)
+    # Заглушка не вводит флуд-лимитов, сравниваем только исполнение обработчиков
+    os.environ.setdefault("OUTBOUND_GLOBAL_RATE", "1000000")
+    os.environ.setdefault("OUTBOUND_GLOBAL_BURST", "1000000")
+    os.environ.setdefault("OUTBOUND_CHAT_BURST", "1000000")
+    os.environ.setdefault("OUTBOUND_WORKERS", "256")
+
+    updates = args.students * len(SCENARIO)
+    for variant in ("TeleBot", "ChatExecutor"):
+        result = run_variant(variant, args.students, args.latency, args.workers)
+        line = (f"{variant:12} {updates} апдейтов: {result['elapsed']:.2f} с, {updates / result['elapsed']:.0f} апдейтов/с, "
+                f"чатов с нарушенным порядком: {result['broken']} из {args.students}")
+        latency = result["executor"]["latency"]
+        if latency["run"]["count"]:
+            line += (f", ожидание в очереди в среднем {latency['wait']['seconds_avg'] * 1000:.1f} мс "
+                     f"(максимум {latency['wait']['seconds_max'] * 1000:.0f} мс)")
+        print(line)
+        if variant == "ChatExecutor" and result["broken"]:
+            # У TeleBot порядок нарушается ожидаемо, у ChatExecutor это ошибка
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
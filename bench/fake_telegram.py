@@ -0,0 +1,273 @@
+import itertools
+import json
+import random
+import threading
+import math
+import time
+from collections import Counter, defaultdict, deque
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "FakeBot", "username": "fake_feedback_bot"}
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+
+class _Flood(Exception):
+    def __init__(self, retry_after: int):
+        self.retry_after = retry_after
+
+
+class _Blocked(Exception):
+    pass
+
+
+class FakeTelegramServer:
+    """Локальная заглушка Telegram Bot API для бенчмарков.
+
+    Отдаёт подготовленные апдейты через getUpdates и отвечает на sendMessage, sendPhoto и
+    answerCallbackQuery, добавляя искусственную задержку latency секунд к каждому исходящему вызову.
+    Лимиты chat_limit и global_limit вида (сообщений, за секунд) включают флуд-контроль как у
+    Telegram: сообщение сверх лимита получает 429 Too Many Requests с retry_after.
+    flood_rate - доля сообщений, которые получают 429 случайно, независимо от лимитов.
+    Сообщения в чаты из blocked получают 403, как от пользователя, заблокировавшего бота.
+    Функции, переданные в on_call, вызываются после каждого успешного исходящего вызова.
+    """
+
+    def __init__(self, latency: float = 0.0, host: str = "127.0.0.1", port: int = 0,
+                 chat_limit: tuple[int, float] | None = None, global_limit: tuple[int, float] | None = None,
+                 flood_rate: float = 0.0, flood_retry_after: int = 1, seed: int = 1, blocked: set | None = None):
+        self.latency = latency
+        self.chat_limit = chat_limit
+        self.global_limit = global_limit
+        self.flood_rate = flood_rate
+        self.flood_retry_after = flood_retry_after
+        self.random = random.Random(seed)
+        self.blocked = blocked or set()
+        self.listeners = []
+        self.sent = defaultdict(deque)  # chat_id (None - все чаты) -> время отправленных сообщений
+        self.updates = []
+        self.next_update_id = 1
+        self.next_message_id = 1
+        self.calls = Counter()
+        self.chat_log = defaultdict(list)  # chat_id -> отправленные в чат методы по порядку
+        self.rejected = Counter()
+        self.condition = threading.Condition()
+        self.server = _Server((host, port), self._handler_class())
+        self.thread = None
+
+    @property
+    def api_url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/bot{{0}}/{{1}}"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, name="fake-telegram", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def push_update(self, update: dict) -> int:
+        with self.condition:
+            update = dict(update, update_id=self.next_update_id)
+            self.next_update_id += 1
+            self.updates.append(update)
+            self.condition.notify_all()
+            return update["update_id"]
+
+    def on_call(self, listener):
+        """listener(method, params) - после каждого успешного исходящего вызова"""
+        self.listeners.append(listener)
+
+    def wait_calls(self, total: int, timeout: float = 60.0) -> bool:
+        """Ждёт, пока бот сделает total исходящих вызовов (без учёта getUpdates/getMe)"""
+        deadline = time.monotonic() + timeout
+        with self.condition:
+            while self.outbound_calls() < total:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self.condition.wait(remaining)
+        return True
+
+    def outbound_calls(self) -> int:
+        return sum(count for method, count in self.calls.items() if method not in ("getUpdates", "getMe"))
+
+    def _get_updates(self, params: dict) -> list:
+        offset = int(params.get("offset") or 0)
+        timeout = min(float(params.get("timeout") or 0), 1.0)
+        deadline = time.monotonic() + timeout
+        with self.condition:
+            self.updates = [u for u in self.updates if u["update_id"] >= offset]
+            while not self.updates and time.monotonic() < deadline:
+                self.condition.wait(deadline - time.monotonic())
+            return list(self.updates[:100])
+
+    def _message(self, params: dict, **extra) -> dict:
+        with self.condition:
+            message_id = self.next_message_id
+            self.next_message_id += 1
+        chat_id = int(params.get("chat_id", 0))
+        return {
+            "message_id": message_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": BOT_USER,
+            **extra
+        }
+
+    def call(self, method: str, params: dict):
+        if method == "getMe":
+            return BOT_USER
+        if method == "getUpdates":
+            return self._get_updates(params)
+
+        if method.startswith(("send", "edit", "copy", "forward")):
+            if int(params.get("chat_id", 0)) in self.blocked:
+                raise _Blocked()
+            self._check_flood(params.get("chat_id"))
+        if self.latency:
+            time.sleep(self.latency)
+        if "chat_id" in params:
+            with self.condition:
+                self.chat_log[int(params["chat_id"])].append(method)
+        if method == "sendMessage":
+            result = self._message(params, text=params.get("text", ""))
+        elif method == "sendPhoto":
+            photo = params.get("photo")
+            file_id = photo if isinstance(photo, str) else f"uploaded-{time.monotonic_ns()}"
+            photo = {"file_id": file_id, "file_unique_id": file_id, "width": 1280, "height": 1280}
+            result = self._message(params, photo=[photo])
+        else:
+            result = True
+        return result
+
+    def _check_flood(self, chat_id):
+        now = time.monotonic()
+        with self.condition:
+            if self.flood_rate and self.random.random() < self.flood_rate:
+                raise _Flood(self.flood_retry_after)
+            windows = [(None, self.global_limit), (str(chat_id), self.chat_limit)]
+            for key, limit in windows:
+                if limit is None:
+                    continue
+                sent = self.sent[key]
+                while sent and now - sent[0] >= limit[1]:
+                    sent.popleft()
+                if len(sent) >= limit[0]:
+                    raise _Flood(max(1, math.ceil(limit[1] - (now - sent[0]))))
+            for key, limit in windows:
+                if limit is not None:
+                    self.sent[key].append(now)
+
+    def count(self, method: str, params: dict | None = None):
+        with self.condition:
+            self.calls[method] += 1
+            self.condition.notify_all()
+        for listener in self.listeners:
+            listener(method, params or {})
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # HTTP/1.0: соединение на запрос, без тонкостей keep-alive у стандартного сервера
+            protocol_version = "HTTP/1.0"
+
+            def do_POST(self):
+                params = dict(parse_qsl(urlsplit(self.path).query))
+                body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                content_type = self.headers.get("Content-Type", "")
+                if content_type.startswith("multipart/form-data"):
+                    message = BytesParser(policy=HTTP).parsebytes(
+                        f"Content-Type: {content_type}\r\n\r\n".encode() + body
+                    )
+                    for part in message.iter_parts():
+                        name = part.get_param("name", header="content-disposition")
+                        payload = part.get_payload(decode=True)
+                        params[name] = payload if part.get_filename() else payload.decode()
+                elif content_type.startswith("application/json"):
+                    params.update(json.loads(body or b"{}"))
+                else:
+                    params.update(parse_qsl(body.decode()))
+                self._handle(params)
+
+            # aiohttp шлёт getUpdates методом GET, но с телом запроса
+            do_GET = do_POST
+
+            def _handle(self, params: dict):
+                method = self.path.split("?")[0].rsplit("/", 1)[-1]
+                try:
+                    status, body = 200, {"ok": True, "result": server.call(method, params)}
+                except _Flood as flood:
+                    with server.condition:
+                        server.rejected[method] += 1
+                    status, body = 429, {
+                        "ok": False,
+                        "error_code": 429,
+                        "description": f"Too Many Requests: retry after {flood.retry_after}",
+                        "parameters": {"retry_after": flood.retry_after}
+                    }
+                except _Blocked:
+                    status, body = 403, {
+                        "ok": False, "error_code": 403, "description": "Forbidden: bot was blocked by the user"
+                    }
+                body = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+                # Считаем вызов только после того, как ответ ушёл клиенту
+                if status == 200:
+                    server.count(method, params)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+_message_ids = itertools.count(1)
+
+
+def text_update(user_id: int, text: str) -> dict:
+    user = {"id": user_id, "is_bot": False, "first_name": f"Student{user_id}"}
+    return {
+        "message": {
+            "message_id": next(_message_ids),
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": user,
+            "text": text,
+            **({"entities": [{"type": "bot_command", "offset": 0, "length": len(text)}]}
+               if text.startswith("/") else {})
+        }
+    }
+
+
+def callback_update(user_id: int, data: str) -> dict:
+    user = {"id": user_id, "is_bot": False, "first_name": f"Student{user_id}"}
+    return {
+        "callback_query": {
+            "id": f"{user_id}-{data}-{time.monotonic_ns()}",
+            "from": user,
+            "chat_instance": str(user_id),
+            "data": data,
+            "message": {
+                "message_id": 1,
+                "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private"},
+                "from": BOT_USER,
+                "text": "..."
+            }
+        }
+    }
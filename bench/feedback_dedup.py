@@ -0,0 +1,111 @@
+"""Поиск повторов обратной связи на большом синтетическом корпусе.
+
+Студенты пишут случайные сообщения из словаря; часть сообщений - дословные повторы предыдущего
+сообщения того же студента в той же категории (с другим регистром и пунктуацией), часть - почти
+дословные (заменено, выброшено или добавлено слово, опечатка). Печатается скорость проверки,
+время на сообщение, полнота и точность по каждому виду повторов и память индекса:
+    python -m bench.feedback_dedup --messages 200000 --max-entries 20000
+"""
+import argparse
+import random
+import time
+import tracemalloc
+
+from db.dedup import DuplicateIndex
+
+WORDS = (
+    "игра карточки задания цифровые ресурсы преподаватель студент понравилось интересно полезно "
+    "сложно легко добавить больше примеров безопасность интернет пароли данные сети команда время "
+    "вопросы ответы объяснение тема урок занятие формат онлайн офлайн картинки текст кнопки бот "
+    "хотелось бы очень спасибо отлично хорошо понятно непонятно быстро медленно новые темы уровни"
+).split()
+
+
+def random_text(rng: random.Random) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(rng.randint(6, 30))).capitalize() + "."
+
+
+def near_copy(rng: random.Random, text: str) -> str:
+    words = text.rstrip(".").split()
+    edit = rng.choice(("replace", "drop", "insert", "typo"))
+    i = rng.randrange(len(words))
+    if edit == "replace":
+        words[i] = rng.choice(WORDS)
+    elif edit == "drop" and len(words) > 1:
+        del words[i]
+    elif edit == "insert":
+        words.insert(i, rng.choice(WORDS))
+    else:
+        word = words[i]
+        j = rng.randrange(len(word))
+        words[i] = word[:j] + word[j + 1:] + rng.choice("аеиоу")
+    return " ".join(words) + rng.choice((".", "!", "", "..."))
+
+
+def exact_copy(rng: random.Random, text: str) -> str:
+    return rng.choice((text.upper(), text.lower(), f"  {text}!!! ", text.replace(" ", "  ")))
+
+
+def corpus(messages: int, students: int, exact: float, near: float, seed: int = 1):
+    """(студент, категория, текст, вид): вид - new, exact или near"""
+    rng = random.Random(seed)
+    last = {}
+    for _ in range(messages):
+        scope = (rng.randint(1, students), rng.choice(("liked", "add")))
+        roll = rng.random()
+        if scope in last and roll < exact:
+            yield (*scope, exact_copy(rng, last[scope]), "exact")
+        elif scope in last and roll < exact + near:
+            yield (*scope, near_copy(rng, last[scope]), "near")
+        else:
+            text = last[scope] = random_text(rng)
+            yield (*scope, text, "new")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--messages", type=int, default=200000)
+    parser.add_argument("--students", type=int, default=5000)
+    parser.add_argument("--exact", type=float, default=0.1, help="доля дословных повторов")
+    parser.add_argument("--near", type=float, default=0.1, help="доля почти дословных повторов")
+    parser.add_argument("--threshold", type=float, default=0.7)
+    parser.add_argument("--max-entries", type=int, default=20000)
+    args = parser.parse_args()
+
+    index = DuplicateIndex(threshold=args.threshold, max_entries=args.max_entries)
+    found = {"new": 0, "exact": 0, "near": 0}
+    total = {"new": 0, "exact": 0, "near": 0}
+    latencies = []
+    rows = corpus(args.messages, args.students, args.exact, args.near)
+    for i, (student_id, category, text, kind) in enumerate(rows):
+        begun = time.perf_counter()
+        duplicate = index.match(student_id, category, text, str(i)) is not None
+        latencies.append(time.perf_counter() - begun)
+        total[kind] += 1
+        found[kind] += duplicate
+    elapsed = sum(latencies)
+
+    latencies.sort()
+    flagged = sum(found.values())
+    print(f"{args.messages} сообщений: проверка {elapsed:.2f} с, {args.messages / elapsed:.0f} в секунду; "
+          f"на сообщение p50 {latencies[len(latencies) // 2] * 1e6:.0f} мкс, "
+          f"p99 {latencies[int(len(latencies) * 0.99)] * 1e6:.0f} мкс")
+    for kind in ("exact", "near"):
+        print(f"Полнота, {kind:5}: {found[kind] / max(total[kind], 1):.1%} ({found[kind]} из {total[kind]})")
+    print(f"Точность: {(flagged - found['new']) / max(flagged, 1):.1%} "
+          f"(новых сообщений ошибочно помечено повтором: {found['new']} из {total['new']})")
+    print(f"Индекс: {index.stats()}")
+
+    # Память индекса, заполненного до max_entries: отдельный прогон, tracemalloc сильно замедляет проверку
+    rng = random.Random(2)
+    tracemalloc.start()
+    full = DuplicateIndex(threshold=args.threshold, max_entries=args.max_entries)
+    for i in range(args.max_entries):
+        full.match(i, "liked", random_text(rng), str(i))
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"Память индекса на {len(full)} записей: {size / 2 ** 20:.1f} МБ, {size / len(full):.0f} байт на запись")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""Сводка для /stats: GROUP BY по сырым таблицам против счётчиков feedback_rollup.
+
+Заполняет синтетические feedback и game_choice, пересчитывает счётчики и сравнивает время одной
+и той же сводки (всего и по категориям, повторы, за 7 дней, выборы по вариантам карточек) тремя
+способами: запросами по сырым таблицам, чтением feedback_rollup и из памяти (db.rollup.Rollup).
+По умолчанию - временная SQLite, для Postgres укажите DB_URL (таблицы в этой базе будут пересозданы):
+    python -m bench.feedback_stats --rows 1000000
+"""
+import argparse
+import os
+import random
+import tempfile
+from datetime import timedelta
+
+from bench.feedback_analytics import SEMESTER_DAYS, SEMESTER_START, fill, timed
+
+
+def fill_choices(database, rows: int, students: int, chunk: int = 50000):
+    from db.models import GameChoice
+
+    rng = random.Random(2)
+    for start in range(0, rows, chunk):
+        batch = [
+            {
+                "student_id": rng.randrange(students),
+                "image": rng.randint(1, 9),
+                "part": rng.randint(1, 3),
+                "time": SEMESTER_START + timedelta(seconds=rng.randrange(SEMESTER_DAYS * 86400)),
+            }
+            for _ in range(min(chunk, rows - start))
+        ]
+        with database.unit_of_work() as session:
+            session.execute(GameChoice.__table__.insert(), batch)
+
+
+def raw_summary(database, today) -> dict:
+    """Та же сводка, что Rollup.summary, запросами по сырым таблицам"""
+    from sqlalchemy import func, select
+
+    from db.models import Feedback, GameChoice
+
+    week = today - timedelta(days=6)
+    with database.unit_of_work() as session:
+        return {
+            "total": session.execute(select(Feedback.category, func.count()).group_by(Feedback.category)).all(),
+            "duplicates": session.execute(
+                select(func.count()).select_from(Feedback).where(Feedback.duplicate_of.is_not(None))
+            ).scalar(),
+            "recent": session.execute(
+                select(Feedback.category, func.count()).where(Feedback.time >= week).group_by(Feedback.category)
+            ).all(),
+            "choices": session.execute(
+                select(GameChoice.image, GameChoice.part, func.count()).group_by(GameChoice.image, GameChoice.part)
+            ).all(),
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=1000000, help="строк feedback и столько же game_choice")
+    parser.add_argument("--students", type=int, default=2000)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench-")
+    os.environ.setdefault("DB_URL", f"sqlite:///{os.path.join(workdir, 'bench.db')}")
+    from db.database import DB_URL, Database
+    from db.migrations import migrate, schema_version
+    from db.models import Base
+    from db.rollup import Rollup, rebuild_rollup
+
+    database = Database(DB_URL)
+    Base.metadata.drop_all(database.engine)
+    schema_version.drop(database.engine, checkfirst=True)
+    migrate(database)
+
+    elapsed, _ = timed(lambda: (
+        fill(database, args.rows, args.students), fill_choices(database, args.rows, args.students)
+    ))
+    print(f"Заполнение {args.rows} строк feedback и {args.rows} строк game_choice: {elapsed:.1f} с")
+
+    def rebuild():
+        with database.engine.begin() as connection:
+            rebuild_rollup(connection)
+
+    elapsed, _ = timed(rebuild)
+    rollup = Rollup(database)
+    rollup.load()
+    print(f"Пересчёт feedback_rollup полным проходом (один раз, в миграции): {elapsed:.1f} с, "
+          f"строк счётчиков: {sum(len(day) for day in rollup.days.values())}")
+
+    today = (SEMESTER_START + timedelta(days=SEMESTER_DAYS - 1)).date()
+    results = {
+        "GROUP BY по feedback и game_choice": timed(lambda: raw_summary(database, today), repeat=3)[0],
+        "чтение feedback_rollup": timed(rollup.load, repeat=3)[0],
+        "счётчики в памяти": timed(lambda: rollup.summary(today=today), repeat=100)[0],
+    }
+    for name, seconds in results.items():
+        print(f"Сводка, {name:34} {seconds * 1000:10.3f} мс")
+    database.dispose()
+
+
+if __name__ == "__main__":
+    main()
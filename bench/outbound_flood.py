@@ -0,0 +1,92 @@
+"""Отправка пачек сообщений напрямую через TeleBot и через OutboundScheduler при флуд-лимитах.
+
+Заглушка API отвечает 429, как Telegram, если чату уходит больше chat-limit сообщений в секунду
+или боту в целом - больше global-limit. Каждый студент получает --messages сообщений подряд
+и ответ на callback, студенты обслуживаются параллельно, как в пуле потоков TeleBot.
+
+Запуск из корня репозитория:
+    python -m bench.outbound_flood --students 100 --messages 5
+"""
+import argparse
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from telebot import TeleBot, apihelper
+
+from bench.fake_telegram import FakeTelegramServer
+from bot.outbound import OutboundScheduler, ScheduledBot
+
+
+def run_student(api, student: int, messages: int) -> int:
+    """Возвращает число сообщений, которые так и не дошли"""
+    lost = 0
+    api.answer_callback_query(f"{student}-callback")
+    for i in range(messages):
+        try:
+            api.send_message(student, f"Сообщение {i + 1}")
+        except apihelper.ApiTelegramException:
+            lost += 1
+    return lost
+
+
+def run_mode(scheduled: bool, args) -> dict:
+    server = FakeTelegramServer(
+        latency=args.latency,
+        chat_limit=(args.chat_limit, 1.0),
+        global_limit=(args.global_limit, 1.0)
+    ).start()
+    apihelper.API_URL = server.api_url
+    api = TeleBot("123:fake", threaded=False)
+    scheduler = None
+    if scheduled:
+        scheduler = OutboundScheduler(
+            global_rate=args.global_limit * 0.9, chat_rate=1.0, chat_burst=args.chat_limit, workers=args.workers
+        )
+        scheduler.start()
+        api = ScheduledBot(api, scheduler)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.threads) as pool:
+        lost = sum(pool.map(lambda s: run_student(api, s, args.messages), range(1, args.students + 1)))
+    elapsed = time.perf_counter() - started
+    if scheduler is not None:
+        scheduler.close()
+    server.stop()
+    return {
+        "elapsed": elapsed,
+        "lost": lost,
+        "rejected": sum(server.rejected.values()),
+        "scheduler": scheduler.stats() if scheduler else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--students", type=int, default=100)
+    parser.add_argument("--messages", type=int, default=5, help="сообщений подряд каждому студенту")
+    parser.add_argument("--latency", type=float, default=0.02, help="задержка заглушки API на вызов, сек.")
+    parser.add_argument("--chat-limit", type=int, default=3, help="сообщений в чат за секунду")
+    parser.add_argument("--global-limit", type=int, default=30, help="сообщений боту за секунду")
+    parser.add_argument("--threads", type=int, default=16, help="потоков-обработчиков")
+    parser.add_argument("--workers", type=int, default=8, help="потоков отправки в планировщике")
+    args = parser.parse_args()
+
+    total = args.students * args.messages
+    for scheduled in (False, True):
+        result = run_mode(scheduled, args)
+        name = "scheduler" if scheduled else "direct"
+        print(f"{name:9} {total} сообщений: {result['elapsed']:.2f} с, "
+              f"потеряно {result['lost']}, ответов 429: {result['rejected']}")
+        if result["scheduler"]:
+            for lane, wait in result["scheduler"]["wait"].items():
+                if wait["count"]:
+                    print(f"          очередь {lane}: {wait['count']} вызовов, ожидание в среднем "
+                          f"{wait['seconds_avg'] * 1000:.0f} мс, максимум {wait['seconds_max'] * 1000:.0f} мс")
+            if result["lost"]:
+                # Без планировщика сообщения теряются ожидаемо, с ним - нет
+                sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""Стоимость маршрутизации одного апдейта: цепочка предикатов TeleBot против Router.
+
+Запуск из корня репозитория:
+    python -m bench.router_dispatch --updates 20000
+"""
+import argparse
+import time
+
+from telebot import TeleBot
+from telebot.types import Update
+
+from bench.fake_telegram import callback_update, text_update
+from bot.router import Router
+
+
+def noop(*args):
+    pass
+
+
+def linear_bot(handlers: int) -> TeleBot:
+    """Регистрация как раньше в FeedbackBot: по лямбде на каждую кнопку"""
+    bot = TeleBot("1:bench", threaded=False)
+    for i in range(handlers):
+        bot.message_handler(func=lambda m, text=f"button {i}": m.text == text)(noop)
+        bot.callback_query_handler(func=lambda c, prefix=f"action{i}": c.data.startswith(prefix))(noop)
+    return bot
+
+
+def router_bot(handlers: int) -> TeleBot:
+    bot = TeleBot("1:bench", threaded=False)
+    router = Router()
+    for i in range(handlers):
+        router.text(f"button {i}", noop)
+        router.action(f"action{i}", noop)
+    bot.message_handler()(router.dispatch_message)
+    bot.callback_query_handler(func=None)(router.dispatch_callback)
+    return bot
+
+
+def measure(bot: TeleBot, updates: list[Update]) -> float:
+    started = time.perf_counter()
+    bot.process_new_updates(updates)
+    return (time.perf_counter() - started) / len(updates) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--updates", type=int, default=20000)
+    args = parser.parse_args()
+
+    print(f"{'обработчиков':>12} {'предикаты, мкс':>15} {'Router, мкс':>12}")
+    for handlers in (5, 20, 100, 500):
+        # Худший случай для цепочки - последняя кнопка, плюс разбор игровых callback-данных
+        last = handlers - 1
+        updates = []
+        for i in range(args.updates // 2):
+            updates.append(Update.de_json(dict(update_id=2 * i, **text_update(i, f"button {last}"))))
+            updates.append(Update.de_json(dict(update_id=2 * i + 1, **callback_update(i, f"action{last}_3_2"))))
+        linear = measure(linear_bot(handlers), updates)
+        routed = measure(router_bot(handlers), updates)
+        print(f"{handlers:>12} {linear:>15.2f} {routed:>12.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+import contextvars
+import inspect
+
+
+class PendingCall:
+    """Исходящий вызов, записанный обработчиком в асинхронном режиме и ещё не выполненный"""
+
+    __slots__ = ("func", "args", "kwargs", "callbacks", "fallback")
+
+    def __init__(self, func, args, kwargs):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.callbacks = []
+        self.fallback = None
+
+    def then(self, callback):
+        """Регистрирует функцию, которая получит результат вызова после его выполнения"""
+        self.callbacks.append(callback)
+        return self
+
+    def catch(self, fallback):
+        """Регистрирует обработчик ошибки вызова.
+
+        fallback(ошибка) возвращает результат взамен (обычный или корутину) или бросает исключение сам.
+        """
+        self.fallback = fallback
+        return self
+
+    async def run(self):
+        try:
+            result = await _resolve(self.func(*self.args, **self.kwargs))
+        except Exception as e:
+            if self.fallback is None:
+                raise
+            result = await _resolve(self.fallback(e))
+        for callback in self.callbacks:
+            callback(result)
+        return result
+
+
+async def _resolve(result):
+    return await result if inspect.isawaitable(result) else result
+
+
+class CallRecorder:
+    """Подставляется в обработчики вместо TeleBot в асинхронном режиме.
+
+    Логика обработчиков синхронная и работает только с состоянием в памяти, поэтому
+    сам обработчик выполняется как есть, а его вызовы self.bot.send_* и т.п. записываются
+    и затем выполняются корутинами AsyncTeleBot строго в том же порядке.
+    """
+
+    def __init__(self, bot):
+        self._bot = bot
+        self._calls = contextvars.ContextVar("pending_calls")
+
+    def __getattr__(self, name):
+        method = getattr(self._bot, name)
+
+        def record(*args, **kwargs):
+            return self.defer(method, *args, **kwargs)
+
+        return record
+
+    def defer(self, func, *args, **kwargs) -> PendingCall:
+        """Откладывает произвольный вызов (обычный или корутину) до конца обработчика"""
+        try:
+            calls = self._calls.get()
+        except LookupError:
+            raise RuntimeError("Исходящий вызов вне обработчика в асинхронном режиме") from None
+        call = PendingCall(func, args, kwargs)
+        calls.append(call)
+        return call
+
+    async def run(self, handler, update):
+        calls = []
+        token = self._calls.set(calls)
+        try:
+            handler(update)
+        finally:
+            self._calls.reset(token)
+        for call in calls:
+            await call.run()
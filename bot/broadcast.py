@@ -0,0 +1,257 @@
+"""Рассылка сообщения всем студентам из таблицы students.
+
+Рассылки отправляет работающий бот: получатели читаются из базы страницами по id и уходят
+через его же OutboundScheduler с приоритетом рассылки, в общем лимите с ответами пользователям.
+Каждый получатель отмечается в broadcast_delivery до отправки, поэтому прерванная рассылка
+продолжается при следующем старте бота, и никто не получит сообщение дважды. Из консоли рассылку
+можно создать (бот подхватит её сам) и посмотреть её статус:
+    python -m bot.broadcast send "Игра начинается через 10 минут"
+    python -m bot.broadcast status 3
+"""
+import argparse
+import os
+import queue
+import sys
+import threading
+import time
+from concurrent.futures import Future
+from datetime import datetime
+
+from sqlalchemy import delete, func, select, update
+from telebot.apihelper import ApiTelegramException
+
+from bot.outbound import BULK, OutboundScheduler
+from db.models import Broadcast, BroadcastDelivery, Students
+
+BROADCAST_PAGE_SIZE = int(os.getenv("BROADCAST_PAGE_SIZE", "500"))
+# Как часто бот проверяет базу на рассылки, созданные из консоли или другим экземпляром, сек.
+BROADCAST_POLL_INTERVAL = float(os.getenv("BROADCAST_POLL_INTERVAL", "10"))
+
+
+class Broadcaster:
+    """Отправляет рассылку страницами получателей.
+
+    Пока планировщик отправляет одну страницу, следующая уже взята из базы и стоит в его очереди,
+    так что на границе страниц отправка не простаивает. Статусы доставки записываются одним
+    запросом на страницу. Получатели, оставшиеся в статусе sending после падения процесса,
+    при продолжении не отправляются повторно: дошло ли им сообщение, неизвестно.
+
+    watch(interval) запускает поток, который отправляет незавершённые рассылки из базы: поставленные
+    через request, созданные из консоли и прерванные остановкой бота. stop() снимает с очереди ещё
+    не отправленных получателей, и продолжение отправит им сообщение.
+    """
+
+    def __init__(self, database, bot, scheduler: OutboundScheduler, page_size: int = BROADCAST_PAGE_SIZE):
+        self.database = database
+        self.bot = bot
+        self.scheduler = scheduler
+        self.page_size = page_size
+        self.stopping = threading.Event()
+        self.wakeup = threading.Event()
+        self.requests = queue.SimpleQueue()  # (текст, чат, которому сообщить о ходе рассылки)
+        self.notify = {}  # id рассылки -> чат, которому сообщить о завершении
+        self.outstanding: list[Future] = []  # отправки текущей рассылки, ещё не записанные в базу
+        self.reports = {}  # id рассылки -> отчёт о последнем запуске
+        self.thread = None
+
+    def create(self, text: str) -> int:
+        with self.database.unit_of_work() as session:
+            broadcast = Broadcast(text=text)
+            session.add(broadcast)
+            session.flush()
+            return broadcast.id
+
+    def request(self, text: str, chat_id: int | None = None):
+        """Ставит рассылку потоку watch: обработчик команды не ждёт записи в базу"""
+        self.requests.put((text, chat_id))
+        self.wakeup.set()
+
+    def unfinished(self) -> list[int]:
+        with self.database.unit_of_work() as session:
+            return session.execute(
+                select(Broadcast.id).where(Broadcast.finished_at.is_(None)).order_by(Broadcast.id)
+            ).scalars().all()
+
+    def stop(self):
+        """Больше не брать новых получателей. Ещё не отправленные снимаются с очереди, уже отправленные записываются"""
+        self.stopping.set()
+        self.wakeup.set()
+        for future in self.outstanding:
+            future.cancel()
+
+    def watch(self, interval: float = BROADCAST_POLL_INTERVAL):
+        if self.thread is None:
+            self.stopping.clear()
+            self.thread = threading.Thread(target=self._watch, args=(interval,), name="broadcast", daemon=True)
+            self.thread.start()
+
+    def close(self):
+        self.stop()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def _watch(self, interval: float):
+        while not self.stopping.is_set():
+            self.wakeup.clear()
+            try:
+                self._create_requested()
+                for broadcast_id in self.unfinished():
+                    if self.stopping.is_set():
+                        break
+                    self._finished(broadcast_id, self.run(broadcast_id))
+            except Exception as e:
+                print(f"Ошибка рассылки: {e}")
+            self.wakeup.wait(interval)
+
+    def _create_requested(self):
+        while True:
+            try:
+                text, chat_id = self.requests.get_nowait()
+            except queue.Empty:
+                return
+            broadcast_id = self.create(text)
+            if chat_id is not None:
+                self.notify[broadcast_id] = chat_id
+                self._tell(chat_id, f"Рассылка {broadcast_id} запущена")
+
+    def _finished(self, broadcast_id: int, report: dict):
+        self.reports[broadcast_id] = report
+        print(f"Рассылка {broadcast_id} {'завершена' if report['finished'] else 'прервана'}: "
+              f"доставлено {report['sent']}, ошибок {report['failed']} за {report['seconds']:.1f} с "
+              f"({report['per_second']:.1f} сообщений в секунду)")
+        chat_id = self.notify.pop(broadcast_id, None) if report["finished"] else None
+        if chat_id is not None:
+            self._tell(chat_id, f"Рассылка {broadcast_id} завершена: доставлено {report['sent']}, "
+                                f"ошибок {report['failed']} (например, бот заблокирован)")
+
+    def _tell(self, chat_id: int, text: str):
+        self.scheduler.submit(self.bot.send_message, (chat_id, text), chat_id=chat_id)
+
+    def run(self, broadcast_id: int) -> dict:
+        """Отправляет рассылку всем, кого она ещё не касалась, и возвращает отчёт об этом запуске"""
+        with self.database.unit_of_work() as session:
+            broadcast = session.get(Broadcast, broadcast_id)
+            if broadcast is None:
+                raise ValueError(f"Рассылки {broadcast_id} нет")
+            text = broadcast.text
+
+        started = time.perf_counter()
+        result = {"sent": 0, "failed": 0, "cancelled": 0, "pages": 0}
+        after, in_flight = 0, []
+        while True:
+            claimed = [] if self.stopping.is_set() else self._claim(broadcast_id, after)
+            submitted = [
+                (student_id, self.scheduler.submit(
+                    self.bot.send_message, (student_id, text), chat_id=student_id, priority=BULK
+                ))
+                for student_id in claimed
+            ]
+            self.outstanding = [future for _, future in in_flight + submitted]
+            if self.stopping.is_set():
+                # stop() мог прийти, пока страница вставала в очередь
+                for future in self.outstanding:
+                    future.cancel()
+            if in_flight:
+                for status, count in self._record(broadcast_id, in_flight).items():
+                    result[status] += count
+            if not claimed:
+                break
+            after, in_flight = claimed[-1], submitted
+            result["pages"] += 1
+        self.outstanding = []
+
+        if not self.stopping.is_set():
+            with self.database.unit_of_work() as session:
+                session.execute(
+                    update(Broadcast).where(Broadcast.id == broadcast_id, Broadcast.finished_at.is_(None))
+                    .values(finished_at=func.now())
+                )
+        elapsed = time.perf_counter() - started
+        processed = result["sent"] + result["failed"]
+        return {
+            **result,
+            "broadcast": broadcast_id,
+            "finished": not self.stopping.is_set(),
+            "seconds": elapsed,
+            "per_second": processed / elapsed if elapsed else 0.0,
+        }
+
+    def status(self, broadcast_id: int) -> dict:
+        """Число получателей по статусам и сколько студентов рассылка ещё не коснулась"""
+        with self.database.unit_of_work() as session:
+            counts = dict(session.execute(
+                select(BroadcastDelivery.status, func.count())
+                .where(BroadcastDelivery.broadcast_id == broadcast_id)
+                .group_by(BroadcastDelivery.status)
+            ).all())
+            students = session.execute(select(func.count()).select_from(Students)).scalar()
+        return {**counts, "remaining": max(students - sum(counts.values()), 0)}
+
+    def _claim(self, broadcast_id: int, after: int) -> list[int]:
+        with self.database.unit_of_work() as session:
+            claimed = session.execute(
+                self.database.statements.claim_recipients,
+                {"broadcast_id": broadcast_id, "after": after, "limit": self.page_size}
+            ).scalars().all()
+        return sorted(claimed)
+
+    def _record(self, broadcast_id: int, in_flight: list) -> dict:
+        rows, counts, cancelled = [], {"sent": 0, "failed": 0, "cancelled": 0}, []
+        for student_id, future in in_flight:
+            if future.cancelled():
+                cancelled.append(student_id)
+                continue
+            try:
+                future.result()
+                status, error = "sent", None
+            except ApiTelegramException as e:
+                status, error = "failed", f"{e.error_code}: {e.description}"
+            except Exception as e:
+                status, error = "failed", str(e)
+            counts[status] += 1
+            rows.append({
+                "b_broadcast_id": broadcast_id,
+                "b_student_id": student_id,
+                "b_status": status,
+                "b_error": error,
+                "b_sent_at": datetime.now() if status == "sent" else None,
+            })
+        counts["cancelled"] = len(cancelled)
+        with self.database.unit_of_work() as session:
+            if rows:
+                session.execute(self.database.statements.record_deliveries, rows)
+            if cancelled:
+                # Сообщение не уходило: продолжение рассылки возьмёт этих получателей заново
+                session.execute(delete(BroadcastDelivery).where(
+                    BroadcastDelivery.broadcast_id == broadcast_id, BroadcastDelivery.student_id.in_(cancelled)
+                ))
+        return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Рассылка сообщения всем студентам")
+    commands = parser.add_subparsers(dest="command", required=True)
+    send = commands.add_parser("send", help="создать рассылку; её отправит работающий бот")
+    send.add_argument("text")
+    status = commands.add_parser("status", help="статусы доставки рассылки")
+    status.add_argument("broadcast_id", type=int)
+    args = parser.parse_args()
+
+    from db.database import db
+    from db.migrations import check_schema
+
+    if not check_schema(db):
+        sys.exit(1)
+    # Отправляет бот, поэтому здесь не нужны ни клиент Telegram, ни планировщик
+    broadcaster = Broadcaster(db, None, None)
+    if args.command == "status":
+        print(broadcaster.status(args.broadcast_id))
+        return
+    broadcast_id = broadcaster.create(args.text)
+    print(f"Рассылка {broadcast_id} создана: бот начнёт её в течение {BROADCAST_POLL_INTERVAL:g} с. "
+          f"Статус: python -m bot.broadcast status {broadcast_id}")
+
+
+if __name__ == "__main__":
+    main()
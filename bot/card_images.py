@@ -0,0 +1,181 @@
+"""Подготовка картинок игровых карточек.
+
+Карточки один раз при старте проверяются и пережимаются под Telegram: фото больше 1280 точек
+по длинной стороне Telegram всё равно уменьшает, а прозрачность не поддерживает, поэтому
+отправлять исходные PNG по 1-2 МБ незачем. Готовые байты хранятся в памяти, и отправка не
+обращается к файловой системе. Отчёт об экономии без запуска бота:
+    python -m bot.card_images
+"""
+import argparse
+import hashlib
+import io
+import os
+import threading
+from typing import NamedTuple
+
+from PIL import Image
+
+from bot.content import Content
+
+# Telegram хранит фото не больше 1280 точек по длинной стороне
+TELEGRAM_PHOTO_SIDE = 1280
+
+
+class CardImage(NamedTuple):
+    number: int
+    path: str
+    data: bytes  # то, что уходит в sendPhoto
+    digest: str  # sha256 data, ключ для кэша file_id
+    source_bytes: int
+    signature: tuple  # (mtime_ns, size) исходного файла на момент подготовки
+
+
+def compress(data: bytes, max_side: int = TELEGRAM_PHOTO_SIDE, quality: int = 85) -> bytes:
+    """JPEG не больше max_side по длинной стороне; прозрачность заливается белым.
+
+    Если исходник уже меньше и Telegram его не отвергнет, он и возвращается.
+    """
+    with Image.open(io.BytesIO(data)) as image:
+        image.load()
+        if image.mode in ("RGBA", "LA", "P"):
+            image = image.convert("RGBA")
+            flat = Image.new("RGB", image.size, (255, 255, 255))
+            flat.paste(image, mask=image.getchannel("A"))
+            image = flat
+        elif image.mode != "RGB":
+            image = image.convert("RGB")
+        source_fits = max(image.size) <= max_side
+        image.thumbnail((max_side, max_side), Image.LANCZOS)
+        out = io.BytesIO()
+        image.save(out, "JPEG", quality=quality, optimize=True, progressive=True)
+    compressed = out.getvalue()
+    return data if source_fits and len(data) <= len(compressed) else compressed
+
+
+class CardImages:
+    """Подготовленные картинки карточек колоды, по номеру карточки.
+
+    watch() раз в interval секунд сравнивает mtime и размер файлов и пересобирает только
+    изменившиеся карточки, так что замену картинок в смонтированной папке бот подхватывает
+    без перезапуска. Кэш file_id ключуется по sha256 готовых байт и тоже обновляется сам.
+    """
+
+    def __init__(self, directory: str, content: Content, max_side: int = TELEGRAM_PHOTO_SIDE, quality: int = 85):
+        self.directory = directory
+        self.content = content
+        self.max_side = max_side
+        self.quality = quality
+        self.cards: dict[int, CardImage] = {}
+        # номер карточки -> (mtime_ns, size) файла, который не удалось прочитать, или None, если файла нет
+        self.failed = {}
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = None
+        self.counters = {"loaded": 0, "reloads": 0, "failed": 0}
+
+    def get(self, number: int) -> CardImage | None:
+        return self.cards.get(number)
+
+    def load(self) -> list[int]:
+        """Готовит новые и изменившиеся карточки и возвращает их номера. Битые файлы пропускаются с сообщением"""
+        os.makedirs(self.directory, exist_ok=True)
+        cards, changed = dict(self.cards), []
+        for number in self.content.cards:
+            path = self.content.card_image(self.directory, number)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                if cards.pop(number, None) is not None:
+                    changed.append(number)
+                if self.failed.get(number, ()) is not None:
+                    print(f"Нет картинки карточки {number}: {path}")
+                self.failed[number] = None
+                continue
+            signature = (stat.st_mtime_ns, stat.st_size)
+            current = cards.get(number)
+            # Тот же файл уже подготовлен или уже не читался - не трогаем его до следующего изменения
+            if current is not None and current.path == path and current.signature == signature:
+                continue
+            if self.failed.get(number) == signature:
+                continue
+            try:
+                with open(path, "rb") as file:
+                    source = file.read()
+                data = compress(source, self.max_side, self.quality)
+            except (OSError, ValueError) as e:
+                # Оставляем прежнюю версию, если она была: полузаписанный файл не должен ломать игру
+                self.counters["failed"] += 1
+                self.failed[number] = signature
+                print(f"Не удалось подготовить картинку карточки {number} ({path}): {e}")
+                continue
+            cards[number] = CardImage(
+                number, path, data, hashlib.sha256(data).hexdigest(), len(source), signature
+            )
+            self.failed.pop(number, None)
+            changed.append(number)
+        with self.lock:
+            self.cards = cards
+            self.counters["loaded"] += len(changed)
+        return changed
+
+    def report(self) -> list[dict]:
+        return [
+            {"card": card.number, "source_bytes": card.source_bytes, "bytes": len(card.data),
+             "saved_bytes": card.source_bytes - len(card.data)}
+            for card in sorted(self.cards.values())
+        ]
+
+    def print_report(self, numbers: list[int] | None = None):
+        for row in self.report():
+            if numbers is None or row["card"] in numbers:
+                print(f"Карточка {row['card']}: {row['source_bytes']} -> {row['bytes']} байт, "
+                      f"сэкономлено {row['saved_bytes']} ({row['saved_bytes'] / max(row['source_bytes'], 1):.0%})")
+
+    def stats(self) -> dict:
+        with self.lock:
+            source = sum(card.source_bytes for card in self.cards.values())
+            ready = sum(len(card.data) for card in self.cards.values())
+            return {**self.counters, "cards": len(self.cards), "source_bytes": source, "bytes": ready}
+
+    def watch(self, interval: float):
+        if self.thread is None and interval > 0:
+            self.stopped.clear()
+            self.thread = threading.Thread(target=self._watch, args=(interval,), name="card-images", daemon=True)
+            self.thread.start()
+
+    def close(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def _watch(self, interval: float):
+        while not self.stopped.wait(interval):
+            try:
+                changed = self.load()
+            except Exception as e:
+                print(f"Ошибка перезагрузки картинок карточек: {e}")
+                continue
+            if changed:
+                self.counters["reloads"] += 1
+                print(f"Картинки карточек перезагружены: {changed}")
+                self.print_report(changed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Подготовка картинок карточек и отчёт об экономии")
+    parser.add_argument("--deck", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "deck.json"))
+    parser.add_argument("--dir", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "carts"))
+    parser.add_argument("--max-side", type=int, default=TELEGRAM_PHOTO_SIDE)
+    parser.add_argument("--quality", type=int, default=85)
+    args = parser.parse_args()
+
+    images = CardImages(args.dir, Content(args.deck), args.max_side, args.quality)
+    images.load()
+    images.print_report()
+    stats = images.stats()
+    print(f"Всего: {stats['source_bytes']} -> {stats['bytes']} байт")
+
+
+if __name__ == "__main__":
+    main()
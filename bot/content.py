@@ -0,0 +1,59 @@
+import json
+import os
+
+from telebot.types import InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMarkup
+
+MENU_FEEDBACK = "Обратная связь"
+MENU_GAME = "Игра"
+MENU_RESOURCES = "Цифровые ресурсы"
+MENU_HELP = "Помощь"
+
+
+def _inline(*rows: list[tuple[str, str]], row_width: int = 3) -> str:
+    keyboard = InlineKeyboardMarkup(row_width=row_width)
+    for row in rows:
+        keyboard.add(*(InlineKeyboardButton(text, callback_data=data) for text, data in row))
+    return keyboard.to_json()
+
+
+class Content:
+    """Игровая колода и все статические клавиатуры, подготовленные один раз при старте.
+
+    Колода (картинки, подписи кнопок, тексты заданий) читается из JSON-файла, поэтому её можно
+    править без изменения кода. Клавиатуры сразу сериализуются в готовый JSON, который TeleBot
+    передаёт в reply_markup как есть, без пересборки объектов на каждое сообщение.
+    """
+
+    def __init__(self, deck_path: str):
+        with open(deck_path, encoding="utf-8") as file:
+            deck = json.load(file)
+
+        self.cards = {card["number"]: card for card in deck["cards"]}
+        self.card_count = max(self.cards)
+        self.option_texts = {
+            (number, index): option["text"]
+            for number, card in self.cards.items()
+            for index, option in enumerate(card["options"], start=1)
+        }
+        self.card_keyboards = {
+            number: _inline(*(
+                [(option["label"], f"part_{number}_{index}")]
+                for index, option in enumerate(card["options"], start=1)
+            ))
+            for number, card in self.cards.items()
+        }
+        self.next_keyboards = {number: _inline([("Дальше →", f"next_{number}")]) for number in self.cards}
+
+        main_menu = ReplyKeyboardMarkup(resize_keyboard=True, row_width=2)
+        main_menu.add(MENU_FEEDBACK, MENU_GAME, MENU_RESOURCES, MENU_HELP)
+        self.main_menu = main_menu.to_json()
+        self.feedback_types = _inline([("Что понравилось", "liked")], [("Что можно добавить", "add")])
+        self.feedback_cancel = _inline([("Отмена", "cancel_feedback")])
+        self.feedback_more = _inline(
+            [("Что понравилось", "liked"), ("Что можно добавить", "add"), ("Завершить", "feedback_end")],
+            row_width=2
+        )
+
+    def card_image(self, carts_dir: str, number: int) -> str | None:
+        card = self.cards.get(number)
+        return os.path.join(carts_dir, card["image"]) if card else None
@@ -0,0 +1,115 @@
+import threading
+import time
+from collections import deque
+
+from telebot.types import CallbackQuery, Message
+
+
+def update_chat_id(update: Message | CallbackQuery) -> int | None:
+    """Чат, к которому относится апдейт; для callback без сообщения - пользователь"""
+    if isinstance(update, CallbackQuery):
+        return update.message.chat.id if update.message else update.from_user.id
+    chat = getattr(update, "chat", None)
+    return chat.id if chat else None
+
+
+class ChatExecutor:
+    """Пул потоков для обработчиков апдейтов с порядком внутри чата.
+
+    У каждого чата своя очередь, и её в каждый момент обрабатывает не больше одного потока:
+    апдейты одного чата выполняются строго по очереди (двойное нажатие на кнопку не гоняется
+    за состоянием), а разные чаты - параллельно. Поток берёт из очереди чата один апдейт и
+    возвращает чат в конец очереди готовых, поэтому медленный чат не задерживает остальные.
+    Если в обработке больше max_pending апдейтов, submit блокирует вызывающий поток (backpressure).
+    """
+
+    def __init__(self, workers: int = 16, max_pending: int = 10000):
+        self.workers = workers
+        self.mailboxes: dict[int | None, deque] = {}  # чат -> его апдейты, пока они есть или выполняются
+        self.ready = deque()  # чаты с апдейтами, которые сейчас никто не обрабатывает
+        self.condition = threading.Condition()
+        self.slots = threading.BoundedSemaphore(max_pending)
+        self.threads = []
+        self.stopping = False
+        self.counters = {"submitted": 0, "done": 0, "failed": 0}
+        self.latency = {
+            stage: {"count": 0, "seconds_total": 0.0, "seconds_max": 0.0} for stage in ("wait", "run")
+        }
+
+    def start(self):
+        if not self.threads:
+            self.stopping = False
+            self.threads = [
+                threading.Thread(target=self._run, name=f"handler-{i}", daemon=True) for i in range(self.workers)
+            ]
+            for thread in self.threads:
+                thread.start()
+
+    def close(self):
+        """Дорабатывает уже принятые апдейты и останавливает потоки"""
+        with self.condition:
+            self.stopping = True
+            self.condition.notify_all()
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+
+    def submit(self, chat_id: int | None, func, *args):
+        self.slots.acquire()
+        with self.condition:
+            self.counters["submitted"] += 1
+            mailbox = self.mailboxes.get(chat_id)
+            if mailbox is None:
+                mailbox = self.mailboxes[chat_id] = deque()
+                self.ready.append(chat_id)
+                self.condition.notify()
+            mailbox.append((func, args, time.monotonic()))
+
+    def stats(self) -> dict:
+        with self.condition:
+            stats = dict(self.counters)
+            stats["queue_depth"] = sum(len(mailbox) for mailbox in self.mailboxes.values())
+            stats["chats"] = len(self.mailboxes)
+            stats["latency"] = {
+                stage: dict(values, seconds_avg=values["seconds_total"] / values["count"] if values["count"] else 0.0)
+                for stage, values in self.latency.items()
+            }
+        return stats
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while not self.ready:
+                    if self.stopping and not self.mailboxes:
+                        return
+                    self.condition.wait()
+                chat_id = self.ready.popleft()
+                func, args, enqueued_at = self.mailboxes[chat_id].popleft()
+
+            started = time.monotonic()
+            failed = False
+            try:
+                func(*args)
+            except Exception as e:
+                failed = True
+                print(f"Ошибка обработки апдейта чата {chat_id}: {e}")
+            finished = time.monotonic()
+            self.slots.release()
+
+            with self.condition:
+                self.counters["failed" if failed else "done"] += 1
+                self._record("wait", started - enqueued_at)
+                self._record("run", finished - started)
+                if self.mailboxes[chat_id]:
+                    self.ready.append(chat_id)
+                    self.condition.notify()
+                else:
+                    del self.mailboxes[chat_id]
+                    if self.stopping and not self.mailboxes:
+                        self.condition.notify_all()
+
+    def _record(self, stage: str, seconds: float):
+        values = self.latency[stage]
+        values["count"] += 1
+        values["seconds_total"] += seconds
+        values["seconds_max"] = max(values["seconds_max"], seconds)
@@ -1,21 +1,92 @@
+import asyncio
+import html
 import os
+import signal
+import sys
 from abc import ABC, abstractmethod
-from collections import defaultdict
-from telebot import TeleBot
+from typing import Callable
+from telebot import TeleBot, util
 from dotenv import load_dotenv
-from telebot.types import (
-    ReplyKeyboardMarkup,
-    Message,
-    CallbackQuery,
-    InlineKeyboardMarkup,
-    InlineKeyboardButton
+from telebot.types import Message, CallbackQuery
+
+from bot.async_runtime import CallRecorder
+from bot.broadcast import BROADCAST_POLL_INTERVAL, Broadcaster
+from bot.card_images import TELEGRAM_PHOTO_SIDE, CardImages
+from bot.executor import ChatExecutor, update_chat_id
+from bot.content import Content, MENU_FEEDBACK, MENU_GAME, MENU_HELP, MENU_RESOURCES
+from bot.media_cache import MediaCache
+from bot.metrics import (
+    FEEDBACK_ERRORS, REGISTRY, SlowUpdateProfiler, instrument_db, instrument_handler, instrument_update, label_handler,
+    serve as serve_metrics
 )
-
-from db.database import db
-from db.models import Feedback, Students
+from bot.outbound import OutboundScheduler, ScheduledBot
+from bot.router import CallbackPayload, Router, parse_callback
+from bot.state import MemoryStateStore, PostgresStateStore, StateStore
+from db.database import db, DB_URL, AsyncDatabase
+from db.dedup import DuplicateIndex
+from db.feedback_writer import FeedbackWriter, AsyncFeedbackWriter
+from db.journal import UpdateJournal
+from db.migrations import check_schema, migrate
+from db.rollup import Rollup
 
 load_dotenv()
 TOKEN = os.getenv("TOKEN")
+# polling - TeleBot с пулом потоков, async - AsyncTeleBot и асинхронный движок БД
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+# polling - long polling через getUpdates, webhook - FastAPI-сервер, принимающий апдейты от Telegram
+UPDATE_SOURCE = os.getenv("UPDATE_SOURCE", "polling")
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", "16"))
+DECK_PATH = os.getenv("DECK_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "deck.json"))
+MEDIA_CACHE_PATH = os.getenv(
+    "MEDIA_CACHE_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "media_cache.json")
+)
+# Картинки карточек: пережимаются при старте и хранятся в памяти; папку можно смонтировать томом
+CARDS_DIR = os.getenv("CARDS_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "carts"))
+CARD_MAX_SIDE = int(os.getenv("CARD_MAX_SIDE", str(TELEGRAM_PHOTO_SIDE)))
+CARD_JPEG_QUALITY = int(os.getenv("CARD_JPEG_QUALITY", "85"))
+# Как часто проверять папку карточек на изменения, сек. (0 - не следить)
+CARDS_WATCH_INTERVAL = float(os.getenv("CARDS_WATCH_INTERVAL", "10"))
+FEEDBACK_BATCH_SIZE = int(os.getenv("FEEDBACK_BATCH_SIZE", "100"))
+FEEDBACK_FLUSH_INTERVAL = float(os.getenv("FEEDBACK_FLUSH_INTERVAL", "0.5"))
+FEEDBACK_QUEUE_SIZE = int(os.getenv("FEEDBACK_QUEUE_SIZE", "10000"))
+FEEDBACK_KNOWN_STUDENTS = int(os.getenv("FEEDBACK_KNOWN_STUDENTS", "10000"))
+# Повторы обратной связи одного студента в одной категории: flag - сохранять с пометкой duplicate_of,
+# collapse - не сохранять, off - не искать. Порог сходства, окно (сек.) и размер индекса в памяти
+FEEDBACK_DEDUP = os.getenv("FEEDBACK_DEDUP", "flag")
+FEEDBACK_DEDUP_THRESHOLD = float(os.getenv("FEEDBACK_DEDUP_THRESHOLD", "0.7"))
+FEEDBACK_DEDUP_WINDOW = float(os.getenv("FEEDBACK_DEDUP_WINDOW", str(24 * 60 * 60)))
+FEEDBACK_DEDUP_MAX_ENTRIES = int(os.getenv("FEEDBACK_DEDUP_MAX_ENTRIES", "20000"))
+# Журнал принятой, но ещё не сохранённой обратной связи; пустое значение отключает журнал
+JOURNAL_DIR = os.getenv("JOURNAL_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "journal"))
+JOURNAL_FSYNC_BATCH = int(os.getenv("JOURNAL_FSYNC_BATCH", "64"))
+JOURNAL_FSYNC_INTERVAL = float(os.getenv("JOURNAL_FSYNC_INTERVAL", "0.05"))
+# Telegram id администраторов через запятую: им доступны команды /stats и /broadcast
+ADMIN_IDS = {int(admin) for admin in os.getenv("ADMIN_IDS", "").split(",") if admin.strip()}
+# Как часто перечитывать счётчики из feedback_rollup, сек. (записи других экземпляров бота; 0 - не перечитывать)
+ROLLUP_REFRESH_INTERVAL = float(os.getenv("ROLLUP_REFRESH_INTERVAL", "60"))
+# memory - состояние в памяти процесса, postgres - общее для всех воркеров в таблице bot_state
+STATE_BACKEND = os.getenv("STATE_BACKEND", "memory")
+STATE_TTL = float(os.getenv("STATE_TTL", str(6 * 60 * 60)))
+# Флуд-лимиты Telegram: около 30 сообщений в секунду на бота и 1 в секунду на чат
+OUTBOUND_GLOBAL_RATE = float(os.getenv("OUTBOUND_GLOBAL_RATE", "30"))
+OUTBOUND_GLOBAL_BURST = float(os.getenv("OUTBOUND_GLOBAL_BURST", "5"))
+OUTBOUND_CHAT_RATE = float(os.getenv("OUTBOUND_CHAT_RATE", "1"))
+OUTBOUND_CHAT_BURST = float(os.getenv("OUTBOUND_CHAT_BURST", "3"))
+OUTBOUND_WORKERS = int(os.getenv("OUTBOUND_WORKERS", "8"))
+# Потоки обработчиков: апдейты одного чата выполняются по очереди, разных чатов - параллельно
+HANDLER_WORKERS = int(os.getenv("HANDLER_WORKERS", "16"))
+HANDLER_QUEUE_SIZE = int(os.getenv("HANDLER_QUEUE_SIZE", "10000"))
+# Порт GET /metrics в режиме long polling (0 - не поднимать); в режиме вебхука метрики на том же сервере
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+# Апдейты дольше стольких секунд профилируются семплированием стеков (0 - профилировщик выключен)
+SLOW_UPDATE_SECONDS = float(os.getenv("SLOW_UPDATE_SECONDS", "0"))
+# auto - при старте применить недостающие миграции, check - не запускаться на устаревшей схеме, off - не проверять
+DB_MIGRATE = os.getenv("DB_MIGRATE", "auto")
 
 
 class BotHandler(ABC):
@@ -25,31 +96,35 @@ class BotHandler(ABC):
 
 
 class StartHandler(BotHandler):
-    def __init__(self, bot: TeleBot):
+    def __init__(self, bot: TeleBot, media: MediaCache, content: Content):
         self.bot = bot
+        self.media = media
+        self.content = content
 
     def handle(self, message: Message):
         image_url = "https://disk.yandex.ru/i/7MNk0dTd9YzMUQ"
-        self.bot.send_photo(
+        self.media.send_photo(
             message.chat.id,
             image_url,
             caption="<b>Уважаемый студент! Я <s>бот</s> кот для сбора обратной связи.</b>\n"
                     "<b>Для того, чтобы поделиться тем, что тебе понравилось и/или ты хотел бы добавить, "
                     "нажми кнопку ниже.</b>",
             parse_mode="HTML",
-            reply_markup=FeedbackBot.markup_main()
+            reply_markup=self.content.main_menu
         )
 
 
 class FeedbackHandler(BotHandler):
-    def __init__(self, bot: TeleBot):
+    def __init__(self, bot: TeleBot, content: Content):
         self.bot = bot
+        self.content = content
 
     def handle(self, message: Message):
-        keyboard = InlineKeyboardMarkup()
-        keyboard.add(InlineKeyboardButton("Что понравилось", callback_data="liked"))
-        keyboard.add(InlineKeyboardButton("Что можно добавить", callback_data="add"))
-        self.bot.send_message(message.chat.id, "Выберите тип обратной связи:", reply_markup=keyboard)
+        self.bot.send_message(
+            message.chat.id,
+            "Выберите тип обратной связи:",
+            reply_markup=self.content.feedback_types
+        )
 
 
 class HelpHandler(BotHandler):
@@ -75,8 +150,9 @@ class HelpHandler(BotHandler):
 
 
 class ResourcesHandler(BotHandler):
-    def __init__(self, bot: TeleBot):
+    def __init__(self, bot: TeleBot, media: MediaCache):
         self.bot = bot
+        self.media = media
 
     def handle(self, message: Message):
         image_url = "https://disk.yandex.ru/i/gqOpER4MIq1pwA"
@@ -102,345 +178,575 @@ class ResourcesHandler(BotHandler):
         объединений</b>
         👉 <a href="https://www.herzen.spb.ru/about/struct-uni/contr/dep-edu-pract-youth-projects/atlas-studencheskikh-obedineniy/">Смотреть атлас</a>
         """
-        self.bot.send_photo(message.chat.id, image_url, caption=caption, parse_mode="HTML")
+        self.media.send_photo(message.chat.id, image_url, caption=caption, parse_mode="HTML")
+
+
+class StatsHandler(BotHandler):
+    """Сводка для администраторов из счётчиков в памяти: время ответа не зависит от объёма feedback"""
+
+    CATEGORIES = {"liked": "Что понравилось", "add": "Что можно добавить"}
+
+    def __init__(self, bot: TeleBot, rollup: Rollup, content: Content, admins: set[int]):
+        self.bot = bot
+        self.rollup = rollup
+        self.content = content
+        self.admins = admins
+
+    def handle(self, message: Message):
+        if message.from_user.id not in self.admins:
+            return
+        self.bot.send_message(message.chat.id, self.render(self.rollup.summary()), parse_mode="HTML")
+
+    def render(self, summary: dict) -> str:
+        total, today, recent = summary["total"], summary["today"], summary["recent"]
+
+        def feedback(counts, kind: str = "feedback") -> int:
+            return sum(count for (k, _), count in counts.items() if k == kind)
+
+        lines = [
+            "<b>Обратная связь</b>",
+            f"Всего: {feedback(total)}, из них повторов: {feedback(total, 'duplicate')}",
+            *(f"{label}: {total[('feedback', category)]}" for category, label in self.CATEGORIES.items()),
+            f"Сегодня: {feedback(today)}, за 7 дней: {feedback(recent)}",
+            "",
+            "<b>Самые популярные варианты в игре</b>",
+        ]
+        for number, card in sorted(self.content.cards.items()):
+            choices = [total[("choice", f"{number}:{index}")] for index in range(1, len(card["options"]) + 1)]
+            chosen = sum(choices)
+            if not chosen:
+                lines.append(f"Карточка {number}: выборов нет")
+                continue
+            best = max(range(len(choices)), key=choices.__getitem__)
+            lines.append(
+                f"Карточка {number}: {html.escape(card['options'][best]['label'])} - {choices[best]} из {chosen} "
+                f"({choices[best] / chosen:.0%})"
+            )
+        return "\n".join(lines)
+
+
+class BroadcastHandler(BotHandler):
+    """/broadcast <текст> от администратора: рассылка всем студентам через общий планировщик отправки"""
+
+    def __init__(self, bot: TeleBot, broadcaster: Broadcaster, admins: set[int]):
+        self.bot = bot
+        self.broadcaster = broadcaster
+        self.admins = admins
+
+    def handle(self, message: Message):
+        if message.from_user.id not in self.admins:
+            return
+        text = util.extract_arguments(message.text or "")
+        if not text:
+            self.bot.send_message(message.chat.id, "Напишите текст рассылки после команды: /broadcast <текст>")
+            return
+        # Запись в базу и отправка - в потоке рассылок, о ходе рассылки он сообщит в этот чат
+        self.broadcaster.request(text, message.chat.id)
 
 
 class FeedbackCallbackHandler(BotHandler):
-    def __init__(self, bot: TeleBot):
+    def __init__(self, bot: TeleBot, states: StateStore, content: Content):
         self.bot = bot
-        self.states = defaultdict(dict)
+        self.states = states
+        self.content = content
 
-    def handle(self, call: CallbackQuery):
+    def get_state(self, chat_id: int) -> dict | None:
+        return self.states.get(f"feedback:{chat_id}")
+
+    def clear_state(self, chat_id: int):
+        self.states.delete(f"feedback:{chat_id}")
+
+    def handle(self, call: CallbackQuery, payload: CallbackPayload | None = None):
         chat_id = call.message.chat.id
         data = call.data
 
         if data in ("liked", "add"):
             self.bot.answer_callback_query(call.id)
-            self.states[chat_id] = {"state": "waiting_feedback", "type": data}
+            self.states.set(f"feedback:{chat_id}", {"state": "waiting_feedback", "type": data})
             self.bot.send_message(
                 chat_id,
                 "Напишите вашу обратную связь:",
-                reply_markup=InlineKeyboardMarkup().add(
-                    InlineKeyboardButton("Отмена", callback_data="cancel_feedback")
-                )
+                reply_markup=self.content.feedback_cancel
             )
 
         elif data == "cancel_feedback":
             self.bot.answer_callback_query(call.id)
-            if chat_id in self.states:
-                del self.states[chat_id]
+            self.clear_state(chat_id)
             self.bot.send_message(
                 chat_id,
                 "Отмена отправки сообщения",
-                reply_markup=FeedbackBot.markup_main()
+                reply_markup=self.content.main_menu
             )
 
         elif data == "feedback_end":
             self.bot.answer_callback_query(call.id, "Спасибо за участие!")
-            if chat_id in self.states:
-                del self.states[chat_id]
+            self.clear_state(chat_id)
             self.bot.send_message(chat_id, "Обратная связь завершена. Если хотите, можете продолжить игру.")
 
 
 class BotGame:
-    def __init__(self, bot: TeleBot):
+    def __init__(self, bot: TeleBot, media: MediaCache, content: Content, cards: CardImages):
         self.bot = bot
-        self.selected_parts = defaultdict(lambda: defaultdict(int))
-        self.button_names = {
-            1: ["1.1 Преодолевая преграды", "1.2 Действие - мой инструмент", "1.3 Сила маленьких шагов"],
-            2: ["2.1 Ресурсы внутри меня", "2.2 Используя каждый момент", "2.3 Возможности общения"],
-            3: ["3.1 Социальное восприятие", "3.2 Принятие в группе", "3.3 Значимые отношения"],
-            4: ["4.1 Общение с группой", "4.2 Социальная батарейка", "4.3 Тёплый круг общения"],
-            5: ["5.1 Личные границы", "5.2 Как сказать НЕТ", "5.3 Чужие ожидания"],
-            6: ["6.1 Новый город - новые возможности", "6.2 Вопросы быта", "6.3 Зов родного края"],
-            7: ["7.1 Культурный шок", "7.2 В поиске новых друзей", "7.3 Связь с культурой"],
-            8: ["8.1 Экзаменационный стресс", "8.2 Новые вызовы учёбы", "8.3 Слишком много информации"],
-            9: ["9.1 Новые смыслы", "9.2 В поисках баланса", "9.3 Принятие"],
-        }
-
-        # Абсолютный путь к папке с картинками
-        self.carts_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "carts")
-        if not os.path.exists(self.carts_dir):
-            os.makedirs(self.carts_dir)
+        self.media = media
+        self.content = content
+        self.cards = cards
 
     def handle(self, message: Message):
         self.send_image(message.chat.id, 1)
 
     def send_image(self, chat_id: int, image_number: int):
-        image_path = os.path.join(self.carts_dir, f"{image_number}.png")
-        if not os.path.exists(image_path):
+        # Картинка уже подготовлена в памяти: ни проверки файла, ни чтения с диска
+        card = self.cards.get(image_number)
+        if card is None:
             self.bot.send_message(chat_id, "Изображение временно недоступно")
             return
 
-        keyboard = InlineKeyboardMarkup()
-        buttons = [
-            InlineKeyboardButton(
-                text=self.button_names[image_number][i],
-                callback_data=f"part_{image_number}_{i + 1}"
-            ) for i in range(3)
-        ]
-        for button in buttons:
-            keyboard.add(button)
-
-
-        with open(image_path, "rb") as cart:
-            self.bot.send_photo(chat_id, cart, reply_markup=keyboard)
+        self.media.send_bytes(
+            chat_id, f"card:{image_number}", card.data, card.digest,
+            reply_markup=self.content.card_keyboards[image_number]
+        )
 
 
 class GameCallbackHandler:
-    def __init__(self, bot: TeleBot, game_handler: BotGame):
+    def __init__(self, bot: TeleBot, game_handler: BotGame, states: StateStore, content: Content,
+                 save_choice: Callable[[CallbackQuery, int, int], None]):
         self.bot = bot
         self.game_handler = game_handler
-        self.selected_parts = defaultdict(lambda: defaultdict(int))
-
-        self.part_texts = {
-            1: {
-                1: """<b>Вопросы:</b>
-    • Что самое сложное вы преодолели за последний год?
-    • Какие уроки вы извлекли из этого опыта?
-
-    <b>Задание:</b> Нарисуйте или напишите, как вы видите свой путь к цели, несмотря на преграды.""",
-                2: """<b>Упражнение:</b> Выберите одну задачу, которая вызывает у вас сомнения. 
-    Сформулируйте её в виде первого конкретного шага и выполните его.
-
-    <b>Совет:</b> Начните с малого, но начинайте. Это откроет дорогу большим успехам.""",
-                3: """<b>Упражнение:</b> Разделите сложную задачу на три небольших шага и выполните их поэтапно.
-
-    <b>Совет:</b> Не перегружайте себя сразу. Делайте маленькие, но уверенные шаги."""
-            },
-            2: {
-                1: """<b>Упражнение:</b> Составьте список из 5 своих качеств, которые помогают вам справляться с трудностями.
-
-    <b>Совет:</b> Напоминайте себе о своих сильных сторонах каждый раз, когда сталкиваетесь с вызовом.""",
-                2: """<b>Упражнение:</b> Напишите три возможности, которые у вас есть прямо сейчас. 
-    Какие шаги вы можете предпринять, чтобы их реализовать?
-
-    <b>Совет:</b> Искать возможности полезно даже в простых повседневных делах.""",
-                3: """<b>Упражнение:</b> Позвоните или напишите человеку, который может поддержать вас или дать совет. 
-    Что нового вы можете узнать от него?
-
-    <b>Совет:</b> Общение открывает неожиданные перспективы."""
-            },
-            3: {
-                1: """<b>Задание:</b> Напишите, как вы воспринимаете чужое мнение о себе. 
-    • Что помогает вам оставаться уверенным в себе, несмотря на внешние воздействия?""",
-                2: """<b>Задание:</b> Вспомните, когда вы почувствовали поддержку и принятие 
-    со стороны одногруппников или преподавателей. 
-    Как это повлияло на вашу уверенность в своих силах? 
-    Как вы можете создать атмосферу принятия для других людей в группе?""",
-                3: """<b>Вопрос:</b> Кто в вашей жизни влияет на ваши решения?
-    <b>Задание:</b> Напишите о трех людях, чье мнение для вас наиболее значимо. 
-    Что именно в их словах или действиях помогает вам чувствовать себя уверенно?"""
-            },
-            4: {
-                1: """<b>Задание:</b> Подумайте о своем последнем взаимодействии с кем-то из группы. 
-    Были ли вы довольны общением? 
-    Что можно улучшить в вашем взаимодействии, чтобы почувствовать большую удовлетворенность?""",
-                2: """<b>Задание:</b> Оцените свою «социальную батарейку» от 0 до 10.
-    После каждой ситуации взаимодействия подумайте, заряжает она вас или разряжает.
-    Какие взаимодействия помогают вам «зарядиться»?""",
-                3: """<b>Задание:</b> Напишите анонимно комплименты или добрые слова для трех человек из группы. 
-    Передайте их, и обсудите, как такие жесты влияют на атмосферу.
-
-    <b>Вопросы:</b> Когда вы в последний раз слышали искреннюю похвалу в свой адрес? 
-    Как это на вас повлияло?"""
-            },
-            5: {
-                1: """<b>Задание:</b> Напишите, как вы определяете свои личные границы в отношениях с другими людьми. 
-    Какие фразы или действия помогают вам устанавливать эти границы и защищаться от манипуляций?""",
-                2: """<b>Задание:</b> Представьте ситуацию, когда одногруппник или друг просит вас сделать что-то, 
-    что вам неудобно. Сыграйте диалог, где вы вежливо, но твердо отказываете.
-
-    <b>Вопрос:</b> Что для вас сложнее: говорить “нет” близким людям или одногруппникам? Почему?""",
-                3: """<b>Задание:</b> Напишите три ожидания, которые вы чувствуете от окружающих. 
-    Решите, какие из них соответствуют вашим ценностям, а какие — нет.
-
-    <b>Вопрос:</b> Как вы справляетесь с ситуациями, когда ожидания окружающих не совпадают 
-    с вашими желаниями?"""
-            },
-            6: {
-                1: """<b>Задание:</b> Поделитесь, какие трудности могут возникнуть при переезде для учёбы. 
-    Обсудите, как можно быстрее освоиться в новом месте.
-
-    <b>Вопрос:</b> Какие шаги помогут вам адаптироваться к жизни в незнакомом городе?""",
-                2: """<b>Задание:</b> Подумайте, что сложнее всего в самостоятельной жизни. 
-    Какие лайфхаки помогают вам быстрее обустроиться в новом месте?""",
-                3: """<b>Задание:</b> Поделитесь способами, которые помогают вам справляться с ностальгией.
-
-    <b>Вопрос:</b> Какие новые привычки могут помочь быстрее адаптироваться в новом месте?"""
-            },
-            7: {
-                1: """<b>Задание:</b> Вспомните случай, когда вы столкнулись с культурными различиями. 
-    Как вы справились с этой ситуацией?
-
-    <b>Вопрос:</b> Как можно наладить общение с представителями других культур?""",
-                2: """<b>Задание:</b> Поделитесь своими способами заведения знакомств в новой среде. 
-    Какие темы лучше не поднимать в начале общения?
-
-    <b>Вопрос:</b> Как легко и естественно влиться в новую компанию?""",
-                3: """<b>Задание:</b> Напишите, какие способы помогают сохранять связь со своими традициями
-    и родным языком в новой среде.
-
-    <b>Вопрос:</b> Как можно интегрироваться в новую культуру, не теряя связи с родной?"""
-            },
-            8: {
-                1: """<b>Задание:</b> Поделитесь своими методами борьбы с тревогой перед экзаменами. 
-    Что помогает вам сохранять спокойствие?""",
-                2: """<b>Задание:</b> Вспомните ситуацию, когда вы не понимали задание или требования. Как вы нашли выход?
-
-    <b>Вопрос:</b> Что делать, если задание кажется непонятным или слишком сложным?""",
-                3: """<b>Задание:</b> Обсудите, как можно быстрее разбираться в больших объёмах информации.
-
-    <b>Вопрос:</b> Что помогает вам справляться с информационной перегрузкой?"""
-            },
-            9: {
-                1: """<b>Задание:</b> Вспомните моменты, когда вы теряли мотивацию. Как вы справлялись с этим?
-
-    <b>Вопрос:</b> Что делать, если пропало желание учиться?""",
-                2: """<b>Задание:</b> Поделитесь своими методами организации времени. Какие привычки помогают вам всё успевать?
-
-    <b>Вопрос:</b> Как правильно расставлять приоритеты и не перегружать себя?""",
-                3: """<b>Задание:</b> Вспомните случаи, когда вам было сложно объяснить родителям свою точку зрения. 
-    Как вы с этим справились?
-
-    <b>Вопрос:</b> Как построить конструктивный диалог с родителями?"""
-            }
-        }
-
-    def handle(self, call: CallbackQuery):
-        data = call.data.split("_")
-        action = data[0]
+        # Выбранные части карточек: "game:<chat_id>" -> {"<номер картинки>": <номер части>}
+        self.states = states
+        self.content = content
+        # Выбор сохраняется событием в game_choice, из которого считается популярность вариантов
+        self.save_choice = save_choice
+
+    def handle(self, call: CallbackQuery, payload: CallbackPayload | None = None):
+        payload = payload or parse_callback(call.data)
         chat_id = call.message.chat.id
 
-        if action == "part":
-            image_number = int(data[1])
-            part_number = int(data[2])
+        if payload.action == "part":
+            image_number = payload.image
+            part_number = payload.option
 
-            if self.selected_parts[chat_id][image_number] != 0:
+            selected_parts = self.states.get(f"game:{chat_id}") or {}
+            if selected_parts.get(str(image_number)):
                 self.bot.answer_callback_query(call.id, "Вы уже выбрали картинку!")
                 return
 
-            self.selected_parts[chat_id][image_number] = part_number
+            self.states.set(f"game:{chat_id}", {**selected_parts, str(image_number): part_number})
+            self.save_choice(call, image_number, part_number)
             self.bot.send_message(
                 chat_id,
-                self.part_texts.get(image_number, {}).get(part_number, "Информация отсутствует."),
+                self.content.option_texts.get((image_number, part_number), "Информация отсутствует."),
                 parse_mode='HTML'
             )
             self.send_next_button(chat_id, image_number)
 
-        elif action == "next":
-            image_number = int(data[1])
+        elif payload.action == "next":
+            image_number = payload.image
 
-            if image_number < 9:
+            if image_number < self.content.card_count:
                 self.game_handler.send_image(chat_id, image_number + 1)
             else:
                 self.bot.send_message(chat_id, "🎉 Вы завершили игру! Нажмите на 'Обратная связь' и поделитесь ею.")
-                self.selected_parts[chat_id].clear()
+                self.states.delete(f"game:{chat_id}")
 
         self.bot.answer_callback_query(call.id)
 
     def send_next_button(self, chat_id: int, image_number: int):
-        keyboard = InlineKeyboardMarkup()
-        keyboard.add(InlineKeyboardButton("Дальше →", callback_data=f"next_{image_number}"))
-        self.bot.send_message(chat_id, "Продолжить игру!", reply_markup=keyboard)
+        self.bot.send_message(chat_id, "Продолжить игру!", reply_markup=self.content.next_keyboards.get(image_number))
 
 
 class FeedbackBot:
     def __init__(self, token: str):
-        self.bot = TeleBot(token)
-        self.game_handler = BotGame(self.bot)
+        self.bot = self.create_bot(token)
+        self.executor = self.create_executor()
+        self.scheduler = OutboundScheduler(
+            global_rate=OUTBOUND_GLOBAL_RATE,
+            global_burst=OUTBOUND_GLOBAL_BURST,
+            chat_rate=OUTBOUND_CHAT_RATE,
+            chat_burst=OUTBOUND_CHAT_BURST,
+            workers=OUTBOUND_WORKERS
+        )
+        # Объект, через который обработчики ходят в Telegram API
+        self.api = self.create_api()
+        self.content = Content(DECK_PATH)
+        self.rollup = Rollup(db)
+        self.feedback_writer = self.create_feedback_writer()
+        self.states = self.create_state_store()
+        self.media = MediaCache(self.api, MEDIA_CACHE_PATH)
+        # Рассылки идут через тот же планировщик, что и ответы: один общий лимит, ответы - в приоритете
+        self.broadcaster = Broadcaster(db, self.create_sender(token), self.scheduler)
+        self.cards = CardImages(CARDS_DIR, self.content, max_side=CARD_MAX_SIDE, quality=CARD_JPEG_QUALITY)
+        self.game_handler = BotGame(self.api, self.media, self.content, self.cards)
         self.handlers = {
-            "start": StartHandler(self.bot),
-            "feedback": FeedbackHandler(self.bot),
-            "help": HelpHandler(self.bot),
-            "resources": ResourcesHandler(self.bot),
-            "feedback_callback": FeedbackCallbackHandler(self.bot),
+            "start": StartHandler(self.api, self.media, self.content),
+            "feedback": FeedbackHandler(self.api, self.content),
+            "help": HelpHandler(self.api),
+            "resources": ResourcesHandler(self.api, self.media),
+            "feedback_callback": FeedbackCallbackHandler(self.api, self.states, self.content),
             "game": self.game_handler,
-            "game_callback": GameCallbackHandler(self.bot, self.game_handler),
+            "game_callback": GameCallbackHandler(
+                self.api, self.game_handler, self.states, self.content, self.save_choice
+            ),
+            "stats": StatsHandler(self.api, self.rollup, self.content, ADMIN_IDS),
+            "broadcast": BroadcastHandler(self.api, self.broadcaster, ADMIN_IDS),
         }
+        self.profiler = SlowUpdateProfiler(SLOW_UPDATE_SECONDS) if SLOW_UPDATE_SECONDS > 0 else None
         self.register_handlers()
+        self.register_metrics()
+
+    def create_bot(self, token: str):
+        # Собственный пул TeleBot не гарантирует порядок внутри чата, обработчики выполняет ChatExecutor
+        return TeleBot(token, threaded=False)
+
+    def create_sender(self, token: str):
+        """Синхронный клиент, которым потоки планировщика отправляют рассылки"""
+        return self.bot
+
+    def create_executor(self) -> ChatExecutor | None:
+        return ChatExecutor(workers=HANDLER_WORKERS, max_pending=HANDLER_QUEUE_SIZE)
+
+    def create_api(self):
+        return ScheduledBot(self.bot, self.scheduler)
+
+    def create_feedback_writer(self):
+        return FeedbackWriter(
+            db,
+            batch_size=FEEDBACK_BATCH_SIZE,
+            flush_interval=FEEDBACK_FLUSH_INTERVAL,
+            max_queue=FEEDBACK_QUEUE_SIZE,
+            known_students=FEEDBACK_KNOWN_STUDENTS,
+            journal=self.create_journal(),
+            dedup=self.create_dedup(),
+            collapse_duplicates=FEEDBACK_DEDUP == "collapse",
+            rollup=self.rollup
+        )
 
-    def register_handlers(self):
-        self.bot.message_handler(commands=['start'])(lambda msg: self.handlers["start"].handle(msg))
+    def create_dedup(self) -> DuplicateIndex | None:
+        if FEEDBACK_DEDUP == "off":
+            return None
+        return DuplicateIndex(
+            threshold=FEEDBACK_DEDUP_THRESHOLD, window=FEEDBACK_DEDUP_WINDOW, max_entries=FEEDBACK_DEDUP_MAX_ENTRIES
+        )
+
+    def create_journal(self) -> UpdateJournal | None:
+        if not JOURNAL_DIR:
+            return None
+        return UpdateJournal(JOURNAL_DIR, fsync_batch=JOURNAL_FSYNC_BATCH, fsync_interval=JOURNAL_FSYNC_INTERVAL)
+
+    def create_state_store(self) -> StateStore:
+        if STATE_BACKEND == "postgres":
+            return PostgresStateStore(db, ttl=STATE_TTL)
+        return MemoryStateStore(ttl=STATE_TTL)
 
-        self.bot.message_handler(func=lambda m: m.text == "Обратная связь")(
-            lambda msg: self.handlers["feedback"].handle(msg))
-        self.bot.message_handler(func=lambda m: m.text == "Помощь")(
-            lambda msg: self.handlers["help"].handle(msg))
-        self.bot.message_handler(func=lambda m: m.text == "Цифровые ресурсы")(
-            lambda msg: self.handlers["resources"].handle(msg))
-        self.bot.message_handler(func=lambda m: m.text == "Игра")(
-            lambda msg: self.handlers["game"].handle(msg))
+    def wrap(self, handler):
+        """Превращает обработчик в функцию, которую регистрирует бот"""
+        def process(update):
+            self.states.prefetch(self.state_keys(update))
+            handler(update)
 
-        self.bot.callback_query_handler(func=lambda c: c.data in ("liked", "add", "cancel_feedback", "feedback_end"))(
-            lambda call: self.handlers["feedback_callback"].handle(call))
+        def run(update):
+            self.executor.submit(update_chat_id(update), process, update)
 
-        self.bot.callback_query_handler(func=lambda c: c.data.startswith(("part", "next")))(
-            lambda call: self.handlers["game_callback"].handle(call))
+        return run
+
+    @staticmethod
+    def state_keys(update: Message | CallbackQuery) -> list[str]:
+        """Ключи состояния, которые могут прочитать обработчики апдейта: загружаются одним запросом"""
+        chat_id = update_chat_id(update)
+        return [f"feedback:{chat_id}", f"game:{chat_id}"]
 
-        self.bot.message_handler(func=lambda m: self.handlers["feedback_callback"].states.get(m.chat.id, {}).get(
-            "state") == "waiting_feedback")(
-            self.handle_feedback_text)
+    def instrumented(self, name: str, update: str):
+        """Обработчик из self.handlers с метриками по нему и по типу апдейта"""
+        handler = self.handlers[name].handle if name in self.handlers else getattr(self, name)
+        return instrument_handler(name, update, handler, self.profiler)
+
+    def register_handlers(self):
+        self.router = Router()
+        self.router.command("start", self.instrumented("start", "command"))
+        self.router.command("stats", self.instrumented("stats", "command"))
+        self.router.command("broadcast", self.instrumented("broadcast", "command"))
+
+        self.router.text(MENU_FEEDBACK, self.instrumented("feedback", "menu"))
+        self.router.text(MENU_HELP, self.instrumented("help", "menu"))
+        self.router.text(MENU_RESOURCES, self.instrumented("resources", "menu"))
+        self.router.text(MENU_GAME, self.instrumented("game", "menu"))
+
+        for data in ("liked", "add", "cancel_feedback", "feedback_end"):
+            self.router.callback(data, self.instrumented("feedback_callback", data))
+        self.router.action("part", self.instrumented("game_callback", "part"), option=True)
+        self.router.action("next", self.instrumented("game_callback", "next"))
+
+        # Текст, не совпавший с кнопками меню, считается обратной связью, если её ждут от этого чата
+        self.router.otherwise(self.instrumented("handle_feedback_text", "text"))
+
+        # Вся маршрутизация - в Router, TeleBot видит по одному обработчику на тип апдейта
+        self.bot.message_handler()(self.wrap(self.router.dispatch_message))
+        self.bot.callback_query_handler(func=None)(self.wrap(self.router.dispatch_callback))
+
+    def register_metrics(self):
+        instrument_db()
+        REGISTRY.collector("bot_queue_depth", "Апдейты и записи, ожидающие обработки", lambda: {
+            "handlers": self.executor.stats()["queue_depth"] if self.executor else 0,
+            "feedback": self.feedback_writer.stats()["queue_depth"],
+            "outbound": self.scheduler.stats()["queue_depth"],
+        })
+        REGISTRY.collector("bot_feedback_duplicates", "Найденные повторы обратной связи: точные и почти точные", lambda: {
+            kind: self.feedback_writer.stats().get("dedup", {}).get(kind, 0) for kind in ("exact", "near")
+        })
+        REGISTRY.collector("bot_card_image_bytes", "Размер картинок карточек: исходных и отправляемых", lambda: {
+            "source": self.cards.stats()["source_bytes"],
+            "prepared": self.cards.stats()["bytes"],
+        })
+        REGISTRY.collector("bot_db_pool", "Состояние пула соединений с базой", lambda: {
+            name: value for name, value in self.feedback_writer.database.pool_stats().items()
+            if name in ("size", "checked_out", "overflow", "checkout_seconds_avg", "checkout_seconds_max")
+        })
 
     def handle_feedback_text(self, message: Message):
-        state = self.handlers["feedback_callback"].states.get(message.chat.id)
+        state = self.handlers["feedback_callback"].get_state(message.chat.id)
         if not state:
             return
 
         feedback_type = state["type"]
         self.save_feedback(message, feedback_type)
-        del self.handlers["feedback_callback"].states[message.chat.id]
+        self.handlers["feedback_callback"].clear_state(message.chat.id)
 
-        markup = InlineKeyboardMarkup(row_width=2)
-        markup.add(
-            InlineKeyboardButton("Что понравилось", callback_data="liked"),
-            InlineKeyboardButton("Что можно добавить", callback_data="add"),
-            InlineKeyboardButton("Завершить", callback_data="feedback_end")
-        )
-        self.bot.send_message(
+        self.api.send_message(
             message.chat.id,
             "✅ Спасибо за вашу обратную связь! Хотите добавить что-то ещё?",
-            reply_markup=markup
+            reply_markup=self.content.feedback_more
         )
 
     @staticmethod
-    def save_feedback(message: Message, category: str):
-        with db.create_session() as session:
-            try:
-                student = session.get(Students, message.from_user.id)
-                if not student:
-                    student = Students(
-                        id=message.from_user.id,
-                        name=message.from_user.full_name
-                    )
-                    session.add(student)
-
-                feedback = Feedback(
-                    message=message.text,
-                    category=category
-                )
-                session.add(feedback)
-                session.commit()
-            except Exception as e:
-                print(f"Ошибка сохранения сообщения: {e}")
-                session.rollback()
+    def feedback_key(message: Message) -> str:
+        """Ключ сообщения, одинаковый при повторной доставке апдейта Telegram"""
+        return f"{message.chat.id}:{message.message_id}"
+
+    def save_feedback(self, message: Message, category: str):
+        try:
+            self.feedback_writer.submit(
+                message.from_user.id,
+                message.from_user.full_name,
+                category,
+                message.text,
+                self.feedback_key(message)
+            )
+        except Exception as e:
+            FEEDBACK_ERRORS.labels().inc()
+            print(f"Ошибка сохранения сообщения: {e}")
 
     @staticmethod
-    def markup_main() -> ReplyKeyboardMarkup:
-        markup = ReplyKeyboardMarkup(resize_keyboard=True, row_width=2)
-        markup.add(
-            "Обратная связь",
-            "Игра",
-            "Цифровые ресурсы",
-            "Помощь"
-        )
-        return markup
+    def choice_key(call: CallbackQuery) -> str:
+        """Ключ нажатия, одинаковый при повторной доставке callback-запроса"""
+        return f"choice:{call.id}"
+
+    def save_choice(self, call: CallbackQuery, image: int, part: int):
+        try:
+            self.feedback_writer.submit_choice(
+                call.from_user.id, call.from_user.full_name, image, part, self.choice_key(call)
+            )
+        except Exception as e:
+            FEEDBACK_ERRORS.labels().inc()
+            print(f"Ошибка сохранения выбора в игре: {e}")
+
+    def stop(self):
+        self.bot.stop_polling()
+
+    def prepare_schema(self):
+        """Проверка схемы при старте: если она актуальна, это один запрос версии"""
+        if DB_MIGRATE == "auto":
+            applied = migrate(db)
+            if applied:
+                print(f"Применены миграции: {applied}")
+        elif DB_MIGRATE == "check" and not check_schema(db):
+            raise SystemExit(1)
+
+    def prepare_rollup(self):
+        try:
+            self.rollup.load()
+        except Exception as e:
+            # /stats покажет то, что записано после старта, а полные счётчики подтянет следующее перечитывание
+            print(f"Не удалось загрузить счётчики обратной связи: {e}")
+        self.rollup.watch(ROLLUP_REFRESH_INTERVAL)
+
+    def prepare_cards(self):
+        self.cards.load()
+        self.cards.print_report()
+        self.cards.watch(CARDS_WATCH_INTERVAL)
+
+    def startup(self):
+        self.prepare_schema()
+        self.prepare_rollup()
+        self.prepare_cards()
+        self.scheduler.start()
+        self.broadcaster.watch(BROADCAST_POLL_INTERVAL)
+        self.feedback_writer.start()
+        if self.executor is not None:
+            self.executor.start()
+
+    def shutdown(self):
+        # Дорабатываем принятые апдейты и дописываем в базу всё, что осталось в очередях
+        self.executor.close()
+        self.feedback_writer.close()
+        self.states.close()
+        # Неотправленные получатели рассылки снимаются с очереди и достанутся следующему запуску
+        self.broadcaster.close()
+        self.scheduler.close()
+        self.cards.close()
+        self.rollup.close()
+        if self.profiler is not None:
+            self.profiler.close()
+        print(f"Бот остановлен: {self.feedback_writer.stats()}, отправка: {self.scheduler.stats()}, "
+              f"обработчики: {self.executor.stats()}")
 
     def run(self):
+        self.startup()
+        if METRICS_PORT:
+            serve_metrics(METRICS_PORT)
+        signal.signal(signal.SIGTERM, lambda *_: self.bot.stop_polling())
         print("Бот запущен!")
-        self.bot.infinity_polling()
+        try:
+            self.bot.infinity_polling()
+        finally:
+            self.shutdown()
+
+    def run_webhook(self):
+        import uvicorn
+
+        from bot.webhook import create_app
+
+        app = create_app(self, secret_token=WEBHOOK_SECRET, webhook_url=WEBHOOK_URL, workers=WEBHOOK_WORKERS)
+        uvicorn.run(app, host=WEBHOOK_HOST, port=WEBHOOK_PORT)
+
+
+class AsyncFeedbackBot(FeedbackBot):
+    """Асинхронный режим: те же обработчики, но весь ввод-вывод выполняется корутинами.
+
+    Обработчики получают CallRecorder вместо TeleBot: их синхронная логика отрабатывает сразу,
+    а записанные вызовы API потом выполняются через AsyncTeleBot, так что один процесс
+    обслуживает множество чатов без пула потоков.
+    """
+
+    def create_bot(self, token: str):
+        # Импорт здесь, чтобы синхронный режим не требовал aiohttp
+        from telebot.async_telebot import AsyncTeleBot
+
+        return AsyncTeleBot(token)
+
+    def create_sender(self, token: str):
+        return TeleBot(token, threaded=False)
+
+    def create_api(self):
+        return CallRecorder(ScheduledBot(self.bot, self.scheduler))
+
+    def create_executor(self) -> ChatExecutor | None:
+        # Синхронная часть обработчика выполняется в цикле событий целиком, без гонок за состояние
+        return None
+
+    def create_feedback_writer(self):
+        return AsyncFeedbackWriter(
+            AsyncDatabase(DB_URL),
+            batch_size=FEEDBACK_BATCH_SIZE,
+            flush_interval=FEEDBACK_FLUSH_INTERVAL,
+            max_queue=FEEDBACK_QUEUE_SIZE,
+            known_students=FEEDBACK_KNOWN_STUDENTS,
+            journal=self.create_journal(),
+            dedup=self.create_dedup(),
+            collapse_duplicates=FEEDBACK_DEDUP == "collapse",
+            rollup=self.rollup
+        )
+
+    def wrap(self, handler):
+        async def run(update):
+            if self.states.blocking:
+                await asyncio.to_thread(self.states.prefetch, self.state_keys(update))
+            # Время обработчика - вместе с записанными им вызовами API, а не только их запись
+            await instrument_update(self.api.run(handler, update))
+
+        return run
+
+    def instrumented(self, name: str, update: str):
+        handler = self.handlers[name].handle if name in self.handlers else getattr(self, name)
+        return label_handler(name, update, handler, self.profiler)
+
+    def save_feedback(self, message: Message, category: str):
+        self.api.defer(
+            self.submit_feedback,
+            message.from_user.id,
+            message.from_user.full_name,
+            category,
+            message.text,
+            self.feedback_key(message)
+        )
+
+    async def submit_feedback(self, student_id: int, name: str, category: str, text: str, key: str):
+        try:
+            await self.feedback_writer.submit(student_id, name, category, text, key)
+        except Exception as e:
+            FEEDBACK_ERRORS.labels().inc()
+            print(f"Ошибка сохранения сообщения: {e}")
+
+    def save_choice(self, call: CallbackQuery, image: int, part: int):
+        self.api.defer(
+            self.submit_choice, call.from_user.id, call.from_user.full_name, image, part, self.choice_key(call)
+        )
+
+    async def submit_choice(self, student_id: int, name: str, image: int, part: int, key: str):
+        try:
+            await self.feedback_writer.submit_choice(student_id, name, image, part, key)
+        except Exception as e:
+            FEEDBACK_ERRORS.labels().inc()
+            print(f"Ошибка сохранения выбора в игре: {e}")
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self.polling.cancel)
+
+    async def shutdown(self):
+        await self.feedback_writer.close()
+        await self.feedback_writer.database.dispose()
+        self.states.close()
+        await asyncio.to_thread(self.broadcaster.close)
+        # Планировщик выдаёт разрешения корутинам этого цикла, поэтому ждём его в отдельном потоке
+        await asyncio.to_thread(self.scheduler.close)
+        await self.bot.close_session()
+        self.cards.close()
+        self.rollup.close()
+        if self.profiler is not None:
+            self.profiler.close()
+        print(f"Бот остановлен: {self.feedback_writer.stats()}, отправка: {self.scheduler.stats()}")
+
+    def run(self):
+        asyncio.run(self.run_async())
+
+    async def run_async(self):
+        self.startup()
+        if METRICS_PORT:
+            serve_metrics(METRICS_PORT)
+        self.loop = asyncio.get_running_loop()
+        self.polling = asyncio.create_task(self.bot.infinity_polling())
+        self.loop.add_signal_handler(signal.SIGTERM, self.polling.cancel)
+        print("Бот запущен в асинхронном режиме!")
+        try:
+            await self.polling
+        except asyncio.CancelledError:
+            pass
+        finally:
+            # Даём обработчикам, уже получившим апдейты, дописать ответы
+            handlers = asyncio.all_tasks() - {asyncio.current_task(), self.feedback_writer.worker}
+            if handlers:
+                await asyncio.wait(handlers, timeout=10)
+            await self.shutdown()
 
 
 if __name__ == "__main__":
-    bot = FeedbackBot(TOKEN)
-    bot.run()
\ No newline at end of file
+    if "--check-schema" in sys.argv[1:]:
+        # Проверка для деплоя и healthcheck: один запрос версии схемы, бот не запускается
+        sys.exit(0 if check_schema(db) else 1)
+    bot_class = AsyncFeedbackBot if BOT_MODE == "async" else FeedbackBot
+    if UPDATE_SOURCE == "webhook":
+        if not WEBHOOK_SECRET:
+            sys.exit("UPDATE_SOURCE=webhook требует WEBHOOK_SECRET: без него апдейты (в том числе от имени "
+                     "администратора) принимались бы от любого, кто достучится до порта")
+        bot_class(TOKEN).run_webhook()
+    else:
+        bot_class(TOKEN).run()
\ No newline at end of file
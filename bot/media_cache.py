@@ -0,0 +1,113 @@
+import json
+import os
+import threading
+
+from telebot import TeleBot
+from telebot.apihelper import ApiTelegramException
+
+# Признаки в описании ошибки 400, по которым file_id больше не принимается: "wrong file
+# identifier/HTTP URL specified", "wrong remote file identifier specified", "invalid file_id"
+_STALE_FILE_ID = ("file identifier", "file_id", "file reference")
+
+
+def stale_file_id(error: Exception) -> bool:
+    """Telegram отверг сам file_id.
+
+    Остальные 400 (чат не найден, ошибка разметки подписи) повторная загрузка не исправит.
+    """
+    if not isinstance(error, ApiTelegramException) or error.error_code != 400:
+        return False
+    description = (error.description or "").lower()
+    return any(marker in description for marker in _STALE_FILE_ID)
+
+
+class MediaCache:
+    """Кэш file_id, которые Telegram возвращает после первой загрузки фото.
+
+    Картинки, подготовленные в памяти, хранятся по имени и sha256 готовых байт, поэтому замена
+    картинки в смонтированной папке bot/carts автоматически инвалидирует запись.
+    Ссылки хранятся по самому URL.
+    """
+
+    def __init__(self, bot: TeleBot, path: str):
+        self.bot = bot
+        self.path = path
+        self.lock = threading.Lock()
+        self.entries = self._load()
+
+    def send_photo(self, chat_id: int, url: str, **kwargs):
+        """Отправляет фото по URL, по возможности переиспользуя file_id"""
+        return self._send(chat_id, f"url:{url}", lambda: url, **kwargs)
+
+    def send_bytes(self, chat_id: int, name: str, data: bytes, digest: str, **kwargs):
+        """Отправляет готовые байты из памяти; name - постоянное имя картинки, digest - sha256 data"""
+        return self._send(chat_id, f"bytes:{name}:{digest}", lambda: data, **kwargs)
+
+    def _send(self, chat_id: int, key: str, upload, **kwargs):
+        """upload() возвращает то, что загружать, если file_id для key ещё нет"""
+        file_id = self.entries.get(key)
+        if file_id:
+            try:
+                message = self.bot.send_photo(chat_id, file_id, **kwargs)
+                if hasattr(message, "catch"):
+                    # Асинхронный режим: ошибка протухшего file_id придёт при выполнении вызова
+                    return message.catch(
+                        lambda error: self._reupload(error, message.func, chat_id, key, upload, kwargs)
+                    )
+                return message
+            except ApiTelegramException as e:
+                # file_id мог протухнуть (например, после смены токена бота) - загружаем заново
+                if not stale_file_id(e):
+                    raise
+                self.forget(key)
+
+        message = self.bot.send_photo(chat_id, upload(), **kwargs)
+        if hasattr(message, "then"):
+            # Асинхронный режим: вызов ещё не выполнен, file_id запомним по его результату
+            message.then(lambda result: self.remember(key, result))
+        else:
+            self.remember(key, message)
+        return message
+
+    async def _reupload(self, error: Exception, send_photo, chat_id: int, key: str, upload, kwargs: dict):
+        if not stale_file_id(error):
+            raise error
+        self.forget(key)
+        message = await send_photo(chat_id, upload(), **kwargs)
+        self.remember(key, message)
+        return message
+
+    def remember(self, key: str, message):
+        if not message or not getattr(message, "photo", None):
+            return
+        with self.lock:
+            if key.startswith("bytes:"):
+                # Убираем записи для старых версий той же картинки
+                prefix = key.rsplit(":", 1)[0] + ":"
+                for stale in [k for k in self.entries if k.startswith(prefix) and k != key]:
+                    del self.entries[stale]
+            self.entries[key] = message.photo[-1].file_id
+            self._save()
+
+    def forget(self, key: str):
+        with self.lock:
+            if self.entries.pop(key, None) is not None:
+                self._save()
+
+    def _load(self) -> dict:
+        try:
+            with open(self.path, encoding="utf-8") as file:
+                entries = json.load(file)
+        except (OSError, ValueError):
+            return {}
+        # Записи по путям к файлам остались от версий, отправлявших карточки с диска
+        return {key: file_id for key, file_id in entries.items() if not key.startswith("file:")}
+
+    def _save(self):
+        tmp_path = f"{self.path}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as file:
+                json.dump(self.entries, file, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            print(f"Не удалось сохранить кэш медиа: {e}")
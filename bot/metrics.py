@@ -0,0 +1,365 @@
+import contextvars
+import sys
+import threading
+import time
+import traceback
+from abc import ABC, abstractmethod
+from collections import Counter as _Tally
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric(ABC):
+    kind = ""
+
+    def __init__(self, name: str, help: str, labels: tuple = ()):
+        self.name = name
+        self.help = help
+        self.label_names = labels
+        self.lock = threading.Lock()
+        self.children = {}
+
+    def labels(self, *values):
+        child = self.children.get(values)
+        if child is None:
+            with self.lock:
+                child = self.children.setdefault(values, self._child())
+        return child
+
+    @abstractmethod
+    def _child(self):
+        pass
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self.lock:
+            children = list(self.children.items())
+        for values, child in children:
+            lines.extend(child.render(self, values))
+        return lines
+
+
+class _CounterChild:
+    __slots__ = ("value", "lock")
+
+    def __init__(self):
+        self.value = 0.0
+        self.lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0):
+        with self.lock:
+            self.value += amount
+
+    def render(self, metric, values) -> list[str]:
+        return [f"{metric.name}_total{_labels(metric.label_names, values)} {self.value}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _child(self):
+        return _CounterChild()
+
+
+class _HistogramChild:
+    __slots__ = ("buckets", "counts", "sum", "lock")
+
+    def __init__(self, buckets: tuple):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, seconds: float):
+        index = len(self.buckets)
+        for i, bound in enumerate(self.buckets):
+            if seconds <= bound:
+                index = i
+                break
+        with self.lock:
+            self.counts[index] += 1
+            self.sum += seconds
+
+    def render(self, metric, values) -> list[str]:
+        with self.lock:
+            counts, total = list(self.counts), self.sum
+        lines, cumulative = [], 0
+        for bound, count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += count
+            le = 'le="+Inf"' if bound == float("inf") else f'le="{bound!r}"'
+            lines.append(f"{metric.name}_bucket{_labels(metric.label_names, values, le)} {cumulative}")
+        lines.append(f"{metric.name}_sum{_labels(metric.label_names, values)} {total}")
+        lines.append(f"{metric.name}_count{_labels(metric.label_names, values)} {cumulative}")
+        return lines
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = buckets
+
+    def _child(self):
+        return _HistogramChild(self.buckets)
+
+
+class Registry:
+    """Набор метрик и функций, снимающих текущие значения (глубины очередей и т.п.) в момент опроса"""
+
+    def __init__(self):
+        self.metrics: list[_Metric] = []
+        self.collectors = {}  # имя метрики -> (описание, функция)
+        self.lock = threading.Lock()
+
+    def register(self, metric: _Metric) -> _Metric:
+        with self.lock:
+            self.metrics.append(metric)
+        return metric
+
+    def collector(self, name: str, help: str, collect):
+        """collect() возвращает {значение метки name или None: число}. Повторная регистрация заменяет функцию"""
+        with self.lock:
+            self.collectors[name] = (help, collect)
+
+    def render(self) -> str:
+        with self.lock:
+            metrics, collectors = list(self.metrics), list(self.collectors.items())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        for name, (help, collect) in collectors:
+            try:
+                values = collect()
+            except Exception as e:
+                print(f"Ошибка сбора метрики {name}: {e}")
+                continue
+            lines.extend([f"# HELP {name} {help}", f"# TYPE {name} gauge"])
+            for label, value in values.items():
+                lines.append(f"{name}{_labels(('name',), (label,)) if label is not None else ''} {value}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+HANDLER_SECONDS = REGISTRY.register(Histogram(
+    "bot_handler_seconds", "Время выполнения обработчика", ("handler", "update")))
+HANDLER_ERRORS = REGISTRY.register(Counter(
+    "bot_handler_errors", "Исключения в обработчиках", ("handler", "update")))
+API_SECONDS = REGISTRY.register(Histogram(
+    "bot_api_call_seconds", "Длительность вызова Telegram Bot API", ("method",)))
+API_ERRORS = REGISTRY.register(Counter(
+    "bot_api_call_errors", "Ошибки вызовов Telegram Bot API", ("method", "code")))
+FEEDBACK_ERRORS = REGISTRY.register(Counter(
+    "bot_feedback_submit_errors", "Обратная связь, которую не удалось поставить в очередь записи"))
+DB_STATEMENT_SECONDS = REGISTRY.register(Histogram(
+    "bot_db_statement_seconds", "Длительность SQL-запроса", ("operation",)))
+DB_STATEMENT_ERRORS = REGISTRY.register(Counter(
+    "bot_db_statement_errors", "Ошибки SQL-запросов", ("operation",)))
+DB_TRANSACTION_SECONDS = REGISTRY.register(Histogram(
+    "bot_db_transaction_seconds", "Длительность транзакции сессии от начала до commit/rollback", ("outcome",)))
+
+
+def _operation(statement: str) -> str:
+    return statement.lstrip().split(None, 1)[0].upper() if statement.strip() else "OTHER"
+
+
+_db_instrumented = False
+
+
+def instrument_db():
+    """Подписывается на события SQLAlchemy: время каждого запроса и каждой транзакции сессии"""
+    global _db_instrumented
+    if _db_instrumented:
+        return
+    _db_instrumented = True
+
+    @event.listens_for(Engine, "before_cursor_execute")
+    def before_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("metrics_started", []).append(time.perf_counter())
+
+    @event.listens_for(Engine, "after_cursor_execute")
+    def after_execute(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info["metrics_started"].pop()
+        DB_STATEMENT_SECONDS.labels(_operation(statement)).observe(time.perf_counter() - started)
+
+    @event.listens_for(Engine, "handle_error")
+    def on_error(context):
+        started = context.connection.info.get("metrics_started") if context.connection is not None else None
+        if started:
+            started.pop()
+        DB_STATEMENT_ERRORS.labels(_operation(context.statement or "")).inc()
+
+    @event.listens_for(Session, "after_begin")
+    def after_begin(session, transaction, connection):
+        session.info["metrics_begun"] = time.perf_counter()
+
+    def finished(outcome):
+        def listener(session):
+            begun = session.info.pop("metrics_begun", None)
+            if begun is not None:
+                DB_TRANSACTION_SECONDS.labels(outcome).observe(time.perf_counter() - begun)
+
+        return listener
+
+    event.listen(Session, "after_commit", finished("commit"))
+    event.listen(Session, "after_rollback", finished("rollback"))
+
+
+class SlowUpdateProfiler:
+    """Семплирующий профилировщик медленных апдейтов.
+
+    Пока обработчик выполняется дольше threshold секунд, фоновый поток раз в interval секунд
+    снимает стек его потока. Если обработчик в итоге оказался медленным, самые частые стеки
+    печатаются в лог: видно, где он стоял - в загрузке фото, в commit или в очереди отправки.
+    """
+
+    def __init__(self, threshold: float = 1.0, interval: float = 0.01, top: int = 5):
+        self.threshold = threshold
+        self.interval = interval
+        self.top = top
+        self.active = {}  # id потока -> (начало, имя обработчика, стеки)
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._sample, name="slow-update-profiler", daemon=True)
+        self.thread.start()
+
+    def begin(self, name: str):
+        with self.lock:
+            self.active[threading.get_ident()] = (time.perf_counter(), name, _Tally())
+
+    def end(self):
+        with self.lock:
+            started, name, stacks = self.active.pop(threading.get_ident())
+        elapsed = time.perf_counter() - started
+        if elapsed >= self.threshold and stacks:
+            samples = sum(stacks.values())
+            report = [f"Медленный апдейт {name}: {elapsed:.2f} с, {samples} семплов"]
+            for stack, count in stacks.most_common(self.top):
+                report.append(f"  {count / samples:.0%}: {stack}")
+            print("\n".join(report))
+
+    def close(self):
+        self.stopped.set()
+
+    def _sample(self):
+        while not self.stopped.wait(self.interval):
+            now = time.perf_counter()
+            with self.lock:
+                slow = {ident: stacks for ident, (started, _, stacks) in self.active.items()
+                        if now - started >= self.threshold}
+            if not slow:
+                continue
+            frames = sys._current_frames()
+            for ident, stacks in slow.items():
+                frame = frames.get(ident)
+                if frame is not None:
+                    stack = " <- ".join(
+                        f"{entry.name} ({entry.filename.rsplit('/', 1)[-1]}:{entry.lineno})"
+                        for entry in reversed(traceback.extract_stack(frame, limit=8))
+                    )
+                    with self.lock:
+                        stacks[stack] += 1
+
+
+def instrument_handler(name: str, update: str, handler, profiler: SlowUpdateProfiler | None = None):
+    """Оборачивает обработчик: гистограмма времени, счётчик ошибок и, если задан, профилировщик"""
+    seconds = HANDLER_SECONDS.labels(name, update)
+    errors = HANDLER_ERRORS.labels(name, update)
+
+    def run(*args):
+        if profiler is not None:
+            profiler.begin(f"{name}/{update}")
+        started = time.perf_counter()
+        try:
+            return handler(*args)
+        except Exception:
+            errors.inc()
+            raise
+        finally:
+            seconds.observe(time.perf_counter() - started)
+            if profiler is not None:
+                profiler.end()
+
+    return run
+
+
+# Обработчик, который сработал на текущий апдейт в асинхронном режиме: (handler, update)
+_handler_label = contextvars.ContextVar("handler_label", default=None)
+
+
+def label_handler(name: str, update: str, handler, profiler: SlowUpdateProfiler | None = None):
+    """Асинхронный режим: обработчик только записывает вызовы API, поэтому здесь лишь отмечается, какой
+    обработчик сработал, а время вместе с вызовами меряет instrument_update.
+
+    Профилировщик снимает стеки потока и видит только синхронную часть обработчика.
+    """
+    def run(*args):
+        _handler_label.set((name, update))
+        if profiler is None:
+            return handler(*args)
+        profiler.begin(f"{name}/{update}")
+        try:
+            return handler(*args)
+        finally:
+            profiler.end()
+
+    return run
+
+
+async def instrument_update(run):
+    """Выполняет апдейт (корутину run) и записывает его время и ошибку на обработчик из label_handler"""
+    token = _handler_label.set(None)
+    started = time.perf_counter()
+    try:
+        return await run
+    except Exception:
+        label = _handler_label.get()
+        if label is not None:
+            HANDLER_ERRORS.labels(*label).inc()
+        raise
+    finally:
+        label = _handler_label.get()
+        if label is not None:
+            HANDLER_SECONDS.labels(*label).observe(time.perf_counter() - started)
+        _handler_label.reset(token)
+
+
+def serve(port: int, host: str = "0.0.0.0", registry: Registry = REGISTRY) -> ThreadingHTTPServer:
+    """Отдаёт GET /metrics в фоновом потоке (для режима long polling, где нет вебхук-сервера)"""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = registry.render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    return server
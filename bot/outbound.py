@@ -0,0 +1,323 @@
+import asyncio
+import heapq
+import inspect
+import itertools
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from bot.metrics import API_ERRORS, API_SECONDS
+
+HIGH, NORMAL, BULK = 0, 1, 2
+LANES = {HIGH: "high", NORMAL: "normal", BULK: "bulk"}
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def wait_time(self, now: float) -> float:
+        """Сколько секунд ждать до появления токена (0 - можно отправлять)"""
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+
+class _Job:
+    __slots__ = ("func", "args", "kwargs", "chat_id", "priority", "permit", "future", "enqueued_at", "attempts")
+
+    def __init__(self, func, args, kwargs, chat_id, priority, permit: asyncio.Future | None = None):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.chat_id = chat_id
+        self.priority = priority
+        # Асинхронный вызов: future цикла событий, которое планировщик завершает, разрешая отправку
+        self.permit = permit
+        self.future = Future() if permit is None else None
+        self.enqueued_at = time.monotonic()
+        self.attempts = 0
+
+
+def retry_after(error: Exception) -> float | None:
+    """Возвращает retry_after из ответа 429 Too Many Requests, иначе None"""
+    if getattr(error, "error_code", None) != 429:
+        return None
+    parameters = (getattr(error, "result_json", None) or {}).get("parameters") or {}
+    return float(parameters.get("retry_after", 1))
+
+
+class OutboundScheduler:
+    """Планировщик исходящих вызовов Telegram API с учётом флуд-лимитов.
+
+    Сообщения в чат ограничены корзиной токенов на чат (chat_rate в секунду, пачкой до chat_burst)
+    и общей корзиной global_rate в секунду (пачкой до global_burst). Готовые к отправке вызовы выбираются по приоритету:
+    HIGH (ответы на callback) раньше NORMAL (ответы пользователю), а те раньше BULK (рассылки).
+    Вызовы без chat_id (ответы на callback) сообщениями не считаются и корзины не расходуют.
+    На ответ 429 вызов откладывается на retry_after секунд и повторяется, чат при этом
+    блокируется целиком, чтобы не получить 429 повторно.
+
+    Синхронные вызовы (submit) выполняются в пуле из workers потоков. Асинхронные (call_async)
+    выполняются в цикле событий вызывающего: поток планировщика только выдаёт им разрешение,
+    так что число одновременных асинхронных вызовов от числа потоков не зависит.
+    """
+
+    def __init__(self, global_rate: float = 30.0, chat_rate: float = 1.0, chat_burst: float = 3.0,
+                 global_burst: float = 5.0, workers: int = 8, max_retries: int = 5):
+        self.global_bucket = TokenBucket(global_rate, global_burst)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self.chat_buckets: dict[int, TokenBucket] = {}
+        self.blocked_until: dict[int | None, float] = {}  # None - блокировка всего бота
+        self.ready = []  # (priority, seq, job)
+        self.delayed = []  # (not_before, seq, job)
+        self.seq = itertools.count()
+        self.condition = threading.Condition()
+        self.slots = threading.Semaphore(workers)
+        self.workers = workers
+        self.executor = None
+        self.dispatcher = None
+        self.stopping = False
+        self.in_flight = 0  # выданные и ещё не завершённые вызовы: могут вернуться в очередь после 429
+        self.counters = {"submitted": 0, "sent": 0, "failed": 0, "retried_429": 0}
+        self.waits = {lane: {"count": 0, "seconds_total": 0.0, "seconds_max": 0.0} for lane in LANES.values()}
+
+    def start(self):
+        if self.dispatcher is None:
+            self.stopping = False
+            self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="outbound")
+            self.dispatcher = threading.Thread(target=self._dispatch, name="outbound-dispatcher", daemon=True)
+            self.dispatcher.start()
+
+    def close(self):
+        """Отправляет всё, что уже в очереди, и останавливает потоки"""
+        if self.dispatcher is None:
+            return
+        with self.condition:
+            self.stopping = True
+            self.condition.notify_all()
+        self.dispatcher.join()
+        self.executor.shutdown(wait=True)
+        self.dispatcher = None
+
+    def submit(self, func, args=(), kwargs=None, chat_id: int | None = None, priority: int = NORMAL) -> Future:
+        """Ставит синхронный вызов в очередь; он выполнится в потоке отправки.
+
+        Пока вызов не начал выполняться, его можно отменить через Future.cancel().
+        """
+        job = _Job(func, args, kwargs or {}, chat_id, priority)
+        self._enqueue(job)
+        return job.future
+
+    async def call_async(self, func, args=(), kwargs=None, chat_id: int | None = None, priority: int = NORMAL):
+        """Дожидается разрешения планировщика и выполняет корутину-функцию func в текущем цикле событий"""
+        job = _Job(func, args, kwargs or {}, chat_id, priority, asyncio.get_running_loop().create_future())
+        self._enqueue(job)
+        while True:
+            try:
+                await job.permit
+                started = time.perf_counter()
+                result = await func(*job.args, **job.kwargs)
+            except asyncio.CancelledError:
+                # Разрешение уже выдано - вызов считался выполняющимся; иначе его закроет _grant
+                if job.permit.done() and not job.permit.cancelled():
+                    self._finish()
+                raise
+            except Exception as e:
+                if not self._failed(job, e, started):
+                    raise
+            else:
+                self._succeeded(job, started)
+                return result
+
+    def _enqueue(self, job: _Job):
+        with self.condition:
+            self.counters["submitted"] += 1
+            heapq.heappush(self.ready, (job.priority, next(self.seq), job))
+            self.condition.notify()
+
+    def stats(self) -> dict:
+        with self.condition:
+            stats = dict(self.counters)
+            stats["queue_depth"] = len(self.ready) + len(self.delayed)
+            stats["wait"] = {
+                lane: dict(wait, seconds_avg=wait["seconds_total"] / wait["count"] if wait["count"] else 0.0)
+                for lane, wait in self.waits.items()
+            }
+        return stats
+
+    def _dispatch(self):
+        while True:
+            job = self._next_job()
+            if job is None:
+                return
+            if job.permit is None:
+                self.slots.acquire()
+                self.executor.submit(self._execute, job)
+                continue
+            try:
+                job.permit.get_loop().call_soon_threadsafe(self._grant, job)
+            except RuntimeError:
+                # Цикл событий вызывающего уже закрыт - отправлять некому
+                self._finish()
+
+    def _grant(self, job: _Job):
+        """Выполняется в цикле событий вызывающего: разрешает асинхронному вызову отправку"""
+        if job.permit.done():
+            # Вызывающего отменили, пока вызов ждал в очереди
+            self._finish()
+        else:
+            job.permit.set_result(None)
+
+    def _next_job(self) -> _Job | None:
+        with self.condition:
+            while True:
+                now = time.monotonic()
+                while self.delayed and self.delayed[0][0] <= now:
+                    _, seq, job = heapq.heappop(self.delayed)
+                    heapq.heappush(self.ready, (job.priority, seq, job))
+
+                if self.ready:
+                    _, seq, job = self.ready[0]
+                    chat_wait = self._chat_wait(job.chat_id, now)
+                    if chat_wait > 0:
+                        # Чат упёрся в свой лимит - не держим из-за него остальные чаты
+                        heapq.heappop(self.ready)
+                        heapq.heappush(self.delayed, (now + chat_wait, seq, job))
+                        continue
+                    global_wait = self.blocked_until.get(None, 0) - now
+                    if job.chat_id is not None:
+                        global_wait = max(global_wait, self.global_bucket.wait_time(now))
+                    if global_wait <= 0:
+                        heapq.heappop(self.ready)
+                        # Синхронный вызов отменили, пока он стоял в очереди: лимиты на него не тратим
+                        starting = job.future is not None and not job.attempts
+                        if starting and not job.future.set_running_or_notify_cancel():
+                            continue
+                        if job.chat_id is not None:
+                            self.global_bucket.take()
+                            self.chat_buckets[job.chat_id].take()
+                        self._record_wait(job, now)
+                        self.in_flight += 1
+                        return job
+                    timeout = global_wait
+                elif self.delayed:
+                    timeout = self.delayed[0][0] - now
+                elif self.stopping and not self.in_flight:
+                    return None
+                else:
+                    timeout = None
+                self.condition.wait(timeout)
+
+    def _chat_wait(self, chat_id: int | None, now: float) -> float:
+        if chat_id is None:
+            return 0.0
+        blocked = self.blocked_until.get(chat_id, 0) - now
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self.chat_buckets) > 10000:
+                self._prune_buckets(now)
+            bucket = self.chat_buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return max(blocked, bucket.wait_time(now))
+
+    def _prune_buckets(self, now: float):
+        """Убирает корзины чатов, которые успели полностью восстановиться"""
+        for chat_id in [c for c, b in self.chat_buckets.items() if b.wait_time(now) == 0 and b.tokens >= b.capacity]:
+            del self.chat_buckets[chat_id]
+        for key in [k for k, until in self.blocked_until.items() if until <= now]:
+            del self.blocked_until[key]
+
+    def _record_wait(self, job: _Job, now: float):
+        if job.attempts:
+            return
+        wait = self.waits[LANES[job.priority]]
+        waited = now - job.enqueued_at
+        wait["count"] += 1
+        wait["seconds_total"] += waited
+        wait["seconds_max"] = max(wait["seconds_max"], waited)
+
+    def _execute(self, job: _Job):
+        started = time.perf_counter()
+        try:
+            result = job.func(*job.args, **job.kwargs)
+        except Exception as e:
+            if not self._failed(job, e, started):
+                job.future.set_exception(e)
+        else:
+            self._succeeded(job, started)
+            job.future.set_result(result)
+        finally:
+            self.slots.release()
+
+    def _succeeded(self, job: _Job, started: float):
+        API_SECONDS.labels(getattr(job.func, "__name__", "call")).observe(time.perf_counter() - started)
+        self._finish("sent")
+
+    def _failed(self, job: _Job, error: Exception, started: float) -> bool:
+        """Учитывает ошибку вызова. True - вызов получил 429 и снова стоит в очереди"""
+        method = getattr(job.func, "__name__", "call")
+        API_SECONDS.labels(method).observe(time.perf_counter() - started)
+        API_ERRORS.labels(method, str(getattr(error, "error_code", type(error).__name__))).inc()
+        delay = retry_after(error)
+        if delay is None or job.attempts >= self.max_retries:
+            self._finish("failed")
+            return False
+        with self.condition:
+            self.in_flight -= 1
+            job.attempts += 1
+            self.counters["retried_429"] += 1
+            until = time.monotonic() + delay
+            self.blocked_until[job.chat_id] = max(self.blocked_until.get(job.chat_id, 0), until)
+            if job.permit is not None:
+                # Выполняется в цикле событий вызывающего: новое разрешение на повтор
+                job.permit = job.permit.get_loop().create_future()
+            heapq.heappush(self.delayed, (until, next(self.seq), job))
+            self.condition.notify()
+        return True
+
+    def _finish(self, counter: str | None = None):
+        with self.condition:
+            self.in_flight -= 1
+            if counter is not None:
+                self.counters[counter] += 1
+            if self.stopping:
+                self.condition.notify()
+
+
+class ScheduledBot:
+    """Прокси над TeleBot или AsyncTeleBot, пропускающий исходящие вызовы через OutboundScheduler.
+
+    Для обработчиков ничего не меняется: синхронный вызов блокируется до фактической отправки
+    и возвращает её результат, асинхронный возвращает корутину.
+    """
+
+    def __init__(self, bot, scheduler: OutboundScheduler):
+        self._bot = bot
+        self._scheduler = scheduler
+
+    def __getattr__(self, name):
+        method = getattr(self._bot, name)
+        if name == "answer_callback_query":
+            priority, chat_limited = HIGH, False
+        elif name.startswith(("send_", "edit_message", "copy_message", "forward_message")):
+            priority, chat_limited = NORMAL, True
+        else:
+            return method
+
+        def chat_of(args, kwargs):
+            return (kwargs.get("chat_id", args[0] if args else None)) if chat_limited else None
+
+        if inspect.iscoroutinefunction(method):
+            async def call(*args, **kwargs):
+                return await self._scheduler.call_async(method, args, kwargs, chat_of(args, kwargs), priority)
+        else:
+            def call(*args, **kwargs):
+                return self._scheduler.submit(method, args, kwargs, chat_of(args, kwargs), priority).result()
+        return call
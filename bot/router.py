@@ -0,0 +1,85 @@
+from typing import Callable, NamedTuple
+
+from telebot import util
+from telebot.types import CallbackQuery, Message
+
+
+class CallbackPayload(NamedTuple):
+    """Разобранные данные callback-кнопки: "part_3_2" -> action="part", image=3, option=2"""
+    action: str
+    image: int | None = None
+    option: int | None = None
+
+
+def parse_callback(data: str) -> CallbackPayload:
+    action, _, rest = data.partition("_")
+    if not rest:
+        return CallbackPayload(action)
+    image, _, option = rest.partition("_")
+    if not image.isdigit() or (option and not option.isdigit()):
+        # Не игровая кнопка (например, "cancel_feedback") - оставляем данные целиком
+        return CallbackPayload(data)
+    return CallbackPayload(action, int(image), int(option) if option else None)
+
+
+class Router:
+    """Таблица маршрутизации апдейтов на словарях вместо цепочки лямбда-предикатов.
+
+    Команды, тексты кнопок меню и callback-данные ищутся за O(1) независимо от числа обработчиков.
+    Callback-данные разбираются один раз и передаются обработчику вместе с запросом.
+    """
+
+    def __init__(self):
+        self.commands: dict[str, Callable[[Message], None]] = {}
+        self.texts: dict[str, Callable[[Message], None]] = {}
+        self.callbacks: dict[str, Callable[[CallbackQuery, CallbackPayload], None]] = {}
+        self.actions: dict[str, Callable[[CallbackQuery, CallbackPayload], None]] = {}
+        self.with_option: set[str] = set()
+        self.fallback: Callable[[Message], None] | None = None
+
+    def command(self, name: str, handler: Callable[[Message], None]):
+        self.commands[name] = handler
+
+    def text(self, text: str, handler: Callable[[Message], None]):
+        self.texts[text] = handler
+
+    def callback(self, data: str, handler: Callable[[CallbackQuery, CallbackPayload], None]):
+        """Обработчик для точного значения callback_data"""
+        self.callbacks[data] = handler
+
+    def action(self, action: str, handler: Callable[[CallbackQuery, CallbackPayload], None], option: bool = False):
+        """Обработчик для callback_data вида "<action>_<картинка>[_<вариант>]".
+
+        Данные без картинки, а при option=True и без варианта, до обработчика не доходят.
+        """
+        self.actions[action] = handler
+        if option:
+            self.with_option.add(action)
+
+    def otherwise(self, handler: Callable[[Message], None]):
+        """Обработчик сообщений, не совпавших ни с командой, ни с кнопкой меню"""
+        self.fallback = handler
+
+    def dispatch_message(self, message: Message):
+        text = message.text or ""
+        handler = None
+        if text.startswith("/"):
+            handler = self.commands.get(util.extract_command(text))
+        if handler is None:
+            handler = self.texts.get(text, self.fallback)
+        if handler is not None:
+            handler(message)
+
+    def dispatch_callback(self, call: CallbackQuery):
+        data = call.data or ""
+        handler = self.callbacks.get(data)
+        if handler is not None:
+            handler(call, CallbackPayload(data))
+            return
+        payload = parse_callback(data)
+        handler = self.actions.get(payload.action)
+        if handler is None or payload.image is None:
+            return
+        if payload.option is None and payload.action in self.with_option:
+            return
+        handler(call, payload)
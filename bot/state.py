@@ -0,0 +1,235 @@
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import delete, select
+from sqlalchemy.dialects import postgresql, sqlite
+
+from db.models import BotState
+
+_DELETED = object()
+
+
+class StateStore(ABC):
+    """Хранилище состояния диалогов с автоматическим истечением записей (TTL).
+
+    Значения - JSON-совместимые словари, поэтому ключи внутри них всегда строки.
+    """
+
+    # prefetch ходит в базу: в асинхронном режиме его выполняют вне цикла событий
+    blocking = False
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+
+    @abstractmethod
+    def get(self, key: str) -> dict | None:
+        pass
+
+    @abstractmethod
+    def set(self, key: str, value: dict, ttl: float | None = None):
+        pass
+
+    @abstractmethod
+    def delete(self, key: str):
+        pass
+
+    def get_many(self, keys: list[str]) -> dict[str, dict]:
+        result = {}
+        for key in keys:
+            value = self.get(key)
+            if value is not None:
+                result[key] = value
+        return result
+
+    def prefetch(self, keys: list[str]):
+        """Загружает ключи, которые прочитает обработчик апдейта, чтобы его get не ходили в хранилище"""
+        pass
+
+    def close(self):
+        pass
+
+
+class MemoryStateStore(StateStore):
+    """Состояние в памяти процесса. Подходит для одного экземпляра бота"""
+
+    def __init__(self, ttl: float, max_entries: int = 100000):
+        super().__init__(ttl)
+        self.max_entries = max_entries
+        self.entries = OrderedDict()  # key -> (expires_at, value), в порядке последнего обновления
+        self.lock = threading.Lock()
+
+    def get(self, key: str) -> dict | None:
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= time.monotonic():
+                del self.entries[key]
+                return None
+            return entry[1]
+
+    def set(self, key: str, value: dict, ttl: float | None = None):
+        now = time.monotonic()
+        with self.lock:
+            self.entries[key] = (now + (ttl or self.ttl), value)
+            self.entries.move_to_end(key)
+            # Записи упорядочены по времени обновления, поэтому просроченные и самые старые - в начале
+            while self.entries:
+                oldest_key, (expires_at, _) = next(iter(self.entries.items()))
+                if expires_at > now and len(self.entries) <= self.max_entries:
+                    break
+                del self.entries[oldest_key]
+
+    def delete(self, key: str):
+        with self.lock:
+            self.entries.pop(key, None)
+
+
+class PostgresStateStore(StateStore):
+    """Состояние в таблице bot_state, общее для нескольких воркеров и переживающее перезапуск.
+
+    Запись попадает в локальный кэш сразу, а в базу уходит пачкой раз в flush_interval секунд
+    одним upsert. Перед обработкой апдейта prefetch перечитывает его ключи одним запросом, и get
+    обработчика отвечает из локального кэша. Поэтому запись другого воркера видна со следующего
+    апдейта после того, как она дошла до базы (до flush_interval секунд). get вне prefetch
+    доверяет кэшу cache_ttl секунд, в том числе отсутствию ключа, и столько же может не видеть
+    чужие записи. Просроченные строки периодически удаляются.
+    """
+
+    blocking = True
+
+    def __init__(self, database, ttl: float, cache_ttl: float = 1.0, flush_interval: float = 0.05,
+                 sweep_interval: float = 60.0):
+        super().__init__(ttl)
+        self.database = database
+        self.cache_ttl = cache_ttl
+        self.flush_interval = flush_interval
+        self.sweep_interval = sweep_interval
+        self.cache = {}  # key -> (fetched_at, value | None)
+        self.pending = {}  # key -> (value | _DELETED, expires_at)
+        self.flushing = {}  # пачка, которая сейчас пишется в базу: там её ещё может не быть
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.worker = threading.Thread(target=self._run, name="state-store", daemon=True)
+        self.worker.start()
+
+    def get(self, key: str) -> dict | None:
+        return self.get_many([key]).get(key)
+
+    def get_many(self, keys: list[str]) -> dict[str, dict]:
+        return self._read(keys, refresh=False)
+
+    def prefetch(self, keys: list[str]):
+        self._read(keys, refresh=True)
+
+    def _read(self, keys: list[str], refresh: bool) -> dict[str, dict]:
+        """Локальные несохранённые записи, затем кэш (если не refresh), остальное - одним запросом"""
+        now = time.monotonic()
+        result, missing = {}, []
+        with self.lock:
+            for key in keys:
+                entry = self.pending.get(key) or self.flushing.get(key)
+                if entry is not None:
+                    value, expires_at = entry
+                    if value is not _DELETED and expires_at > _utcnow():
+                        result[key] = value
+                    continue
+                cached = self.cache.get(key)
+                if not refresh and cached and now - cached[0] < self.cache_ttl:
+                    if cached[1] is not None:
+                        result[key] = cached[1]
+                    continue
+                missing.append(key)
+
+        if missing:
+            with self.database.unit_of_work() as session:
+                rows = session.execute(
+                    select(BotState.key, BotState.value)
+                    .where(BotState.key.in_(missing), BotState.expires_at > _utcnow())
+                ).all()
+            found = dict(rows)
+            with self.lock:
+                for key in missing:
+                    # Пока шёл запрос, ключ могли записать здесь же - более свежий кэш не затираем
+                    cached = self.cache.get(key)
+                    if cached is None or cached[0] <= now:
+                        self.cache[key] = (now, found.get(key))
+            result.update(found)
+        return result
+
+    def set(self, key: str, value: dict, ttl: float | None = None):
+        expires_at = _utcnow() + timedelta(seconds=ttl or self.ttl)
+        with self.lock:
+            self.pending[key] = (value, expires_at)
+            self.cache[key] = (time.monotonic(), value)
+
+    def delete(self, key: str):
+        with self.lock:
+            self.pending[key] = (_DELETED, _utcnow())
+            self.cache[key] = (time.monotonic(), None)
+
+    def close(self):
+        self.stopped.set()
+        self.worker.join()
+        self.flush()
+
+    def flush(self):
+        with self.lock:
+            pending, self.pending = self.pending, {}
+            self.flushing = pending
+        if not pending:
+            return
+        upserts = [
+            {"key": key, "value": value, "expires_at": expires_at}
+            for key, (value, expires_at) in pending.items() if value is not _DELETED
+        ]
+        deletes = [key for key, (value, _) in pending.items() if value is _DELETED]
+        try:
+            with self.database.unit_of_work() as session:
+                if upserts:
+                    session.execute(self._upsert(), upserts)
+                if deletes:
+                    session.execute(delete(BotState).where(BotState.key.in_(deletes)))
+        except Exception as e:
+            print(f"Ошибка сохранения состояния: {e}")
+            # Возвращаем неудачную пачку, не затирая более свежие изменения
+            with self.lock:
+                for key, entry in pending.items():
+                    self.pending.setdefault(key, entry)
+        finally:
+            with self.lock:
+                self.flushing = {}
+
+    def sweep(self):
+        with self.database.unit_of_work() as session:
+            session.execute(delete(BotState).where(BotState.expires_at <= _utcnow()))
+        now = time.monotonic()
+        with self.lock:
+            for key in [k for k, (fetched_at, _) in self.cache.items() if now - fetched_at >= self.cache_ttl]:
+                del self.cache[key]
+
+    def _run(self):
+        last_sweep = time.monotonic()
+        while not self.stopped.wait(self.flush_interval):
+            self.flush()
+            if time.monotonic() - last_sweep >= self.sweep_interval:
+                last_sweep = time.monotonic()
+                try:
+                    self.sweep()
+                except Exception as e:
+                    print(f"Ошибка очистки состояния: {e}")
+
+    def _upsert(self):
+        dialect = postgresql if self.database.engine.dialect.name == "postgresql" else sqlite
+        statement = dialect.insert(BotState)
+        return statement.on_conflict_do_update(
+            index_elements=["key"],
+            set_={"value": statement.excluded.value, "expires_at": statement.excluded.expires_at}
+        )
+
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
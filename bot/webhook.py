@@ -0,0 +1,121 @@
+import asyncio
+import hmac
+import inspect
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response
+from telebot.types import Update
+
+from bot.metrics import CONTENT_TYPE, REGISTRY
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+async def _maybe_await(result):
+    if inspect.isawaitable(result):
+        return await result
+    return result
+
+
+class _Inflight:
+    """Счётчик обрабатываемых апдейтов для корректного завершения (draining)"""
+
+    def __init__(self):
+        self.count = 0
+        self.draining = False
+        self.condition = threading.Condition()
+
+    def __enter__(self):
+        with self.condition:
+            self.count += 1
+
+    def __exit__(self, *exc):
+        with self.condition:
+            self.count -= 1
+            self.condition.notify_all()
+
+    def wait_idle(self, timeout: float) -> bool:
+        with self.condition:
+            return self.condition.wait_for(lambda: self.count == 0, timeout)
+
+
+def create_app(feedback_bot, secret_token: str, webhook_url: str | None = None,
+               path: str = "/webhook", workers: int = 16, drain_timeout: float = 30.0) -> FastAPI:
+    """Создаёт FastAPI-приложение, принимающее апдейты Telegram через вебхук.
+
+    Апдейты передаются в обработчики, зарегистрированные FeedbackBot, так же как при long polling.
+    Синхронный TeleBot разбирает их в пуле из workers потоков и передаёт в ChatExecutor бота,
+    AsyncTeleBot обрабатывает прямо в цикле событий. Если задан webhook_url, вебхук регистрируется при старте.
+    Апдейты принимаются только с заголовком секрета secret_token, без него приложение не создаётся.
+    """
+    if not secret_token:
+        raise ValueError("Вебхук без секрета принимал бы поддельные апдейты от кого угодно")
+    bot = feedback_bot.bot
+    is_async = inspect.iscoroutinefunction(bot.process_new_updates)
+    executor = None if is_async else ThreadPoolExecutor(max_workers=workers, thread_name_prefix="webhook")
+    inflight = _Inflight()
+
+    @asynccontextmanager
+    async def lifespan(app: FastAPI):
+        feedback_bot.startup()
+        if webhook_url:
+            await _maybe_await(bot.set_webhook(url=webhook_url + path, secret_token=secret_token))
+        print("Бот запущен в режиме вебхука!")
+        try:
+            yield
+        finally:
+            # Новые апдейты получают 503 (Telegram повторит их позже), текущие дорабатываем
+            inflight.draining = True
+            if not await asyncio.to_thread(inflight.wait_idle, drain_timeout):
+                print(f"Не дождались обработки {inflight.count} апдейтов за {drain_timeout} с")
+            if executor:
+                executor.shutdown(wait=True)
+            await _maybe_await(feedback_bot.shutdown())
+
+    app = FastAPI(lifespan=lifespan)
+
+    @app.post(path)
+    async def webhook(request: Request):
+        if not hmac.compare_digest(request.headers.get(SECRET_HEADER, ""), secret_token):
+            return JSONResponse({"ok": False, "error": "invalid secret token"}, status_code=401)
+        if inflight.draining:
+            return JSONResponse({"ok": False, "error": "shutting down"}, status_code=503)
+
+        try:
+            update = Update.de_json(await request.json())
+        except Exception:
+            update = None
+        if update is None:
+            # Повторять такой запрос бессмысленно: 4xx, а не 500
+            return JSONResponse({"ok": False, "error": "malformed update"}, status_code=400)
+        with inflight:
+            try:
+                if is_async:
+                    await bot.process_new_updates([update])
+                else:
+                    await asyncio.get_running_loop().run_in_executor(executor, bot.process_new_updates, [update])
+            except Exception as e:
+                # Отвечаем 200, иначе Telegram будет присылать тот же апдейт снова
+                print(f"Ошибка обработки апдейта {update.update_id}: {e}")
+        return {"ok": True}
+
+    @app.get("/health")
+    async def health():
+        body = {
+            "status": "draining" if inflight.draining else "ok",
+            "inflight": inflight.count,
+            "feedback_queue": feedback_bot.feedback_writer.stats()["queue_depth"],
+            "outbound_queue": feedback_bot.scheduler.stats()["queue_depth"],
+            "handler_queue": feedback_bot.executor.stats()["queue_depth"] if feedback_bot.executor else 0,
+            "db_pool": feedback_bot.feedback_writer.database.pool_stats(),
+        }
+        return JSONResponse(body, status_code=503 if inflight.draining else 200)
+
+    @app.get("/metrics")
+    async def metrics():
+        return Response(REGISTRY.render(), media_type=CONTENT_TYPE)
+
+    return app
@@ -0,0 +1,132 @@
+"""Запросы для отчётов по обратной связи и потоковая выгрузка.
+
+Выгрузка за семестр из командной строки:
+    python -m db.analytics export --format csv --since 2025-02-01 --until 2025-07-01 > feedback.csv
+    python -m db.analytics counts --since 2025-02-01 --until 2025-07-01 --category liked
+С --unique повторы обратной связи (feedback.duplicate_of) не учитываются.
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+from datetime import date, datetime
+from typing import NamedTuple, TextIO
+
+from sqlalchemy import Date, func, select, tuple_
+
+from .models import Feedback
+
+# Отдельный адрес для отчётов (например, реплика), чтобы выгрузки не занимали соединения бота
+DB_REPORT_URL = os.getenv("DB_REPORT_URL")
+EXPORT_COLUMNS = ("id", "time", "student_id", "category", "message", "duplicate_of")
+
+
+class PageCursor(NamedTuple):
+    """Позиция последней выданной строки: следующая страница начинается строго после неё"""
+    time: datetime
+    id: int
+
+
+def _in_period(query, since: datetime | None, until: datetime | None, category: str | None,
+               unique: bool = False):
+    if unique:
+        query = query.where(Feedback.duplicate_of.is_(None))
+    if since is not None:
+        query = query.where(Feedback.time >= since)
+    if until is not None:
+        query = query.where(Feedback.time < until)
+    if category is not None:
+        query = query.where(Feedback.category == category)
+    return query
+
+
+def feedback_page(session, since: datetime | None = None, until: datetime | None = None,
+                  category: str | None = None, after: PageCursor | None = None,
+                  limit: int = 100, unique: bool = False) -> tuple[list, PageCursor | None]:
+    """Страница обратной связи в порядке (time, id) и курсор следующей страницы (None - это последняя).
+
+    Пагинация по ключу, а не OFFSET: каждая страница - короткий проход по индексу
+    ix_feedback_category_time (или ix_feedback_time без категории), как бы далеко она ни была.
+    """
+    # Курсор сам задаёт нижнюю границу, а лишнее условие на time сбивает планировщик SQLite с индекса
+    query = _in_period(
+        select(Feedback.id, Feedback.time, Feedback.student_id, Feedback.category, Feedback.message),
+        since if after is None else None, until, category, unique
+    )
+    if after is not None:
+        query = query.where(tuple_(Feedback.time, Feedback.id) > tuple_(after.time, after.id))
+    rows = session.execute(query.order_by(Feedback.time, Feedback.id).limit(limit)).all()
+    cursor = PageCursor(rows[-1].time, rows[-1].id) if len(rows) == limit else None
+    return rows, cursor
+
+
+def daily_counts(session, since: datetime | None = None, until: datetime | None = None,
+                 category: str | None = None, unique: bool = False) -> list[tuple[date, str, int]]:
+    """Число сообщений по дням и категориям: [(день, категория, количество), ...]"""
+    day = func.date(Feedback.time, type_=Date)
+    query = _in_period(select(day, Feedback.category, func.count()), since, until, category, unique)
+    return [tuple(row) for row in session.execute(query.group_by(day, Feedback.category).order_by(day, Feedback.category))]
+
+
+def export_feedback(database, out: TextIO, fmt: str = "csv", since: datetime | None = None,
+                    until: datetime | None = None, category: str | None = None, batch_size: int = 1000,
+                    unique: bool = False) -> int:
+    """Пишет обратную связь за период в out в формате csv или jsonl и возвращает число строк.
+
+    Строки читаются серверным курсором пачками по batch_size, поэтому память не зависит от объёма выгрузки.
+    """
+    if fmt not in ("csv", "jsonl"):
+        raise ValueError(f"Неизвестный формат выгрузки: {fmt}")
+    query = _in_period(
+        select(Feedback.id, Feedback.time, Feedback.student_id, Feedback.category, Feedback.message,
+               Feedback.duplicate_of),
+        since, until, category, unique
+    ).order_by(Feedback.time, Feedback.id).execution_options(yield_per=batch_size)
+
+    writer = csv.writer(out) if fmt == "csv" else None
+    if writer:
+        writer.writerow(EXPORT_COLUMNS)
+    count = 0
+    with database.unit_of_work() as session:
+        for row in session.execute(query):
+            if writer:
+                writer.writerow(row)
+            else:
+                record = dict(zip(EXPORT_COLUMNS, row))
+                record["time"] = record["time"].isoformat() if record["time"] else None
+                out.write(json.dumps(record, ensure_ascii=False) + "\n")
+            count += 1
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Отчёты по обратной связи")
+    parser.add_argument("command", choices=("export", "counts"))
+    parser.add_argument("--format", choices=("csv", "jsonl"), default="csv")
+    parser.add_argument("--since", type=datetime.fromisoformat)
+    parser.add_argument("--until", type=datetime.fromisoformat)
+    parser.add_argument("--category")
+    parser.add_argument("--unique", action="store_true", help="без повторов обратной связи")
+    args = parser.parse_args()
+
+    from .database import DB_URL, Database
+
+    # Отчётам хватает пары соединений, пул бота они не трогают
+    database = Database(DB_REPORT_URL or DB_URL, pool_size=2, max_overflow=0)
+    try:
+        if args.command == "export":
+            count = export_feedback(
+                database, sys.stdout, args.format, args.since, args.until, args.category, unique=args.unique
+            )
+            print(f"Выгружено строк: {count}", file=sys.stderr)
+        else:
+            with database.unit_of_work() as session:
+                for day, category, count in daily_counts(session, args.since, args.until, args.category, args.unique):
+                    print(f"{day}\t{category}\t{count}")
+    finally:
+        database.dispose()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,35 +1,251 @@
+from contextlib import asynccontextmanager, contextmanager
+from functools import lru_cache
+from typing import NamedTuple
+import threading
+import time
+
 from sqlalchemy.orm import sessionmaker
-from sqlalchemy import create_engine
+from sqlalchemy import Integer, bindparam, create_engine, exists, insert, literal, make_url, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import URL
+from sqlalchemy.sql import Executable
 from dotenv import load_dotenv
 import os
-from .models import Base
+from .models import FEEDBACK_PARTITIONED, BroadcastDelivery, Feedback, FeedbackRollup, GameChoice, Students
 
 load_dotenv()
 DB_URL = os.getenv("DB_URL")
+# Пул соединений: постоянные соединения, сколько можно открыть сверх них при всплеске,
+# сколько ждать свободного соединения, проверка перед выдачей и пересоздание старых (сек.)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "1") == "1"
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+
+
+class Statements(NamedTuple):
+    """Запросы горячего пути, собранные один раз на диалект.
+
+    SQLAlchemy кэширует компиляцию по структуре выражения, а одни и те же объекты
+    ещё и не нужно строить заново на каждую пачку.
+    """
+    insert_feedback: Executable
+    upsert_students: Executable
+    select_recent_students: Executable
+    select_recent_feedback: Executable
+    claim_recipients: Executable
+    record_deliveries: Executable
+    insert_choices: Executable
+    upsert_rollup: Executable
+    select_rollup: Executable
+
+
+@lru_cache
+def statements(dialect: str) -> Statements:
+    if dialect == "postgresql":
+        dialect_insert = postgresql.insert
+    elif dialect == "sqlite":
+        dialect_insert = sqlite.insert
+    else:
+        raise NotImplementedError(f"Upsert студентов не поддерживается для {dialect}")
+    upsert_students = dialect_insert(Students).on_conflict_do_nothing(index_elements=["id"])
+    # Повтор записи из журнала после падения не должен дублировать обратную связь. RETURNING отдаёт
+    # только действительно вставленные строки: по ним увеличиваются счётчики feedback_rollup
+    feedback = Feedback.__table__
+    insert_feedback = (
+        insert(feedback) if FEEDBACK_PARTITIONED
+        else dialect_insert(feedback).on_conflict_do_nothing(index_elements=["update_key"])
+    ).returning(feedback.c.time, feedback.c.category, feedback.c.duplicate_of)
+    choices = GameChoice.__table__
+    insert_choices = dialect_insert(choices).on_conflict_do_nothing(index_elements=["update_key"]).returning(
+        choices.c.time, choices.c.image, choices.c.part
+    )
+    rollup = FeedbackRollup.__table__
+    upsert_rollup = dialect_insert(rollup)
+    upsert_rollup = upsert_rollup.on_conflict_do_update(
+        index_elements=["day", "kind", "item"], set_={"count": rollup.c.count + upsert_rollup.excluded.count}
+    )
+    # Следующая страница получателей рассылки по id, которых она ещё не касалась, сразу помечается
+    # "sending" одним запросом; RETURNING отдаёт тех, кого взял именно этот запрос
+    # Строятся по таблице, а не по модели: ORM превратил бы их в массовые операции по объектам
+    deliveries = BroadcastDelivery.__table__
+    delivered = exists().where(
+        deliveries.c.broadcast_id == bindparam("broadcast_id"), deliveries.c.student_id == Students.id
+    )
+    claim_recipients = dialect_insert(deliveries).from_select(
+        ["broadcast_id", "student_id", "status"],
+        select(bindparam("broadcast_id", type_=Integer), Students.id, literal("sending"))
+        .where(Students.id > bindparam("after"), ~delivered)
+        .order_by(Students.id)
+        .limit(bindparam("limit"))
+    ).on_conflict_do_nothing().returning(deliveries.c.student_id)
+    record_deliveries = update(deliveries).where(
+        deliveries.c.broadcast_id == bindparam("b_broadcast_id"),
+        deliveries.c.student_id == bindparam("b_student_id"),
+    ).values(status=bindparam("b_status"), error=bindparam("b_error"), sent_at=bindparam("b_sent_at"))
+    return Statements(
+        insert_feedback=insert_feedback,
+        upsert_students=upsert_students,
+        select_recent_students=select(Students.id).order_by(Students.time.desc()).limit(bindparam("limit")),
+        select_recent_feedback=select(Feedback.student_id, Feedback.category, Feedback.message, Feedback.update_key)
+        .where(Feedback.time >= bindparam("since"), Feedback.duplicate_of.is_(None))
+        .order_by(Feedback.time.desc(), Feedback.id.desc())
+        .limit(bindparam("limit")),
+        claim_recipients=claim_recipients,
+        record_deliveries=record_deliveries,
+        insert_choices=insert_choices,
+        upsert_rollup=upsert_rollup,
+        select_rollup=select(rollup.c.day, rollup.c.kind, rollup.c.item, rollup.c.count),
+    )
+
+
+def pool_options(db_url: str | URL, pool_size: int = DB_POOL_SIZE, max_overflow: int = DB_MAX_OVERFLOW,
+                 pool_timeout: float = DB_POOL_TIMEOUT, pool_pre_ping: bool = DB_POOL_PRE_PING,
+                 pool_recycle: int = DB_POOL_RECYCLE) -> dict:
+    """Параметры пула для create_engine. SQLite в памяти живёт в одном соединении, пул ему не настраивается"""
+    url = make_url(db_url)
+    if url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:"):
+        return {}
+    return {
+        "pool_size": pool_size,
+        "max_overflow": max_overflow,
+        "pool_timeout": pool_timeout,
+        "pool_pre_ping": pool_pre_ping,
+        "pool_recycle": pool_recycle,
+    }
+
+
+class _PoolStats:
+    """Сколько времени сессии ждут соединение из пула"""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.lock = threading.Lock()
+        self.counters = {"checkouts": 0, "checkout_seconds_total": 0.0, "checkout_seconds_max": 0.0}
+
+    def record(self, elapsed: float):
+        with self.lock:
+            self.counters["checkouts"] += 1
+            self.counters["checkout_seconds_total"] += elapsed
+            self.counters["checkout_seconds_max"] = max(self.counters["checkout_seconds_max"], elapsed)
+
+    def stats(self) -> dict:
+        with self.lock:
+            stats = dict(self.counters)
+        stats["checkout_seconds_avg"] = (
+            stats["checkout_seconds_total"] / stats["checkouts"] if stats["checkouts"] else 0.0
+        )
+        pool = self.engine.pool
+        if hasattr(pool, "checkedout"):
+            stats.update(size=pool.size(), checked_out=pool.checkedout(), overflow=pool.overflow())
+        return stats
+
 
 class Database:
-    def __init__(self, db_url):
-        self.engine = create_engine(db_url)
-        self.Session = sessionmaker(bind=self.engine, autoflush=False, autocommit=False)
+    """Синхронный движок SQLAlchemy. Движок и пул создаются при первом обращении, а не при импорте"""
+
+    def __init__(self, db_url, **pool):
+        self.db_url = db_url
+        self.pool_kwargs = pool
+        self.lock = threading.Lock()
+        self._engine = None
+        self._session = None
+        self._pool = None
+
+    @property
+    def engine(self):
+        if self._engine is None:
+            with self.lock:
+                if self._engine is None:
+                    engine = create_engine(self.db_url, **pool_options(self.db_url, **self.pool_kwargs))
+                    self._session = sessionmaker(bind=engine, autoflush=False, autocommit=False)
+                    self._pool = _PoolStats(engine)
+                    self._engine = engine
+        return self._engine
+
+    @property
+    def Session(self):
+        self.engine
+        return self._session
+
+    @property
+    def pool(self) -> _PoolStats:
+        self.engine
+        return self._pool
+
+    @property
+    def statements(self) -> Statements:
+        return statements(self.engine.dialect.name)
 
     def create_session(self):
         """Создаёт сессию для работы с базой данных, которая поддерживает контекстный менеджер"""
         return self.Session()  # Возвращаем сам объект сессии
 
-    def commit(self):
-        """Подтверждает изменения в базе данных"""
-        if self.session:
-            self.session.commit()
+    @contextmanager
+    def unit_of_work(self):
+        """Сессия на одну единицу работы: commit при успехе, rollback при ошибке, соединение - обратно в пул"""
+        with self.Session() as session:
+            started = time.perf_counter()
+            session.connection()
+            self.pool.record(time.perf_counter() - started)
+            try:
+                yield session
+                session.commit()
+            except BaseException:
+                session.rollback()
+                raise
+
+    def pool_stats(self) -> dict:
+        return self.pool.stats()
+
+    def dispose(self):
+        if self._engine is not None:
+            self._engine.dispose()
+
+
+def async_url(db_url: str) -> URL:
+    """Подставляет асинхронный драйвер для того же адреса базы данных"""
+    url = make_url(db_url)
+    drivers = {"postgresql": "postgresql+asyncpg", "sqlite": "sqlite+aiosqlite"}
+    return url.set(drivername=drivers.get(url.get_backend_name(), url.drivername))
+
+
+class AsyncDatabase:
+    """Асинхронный движок SQLAlchemy для режима BOT_MODE=async"""
+
+    def __init__(self, db_url, **pool):
+        # Импорт здесь, чтобы синхронный режим не требовал асинхронных драйверов
+        from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+        url = async_url(db_url)
+        self.engine = create_async_engine(url, **pool_options(url, **pool))
+        self.Session = async_sessionmaker(bind=self.engine, autoflush=False, expire_on_commit=False)
+        self.statements = statements(self.engine.dialect.name)
+        self.pool = _PoolStats(self.engine.sync_engine)
+
+    def create_session(self):
+        """Создаёт асинхронную сессию, поддерживающую async with"""
+        return self.Session()
+
+    @asynccontextmanager
+    async def unit_of_work(self):
+        async with self.Session() as session:
+            started = time.perf_counter()
+            await session.connection()
+            self.pool.record(time.perf_counter() - started)
+            try:
+                yield session
+                await session.commit()
+            except BaseException:
+                await session.rollback()
+                raise
 
-    def close(self):
-        """Закрывает сессию"""
-        if self.session:
-            self.session.close()
+    def pool_stats(self) -> dict:
+        return self.pool.stats()
 
-    def create_all(self):
-        """Создает все таблицы в базе данных"""
-        Base.metadata.create_all(self.engine)
+    async def dispose(self):
+        await self.engine.dispose()
 
-# Инициализация базы данных
+# Подключение к базе откладывается до первого запроса; схему создают миграции (db/migrations.py)
 db = Database(DB_URL)
-db.create_all()  # Создаем все таблицы
\ No newline at end of file
@@ -0,0 +1,185 @@
+import hashlib
+import re
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from typing import NamedTuple
+
+_WORDS = re.compile(r"\w+")
+_MASK64 = (1 << 64) - 1
+_EMPTY = 1 << 64
+# Заполненные из соседних корзины помечены старшим битом и не совпадают с настоящими минимумами
+_DENSIFIED = 1 << 63
+_DENSIFY_STEP = 0x9E3779B97F4A7C15
+
+
+def normalize(text: str) -> str:
+    """Нижний регистр, ё -> е, без знаков препинания, эмодзи и лишних пробелов"""
+    return " ".join(_WORDS.findall(text.lower().replace("ё", "е")))
+
+
+class MinHasher:
+    """MinHash по символьным шинглам длины shingle в варианте "одной перестановки".
+
+    Каждый шингл хэшируется один раз и попадает в одну из num_perm корзин; значение корзины -
+    минимум попавших в неё хэшей. Так сигнатура стоит O(число шинглов), а не O(шинглы * num_perm).
+    Пустые корзины (короткий текст) заполняются из следующей непустой со сдвигом, чтобы совпадение
+    пустых корзин у разных текстов не засчитывалось как сходство.
+    Встроенный hash() строки случаен для каждого процесса, но сигнатуры живут только в памяти.
+    """
+
+    def __init__(self, num_perm: int = 64, shingle: int = 4):
+        self.num_perm = num_perm
+        self.shingle = shingle
+
+    def signature(self, normalized: str) -> array:
+        k, n = self.shingle, self.num_perm
+        bins = [_EMPTY] * n
+        for h in map(hash, {normalized[i:i + k] for i in range(max(1, len(normalized) - k + 1))}):
+            h &= _MASK64
+            slot, value = h % n, h // n
+            if value < bins[slot]:
+                bins[slot] = value
+        if _EMPTY in bins:
+            # Два прохода справа налево по кругу: каждая пустая корзина берёт ближайшую непустую справа
+            # (хотя бы один шингл есть всегда, так что на втором проходе источник уже найден)
+            source, distance = 0, 0
+            for slot in range(2 * n - 1, -1, -1):
+                value = bins[slot % n]
+                if value < _DENSIFIED:
+                    source, distance = value, 0
+                else:
+                    distance += 1
+                    if slot < n:
+                        bins[slot] = ((source + distance * _DENSIFY_STEP) & _MASK64) | _DENSIFIED
+        return array("Q", bins)
+
+
+class _Entry(NamedTuple):
+    scope: tuple
+    digest: bytes
+    signature: array
+    key: str | None
+    added_at: float
+    buckets: tuple
+
+
+class DuplicateIndex:
+    """Точные и почти точные повторы обратной связи одного студента в одной категории.
+
+    Точный повтор - совпадение хэша нормализованного текста. Почти точный - оценка сходства
+    Жаккара по MinHash не ниже threshold; кандидатов отбирает LSH: сигнатура режется на bands
+    полос, и сравниваются только записи, совпавшие с новой хотя бы в одной полосе.
+    Память ограничена: записи старше window секунд и сверх max_entries вытесняются в порядке добавления.
+    """
+
+    def __init__(self, threshold: float = 0.7, window: float = 24 * 60 * 60, max_entries: int = 20000,
+                 num_perm: int = 64, bands: int = 16, shingle: int = 4):
+        assert num_perm % bands == 0, "num_perm должно делиться на bands"
+        self.threshold = threshold
+        self.window = window
+        self.max_entries = max_entries
+        self.rows = num_perm // bands
+        self.hasher = MinHasher(num_perm, shingle)
+        self.entries: OrderedDict[int, _Entry] = OrderedDict()  # в порядке добавления
+        self.exact = {}  # (область, хэш текста) -> номер записи
+        # (область, полоса, значения полосы) -> номер записи или список номеров: почти все корзины
+        # содержат одну запись, и отдельный список на каждую удвоил бы память индекса
+        self.buckets = {}
+        self.by_key = {}  # ключ сообщения -> номер записи
+        self.next_id = 0
+        self.lock = threading.Lock()
+        self.counters = {"checked": 0, "exact": 0, "near": 0, "evicted": 0}
+
+    def match(self, student_id: int, category: str, text: str, key: str | None) -> str | None:
+        """Ключ более раннего сообщения, повтором которого является text, иначе None.
+
+        Сообщение, не оказавшееся повтором, добавляется в индекс.
+        """
+        normalized = normalize(text) or text.strip()
+        scope = (student_id, category)
+        digest = hashlib.blake2b(normalized.encode(), digest_size=8).digest()
+        now = time.monotonic()
+        with self.lock:
+            self.counters["checked"] += 1
+            self._evict(now)
+            original = self.exact.get((scope, digest))
+            if original is not None:
+                self.counters["exact"] += 1
+                return self.entries[original].key
+
+        signature = self.hasher.signature(normalized)
+        rows = self.rows
+        buckets = tuple(
+            hash((scope, band, signature[band * rows:(band + 1) * rows].tobytes()))
+            for band in range(len(signature) // rows)
+        )
+        with self.lock:
+            candidates = set()
+            for bucket in buckets:
+                ids = self.buckets.get(bucket)
+                if isinstance(ids, list):
+                    candidates.update(ids)
+                elif ids is not None:
+                    candidates.add(ids)
+            for entry_id in sorted(candidates):
+                entry = self.entries[entry_id]
+                same = sum(1 for mine, theirs in zip(signature, entry.signature) if mine == theirs)
+                if same >= self.threshold * len(signature):
+                    self.counters["near"] += 1
+                    return entry.key
+            self._add(_Entry(scope, digest, signature, key, now, buckets))
+        return None
+
+    def discard(self, keys):
+        """Убирает записи, которые так и не попали в базу"""
+        with self.lock:
+            for key in keys:
+                entry_id = self.by_key.get(key)
+                if entry_id is not None:
+                    self._remove(entry_id)
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {**self.counters, "size": len(self.entries)}
+
+    def _add(self, entry: _Entry):
+        entry_id = self.next_id
+        self.next_id += 1
+        self.entries[entry_id] = entry
+        self.exact[(entry.scope, entry.digest)] = entry_id
+        if entry.key is not None:
+            self.by_key[entry.key] = entry_id
+        for bucket in entry.buckets:
+            ids = self.buckets.setdefault(bucket, entry_id)
+            if isinstance(ids, list):
+                ids.append(entry_id)
+            elif ids != entry_id:
+                self.buckets[bucket] = [ids, entry_id]
+
+    def _remove(self, entry_id: int):
+        entry = self.entries.pop(entry_id)
+        if self.exact.get((entry.scope, entry.digest)) == entry_id:
+            del self.exact[(entry.scope, entry.digest)]
+        if entry.key is not None and self.by_key.get(entry.key) == entry_id:
+            del self.by_key[entry.key]
+        for bucket in entry.buckets:
+            ids = self.buckets[bucket]
+            if not isinstance(ids, list):
+                del self.buckets[bucket]
+                continue
+            ids.remove(entry_id)
+            if len(ids) == 1:
+                self.buckets[bucket] = ids[0]
+
+    def _evict(self, now: float):
+        while self.entries:
+            entry_id, entry = next(iter(self.entries.items()))
+            if len(self.entries) < self.max_entries and now - entry.added_at < self.window:
+                return
+            self._remove(entry_id)
+            self.counters["evicted"] += 1
@@ -0,0 +1,456 @@
+import asyncio
+import queue
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from sqlalchemy.exc import DataError, IntegrityError
+
+from .dedup import DuplicateIndex
+from .known_students import KnownStudents
+from .rollup import Rollup, rollup_deltas, rollup_rows
+
+_STOP = object()
+
+
+def _rejected(error: Exception) -> bool:
+    """Ошибка в самих данных пачки (NULL в NOT NULL, выход за диапазон типа): повтор её не исправит"""
+    return isinstance(error, (IntegrityError, DataError)) and not error.connection_invalidated
+
+
+class FeedbackWriter:
+    """Отложенная (write-behind) запись обратной связи пачками.
+
+    Обработчик сообщений только кладёт запись в ограниченную очередь, а фоновый поток
+    сбрасывает её в базу по достижении batch_size или по истечении flush_interval секунд
+    одним многострочным INSERT в feedback. Студенты, которых ещё нет в кэше known_students
+    (он прогревается из базы при старте), предварительно добавляются одним upsert.
+    Если очередь заполнена, submit блокирует вызывающий поток (backpressure).
+
+    С журналом (db.journal.UpdateJournal) запись с ключом сначала попадает на диск и отмечается
+    сохранённой только после фиксации транзакции; незафиксированное перечитывается при следующем старте.
+
+    С индексом повторов (db.dedup.DuplicateIndex) каждая пачка перед записью проверяется на повторы:
+    повтор сохраняется с duplicate_of или, если collapse_duplicates, не сохраняется вовсе. Проверка
+    идёт в потоке записи, поэтому обработчик сообщения её не ждёт.
+
+    Выборы вариантов в игре (submit_choice) идут той же очередью в game_choice. В той же транзакции
+    увеличиваются счётчики feedback_rollup по действительно вставленным строкам, а после фиксации -
+    их копия в памяти (db.rollup.Rollup).
+
+    Пачка, которую база отвергла из-за данных, делится пополам, пока не останутся отдельные
+    строки, которые она не принимает. Такие строки откладываются в журнал отвергнутых
+    (UpdateJournal.reject) и отмечаются обработанными, чтобы не перечитываться при каждом старте.
+    Ошибки соединения повторяются retries раз, после чего пачка остаётся в журнале до следующего старта.
+    """
+
+    def __init__(self, database, batch_size: int = 100, flush_interval: float = 0.5,
+                 max_queue: int = 10000, put_timeout: float = 5.0, retries: int = 3,
+                 known_students: int = 10000, journal=None, dedup: DuplicateIndex | None = None,
+                 collapse_duplicates: bool = False, rollup: Rollup | None = None):
+        self.database = database
+        self.known_students = KnownStudents(known_students)
+        self.journal = journal
+        self.dedup = dedup
+        self.collapse_duplicates = collapse_duplicates
+        self.rollup = rollup
+        self.replay = []
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.put_timeout = put_timeout
+        self.retries = retries
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.worker = None
+        self.lock = threading.Lock()
+        self.counters = {
+            "submitted": 0,
+            "written": 0,
+            "choices": 0,
+            "duplicates": 0,
+            "failed": 0,
+            "rejected": 0,
+            "flushes": 0,
+            "flush_seconds_total": 0.0,
+            "flush_seconds_max": 0.0,
+            "last_flush_seconds": 0.0,
+        }
+
+    def open_journal(self):
+        if self.journal is not None:
+            self.replay = self.journal.open()
+            if self.replay:
+                print(f"Из журнала будет дописано записей обратной связи: {len(self.replay)}")
+
+    def start(self):
+        if self.worker is None:
+            self.open_journal()
+            self.worker = threading.Thread(target=self._run, name="feedback-writer", daemon=True)
+            self.worker.start()
+
+    def submit(self, student_id: int, name: str, category: str, message: str, key: str | None = None) -> bool:
+        """Ставит запись в очередь. Бросает queue.Full, если база не успевает за входящим потоком.
+
+        Возвращает False, если запись с этим ключом уже была принята (повторная доставка апдейта).
+        """
+        return self._put({"student_id": student_id, "name": name, "category": category, "message": message}, key)
+
+    def submit_choice(self, student_id: int, name: str, image: int, part: int, key: str | None = None) -> bool:
+        """Ставит в очередь выбор варианта part на карточке image; возвращает то же, что submit"""
+        return self._put({"student_id": student_id, "name": name, "image": image, "part": part}, key)
+
+    def _put(self, row: dict, key: str | None) -> bool:
+        row = self._journaled(row, key)
+        if row is None:
+            return False
+        self.queue.put(row, timeout=self.put_timeout)
+        with self.lock:
+            self.counters["submitted"] += 1
+        return True
+
+    def close(self, timeout: float | None = 30.0):
+        """Останавливает поток записи, гарантированно сбросив всё, что уже в очереди"""
+        if self.worker is None:
+            return
+        self.queue.put(_STOP)
+        self.worker.join(timeout)
+        if self.worker.is_alive():
+            # Поток ещё сбрасывает пачки и отмечает их в журнале, поэтому журнал не закрываем:
+            # что не успеет сохраниться, допишется из журнала при следующем старте
+            print(f"Запись обратной связи не завершилась за {timeout} с, в очереди: {self.queue.qsize()}")
+            return
+        self.worker = None
+        if self.journal is not None:
+            self.journal.close()
+
+    def stats(self) -> dict:
+        with self.lock:
+            stats = dict(self.counters)
+        stats["queue_depth"] = self.queue.qsize()
+        stats["flush_seconds_avg"] = stats["flush_seconds_total"] / stats["flushes"] if stats["flushes"] else 0.0
+        stats["known_students"] = self.known_students.stats()
+        if self.journal is not None:
+            stats["journal"] = self.journal.stats()
+        if self.dedup is not None:
+            stats["dedup"] = self.dedup.stats()
+        if self.rollup is not None:
+            stats["rollup"] = self.rollup.stats()
+        return stats
+
+    def _journaled(self, row: dict, key: str | None) -> dict | None:
+        if self.journal is not None and key is not None and not self.journal.append(key, row):
+            return None
+        return {**row, "key": key}
+
+    def warm(self):
+        """Заполняет кэш известных студентов недавно писавшими, а индекс повторов - недавней обратной связью"""
+        try:
+            with self.database.unit_of_work() as session:
+                ids = session.execute(
+                    self.database.statements.select_recent_students, {"limit": self.known_students.max_entries}
+                ).scalars().all()
+                recent = session.execute(*self._recent_feedback()).all() if self.dedup is not None else []
+        except Exception as e:
+            print(f"Не удалось прогреть кэш студентов и индекс повторов: {e}")
+            return
+        self._warmed(ids, recent)
+
+    def _recent_feedback(self) -> tuple:
+        since = datetime.now() - timedelta(seconds=self.dedup.window)
+        return self.database.statements.select_recent_feedback, {"since": since, "limit": self.dedup.max_entries}
+
+    def _warmed(self, ids: list[int], recent: list):
+        # Самые недавние - последними, чтобы они вытеснялись позже остальных
+        self.known_students.add(reversed(ids))
+        for student_id, category, message, key in reversed(recent):
+            self.dedup.match(student_id, category, message or "", key)
+
+    def _run(self):
+        self.warm()
+        for start in range(0, len(self.replay), self.batch_size):
+            self._flush(self.replay[start:start + self.batch_size])
+        self.replay = []
+        stopping = False
+        while not stopping:
+            item = self.queue.get()
+            if item is _STOP:
+                break
+            batch = [item]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self.queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+            self._flush(batch)
+
+        # Досбрасываем то, что успели положить до сигнала остановки
+        rest = []
+        while True:
+            try:
+                item = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not _STOP:
+                rest.append(item)
+        for start in range(0, len(rest), self.batch_size):
+            self._flush(rest[start:start + self.batch_size])
+
+    def _flush(self, batch: list[dict]):
+        students, feedback, choices = self._split(batch)
+        statements = self.database.statements
+        started = time.perf_counter()
+        for attempt in range(1, self.retries + 1):
+            try:
+                with self.database.unit_of_work() as session:
+                    if students:
+                        session.execute(statements.upsert_students, students)
+                    inserted = session.execute(statements.insert_feedback, feedback).all() if feedback else []
+                    chosen = session.execute(statements.insert_choices, choices).all() if choices else []
+                    deltas = rollup_deltas(inserted, chosen)
+                    if deltas:
+                        session.execute(statements.upsert_rollup, rollup_rows(deltas))
+                break
+            except Exception as e:
+                if _rejected(e):
+                    for half in self._halves(batch, e):
+                        self._flush(half)
+                    return
+                if not self._failed(batch, attempt, e):
+                    return
+                time.sleep(0.1 * 2 ** attempt)
+        self._flushed(batch, deltas, time.perf_counter() - started)
+
+    def _split(self, batch: list[dict]) -> tuple[list[dict], list[dict], list[dict]]:
+        """Строки для upsert студентов, которых нет в кэше, для feedback и для game_choice"""
+        new = self.known_students.unknown({row["student_id"] for row in batch})
+        students = {}
+        for row in batch:
+            if row["student_id"] in new:
+                students.setdefault(row["student_id"], {"id": row["student_id"], "name": row["name"]})
+        feedback, choices = [], []
+        for row in batch:
+            if "image" in row:
+                choices.append({
+                    "student_id": row["student_id"],
+                    "image": row["image"],
+                    "part": row["part"],
+                    "update_key": row.get("key"),
+                })
+                continue
+            duplicate_of = self._duplicate_of(row)
+            if duplicate_of is not None and self.collapse_duplicates:
+                continue
+            feedback.append({
+                "student_id": row["student_id"],
+                "category": row["category"],
+                "message": row["message"],
+                "update_key": row.get("key"),
+                "duplicate_of": duplicate_of,
+            })
+        return list(students.values()), feedback, choices
+
+    def _duplicate_of(self, row: dict) -> str | None:
+        if self.dedup is None:
+            return None
+        # Половины отвергнутой пачки проверяются заново, а индекс уже помнит их строки
+        if "duplicate_of" in row:
+            return row["duplicate_of"]
+        original = self.dedup.match(row["student_id"], row["category"], row["message"] or "", row.get("key"))
+        # Запись из журнала, уже сохранённая до падения, совпадает сама с собой
+        if original == row.get("key"):
+            original = None
+        row["duplicate_of"] = original
+        if original is not None:
+            with self.lock:
+                self.counters["duplicates"] += 1
+        return original
+
+    def _failed(self, batch: list[dict], attempt: int, error: Exception) -> bool:
+        """Логирует ошибку и возвращает True, если стоит повторить попытку"""
+        print(f"Ошибка сохранения пачки обратной связи (попытка {attempt}): {error}")
+        if attempt < self.retries:
+            return True
+        with self.lock:
+            self.counters["failed"] += len(batch)
+        if self.dedup is not None:
+            # Несохранённые сообщения не должны считаться оригиналами для следующих
+            self.dedup.discard(row.get("key") for row in batch)
+        return False
+
+    def _halves(self, batch: list[dict], error: Exception) -> list[list[dict]]:
+        """Половины отвергнутой базой пачки; строку, которую база не принимает саму по себе, откладывает"""
+        if len(batch) > 1:
+            middle = len(batch) // 2
+            return [batch[:middle], batch[middle:]]
+        row = batch[0]
+        print(f"База не принимает запись обратной связи, она отложена в журнал отвергнутых: {row}: {error}")
+        with self.lock:
+            self.counters["failed"] += 1
+            self.counters["rejected"] += 1
+        if self.dedup is not None:
+            self.dedup.discard([row.get("key")])
+        if self.journal is not None:
+            self.journal.reject(row, str(error))
+        return []
+
+    def _flushed(self, batch: list[dict], deltas: Counter, elapsed: float):
+        # Студенты попадают в кэш только после фиксации транзакции, в которой их добавили
+        self.known_students.add({row["student_id"] for row in batch})
+        if self.journal is not None:
+            self.journal.commit([row.get("key") for row in batch])
+        if self.rollup is not None and deltas:
+            self.rollup.add(deltas)
+        with self.lock:
+            self.counters["written"] += sum(count for (_, kind, _), count in deltas.items() if kind == "feedback")
+            self.counters["choices"] += sum(count for (_, kind, _), count in deltas.items() if kind == "choice")
+            self.counters["flushes"] += 1
+            self.counters["flush_seconds_total"] += elapsed
+            self.counters["flush_seconds_max"] = max(self.counters["flush_seconds_max"], elapsed)
+            self.counters["last_flush_seconds"] = elapsed
+
+
+class AsyncFeedbackWriter(FeedbackWriter):
+    """Тот же write-behind, но на asyncio и асинхронном движке SQLAlchemy (BOT_MODE=async).
+
+    submit и close здесь корутины, сброс выполняет фоновая задача в цикле событий. Запись в журнал
+    и его fsync идут в отдельном потоке журнала, чтобы цикл событий не ждал диска.
+    """
+
+    def __init__(self, database, batch_size: int = 100, flush_interval: float = 0.5,
+                 max_queue: int = 10000, put_timeout: float = 5.0, retries: int = 3,
+                 known_students: int = 10000, journal=None, dedup: DuplicateIndex | None = None,
+                 collapse_duplicates: bool = False, rollup: Rollup | None = None):
+        super().__init__(
+            database, batch_size, flush_interval, max_queue, put_timeout, retries, known_students, journal,
+            dedup, collapse_duplicates, rollup
+        )
+        self.queue = asyncio.Queue(maxsize=max_queue)
+        self.journal_thread = None
+
+    def start(self):
+        if self.worker is None:
+            self.open_journal()
+            if self.journal is not None:
+                self.journal_thread = ThreadPoolExecutor(1, thread_name_prefix="feedback-journal")
+            self.worker = asyncio.get_running_loop().create_task(self._run())
+
+    async def _journal_io(self, fn, *args):
+        """Вызывает fn, который пишет в журнал, в потоке журнала (до start - сразу)"""
+        if self.journal_thread is None:
+            return fn(*args)
+        return await asyncio.get_running_loop().run_in_executor(self.journal_thread, fn, *args)
+
+    async def submit(self, student_id: int, name: str, category: str, message: str, key: str | None = None) -> bool:
+        """Ставит запись в очередь. Бросает TimeoutError, если база не успевает за входящим потоком"""
+        return await self._put({"student_id": student_id, "name": name, "category": category, "message": message}, key)
+
+    async def submit_choice(self, student_id: int, name: str, image: int, part: int, key: str | None = None) -> bool:
+        return await self._put({"student_id": student_id, "name": name, "image": image, "part": part}, key)
+
+    async def _put(self, row: dict, key: str | None) -> bool:
+        row = await self._journal_io(self._journaled, row, key)
+        if row is None:
+            return False
+        await asyncio.wait_for(self.queue.put(row), self.put_timeout)
+        with self.lock:
+            self.counters["submitted"] += 1
+        return True
+
+    async def close(self, timeout: float | None = 30.0):
+        if self.worker is None:
+            return
+        await self.queue.put(_STOP)
+        try:
+            await asyncio.wait_for(self.worker, timeout)
+        except asyncio.TimeoutError:
+            # wait_for уже отменил задачу и дождался её: журнал больше никто не трогает,
+            # и то, что не успело сохраниться, допишется из него при следующем старте
+            print(f"Запись обратной связи не завершилась за {timeout} с, в очереди: {self.queue.qsize()}")
+        self.worker = None
+        if self.journal is not None:
+            await self._journal_io(self.journal.close)
+        if self.journal_thread is not None:
+            self.journal_thread.shutdown()
+            self.journal_thread = None
+
+    async def warm(self):
+        try:
+            async with self.database.unit_of_work() as session:
+                result = await session.execute(
+                    self.database.statements.select_recent_students, {"limit": self.known_students.max_entries}
+                )
+                ids = result.scalars().all()
+                recent = (await session.execute(*self._recent_feedback())).all() if self.dedup is not None else []
+        except Exception as e:
+            print(f"Не удалось прогреть кэш студентов и индекс повторов: {e}")
+            return
+        await asyncio.to_thread(self._warmed, ids, recent)
+
+    async def _run(self):
+        await self.warm()
+        for start in range(0, len(self.replay), self.batch_size):
+            await self._flush(self.replay[start:start + self.batch_size])
+        self.replay = []
+        stopping = False
+        while not stopping:
+            item = await self.queue.get()
+            if item is _STOP:
+                break
+            batch = [item]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self.queue.get(), remaining)
+                except asyncio.TimeoutError:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+            await self._flush(batch)
+
+        rest = []
+        while not self.queue.empty():
+            item = self.queue.get_nowait()
+            if item is not _STOP:
+                rest.append(item)
+        for start in range(0, len(rest), self.batch_size):
+            await self._flush(rest[start:start + self.batch_size])
+
+    async def _flush(self, batch: list[dict]):
+        # MinHash повторов считается в отдельном потоке, чтобы не задерживать цикл событий
+        students, feedback, choices = await asyncio.to_thread(self._split, batch) if self.dedup else self._split(batch)
+        statements = self.database.statements
+        started = time.perf_counter()
+        for attempt in range(1, self.retries + 1):
+            try:
+                async with self.database.unit_of_work() as session:
+                    if students:
+                        await session.execute(statements.upsert_students, students)
+                    inserted = (await session.execute(statements.insert_feedback, feedback)).all() if feedback else []
+                    chosen = (await session.execute(statements.insert_choices, choices)).all() if choices else []
+                    deltas = rollup_deltas(inserted, chosen)
+                    if deltas:
+                        await session.execute(statements.upsert_rollup, rollup_rows(deltas))
+                break
+            except Exception as e:
+                if _rejected(e):
+                    for half in await self._journal_io(self._halves, batch, e):
+                        await self._flush(half)
+                    return
+                if not self._failed(batch, attempt, e):
+                    return
+                await asyncio.sleep(0.1 * 2 ** attempt)
+        await self._journal_io(self._flushed, batch, deltas, time.perf_counter() - started)
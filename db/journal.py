@@ -0,0 +1,177 @@
+import json
+import os
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+
+class UpdateJournal:
+    """Локальный журнал входящей обратной связи: запись попадает на диск до обработки.
+
+    Журнал - это сегментные файлы из строк "crc32 json". Запись "put" добавляется до постановки
+    в очередь записи в базу, запись "done" - после фиксации транзакции. Закрытый сегмент, все записи
+    которого зафиксированы, удаляется. При старте незафиксированные записи перечитываются, а
+    недавно зафиксированные ключи помнятся, чтобы повторно доставленный апдейт не сохранился дважды.
+    Запись, которую база не принимает, откладывается в rejected.jsonl рядом с сегментами для разбора вручную.
+
+    fsync выполняется не на каждую запись, а раз в fsync_batch записей или fsync_interval секунд:
+    write+flush уже переживают падение процесса, fsync нужен только на случай отказа машины.
+    """
+
+    def __init__(self, directory: str, segment_bytes: int = 4 * 2 ** 20, fsync_batch: int = 64,
+                 fsync_interval: float = 0.05, remember_done: int = 100000):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.fsync_batch = fsync_batch
+        self.fsync_interval = fsync_interval
+        self.remember_done = remember_done
+        self.lock = threading.Lock()
+        self.pending = {}  # ключ -> запись, ещё не зафиксированная в базе
+        self.segment_of = {}  # ключ -> номер сегмента с его "put"
+        self.open_keys = {}  # номер сегмента -> ключи, которые в нём ещё не зафиксированы
+        self.done = OrderedDict()  # недавно зафиксированные ключи
+        self.file = None
+        self.segment = 0
+        self.unsynced = 0
+        self.synced_at = time.monotonic()
+        self.rejected_path = os.path.join(directory, "rejected.jsonl")
+        self.counters = {"appended": 0, "committed": 0, "duplicates": 0, "fsyncs": 0, "rejected": 0, "replayed": 0}
+
+    def open(self) -> list[dict]:
+        """Читает журнал, переписывает незафиксированные записи в новый сегмент и возвращает их"""
+        os.makedirs(self.directory, exist_ok=True)
+        old = self._segments()
+        for segment in old:
+            for entry in self._read(segment):
+                keys = entry["k"] if isinstance(entry["k"], list) else [entry["k"]]
+                if entry["op"] == "put":
+                    self.pending[keys[0]] = entry["r"]
+                else:
+                    for key in keys:
+                        self.pending.pop(key, None)
+                        self._remember(key)
+        self.segment = old[-1] + 1 if old else 1
+        self._open_segment()
+        with self.lock:
+            # Зафиксированные ключи переносим одной строкой, чтобы защита от повторов пережила сжатие
+            if self.done:
+                self._write({"op": "done", "k": list(self.done)})
+            for key, record in self.pending.items():
+                self._write({"op": "put", "k": key, "r": record})
+                self._track(key)
+            self._sync()
+        for segment in old:
+            os.remove(self._path(segment))
+        self.counters["replayed"] = len(self.pending)
+        return [dict(record, key=key) for key, record in self.pending.items()]
+
+    def append(self, key: str, record: dict) -> bool:
+        """Записывает обратную связь до обработки. False - этот ключ уже в журнале (повторная доставка)"""
+        with self.lock:
+            if key in self.pending or key in self.done:
+                self.counters["duplicates"] += 1
+                return False
+            self.pending[key] = record
+            self._write({"op": "put", "k": key, "r": record})
+            self._track(key)
+            self.counters["appended"] += 1
+            if self.unsynced >= self.fsync_batch or time.monotonic() - self.synced_at >= self.fsync_interval:
+                self._sync()
+            if self.file.tell() >= self.segment_bytes:
+                self._rotate()
+        return True
+
+    def commit(self, keys: list[str]):
+        """Отмечает записи сохранёнными в базе и удаляет полностью зафиксированные сегменты"""
+        keys = [key for key in keys if key is not None]
+        if not keys:
+            return
+        with self.lock:
+            self._write({"op": "done", "k": keys})
+            for key in keys:
+                self.pending.pop(key, None)
+                self._remember(key)
+                segment = self.segment_of.pop(key, None)
+                if segment is not None:
+                    self.open_keys[segment].discard(key)
+            self.counters["committed"] += len(keys)
+            self._sync()
+            for segment in [s for s, open_keys in self.open_keys.items() if not open_keys and s != self.segment]:
+                del self.open_keys[segment]
+                os.remove(self._path(segment))
+
+    def reject(self, row: dict, error: str):
+        """Откладывает запись, которую база не принимает, в rejected.jsonl и отмечает её обработанной"""
+        record = {key: value for key, value in row.items() if key != "key"}
+        entry = {"k": row.get("key"), "r": record, "error": error, "at": time.time()}
+        with self.lock, open(self.rejected_path, "a", encoding="utf-8") as file:
+            file.write(json.dumps(entry, ensure_ascii=False, default=str) + "\n")
+            file.flush()
+            os.fsync(file.fileno())
+            self.counters["rejected"] += 1
+        self.commit([row.get("key")])
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self._sync()
+                self.file.close()
+                self.file = None
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {**self.counters, "pending": len(self.pending), "segments": len(self.open_keys)}
+
+    def _remember(self, key: str):
+        self.done[key] = None
+        self.done.move_to_end(key)
+        while len(self.done) > self.remember_done:
+            self.done.popitem(last=False)
+
+    def _track(self, key: str):
+        self.segment_of[key] = self.segment
+        self.open_keys.setdefault(self.segment, set()).add(key)
+
+    def _write(self, entry: dict):
+        payload = json.dumps(entry, ensure_ascii=False, separators=(",", ":"))
+        self.file.write(f"{zlib.crc32(payload.encode()):08x} {payload}\n")
+        self.file.flush()
+        self.unsynced += 1
+
+    def _sync(self):
+        if self.unsynced:
+            os.fsync(self.file.fileno())
+            self.unsynced = 0
+            self.counters["fsyncs"] += 1
+        self.synced_at = time.monotonic()
+
+    def _rotate(self):
+        self._sync()
+        self.file.close()
+        closed = self.segment
+        self.segment += 1
+        self._open_segment()
+        if not self.open_keys.get(closed):
+            self.open_keys.pop(closed, None)
+            os.remove(self._path(closed))
+
+    def _open_segment(self):
+        self.file = open(self._path(self.segment), "a", encoding="utf-8")
+        self.open_keys.setdefault(self.segment, set())
+
+    def _path(self, segment: int) -> str:
+        return os.path.join(self.directory, f"journal-{segment:08d}.log")
+
+    def _segments(self) -> list[int]:
+        names = [name for name in os.listdir(self.directory) if name.startswith("journal-") and name.endswith(".log")]
+        return sorted(int(name[len("journal-"):-len(".log")]) for name in names)
+
+    def _read(self, segment: int):
+        with open(self._path(segment), encoding="utf-8") as file:
+            for line in file:
+                checksum, _, payload = line.rstrip("\n").partition(" ")
+                # Оборванная последняя строка после падения - дальше читать нечего
+                if not payload or f"{zlib.crc32(payload.encode()):08x}" != checksum:
+                    return
+                yield json.loads(payload)
@@ -0,0 +1,45 @@
+import threading
+from collections import OrderedDict
+
+
+class KnownStudents:
+    """Ограниченный LRU-кэш id студентов, которые уже есть в таблице students.
+
+    Запись обратной связи от известного студента не требует обращения к students:
+    upsert выполняется только для id, которых нет в кэше. Кэш лишь оптимизация -
+    студент, вытесненный из него, просто ещё раз пройдёт через ON CONFLICT DO NOTHING.
+    """
+
+    def __init__(self, max_entries: int = 10000):
+        self.max_entries = max_entries
+        self.ids = OrderedDict()  # id -> None, в порядке последнего обращения
+        self.lock = threading.Lock()
+        self.counters = {"hits": 0, "misses": 0}
+
+    def unknown(self, ids) -> set[int]:
+        """Возвращает id, которых нет в кэше; известные помечаются как недавно использованные"""
+        missing = set()
+        with self.lock:
+            for student_id in ids:
+                if student_id in self.ids:
+                    self.ids.move_to_end(student_id)
+                    self.counters["hits"] += 1
+                else:
+                    missing.add(student_id)
+                    self.counters["misses"] += 1
+        return missing
+
+    def add(self, ids):
+        with self.lock:
+            for student_id in ids:
+                self.ids[student_id] = None
+                self.ids.move_to_end(student_id)
+            while len(self.ids) > self.max_entries:
+                self.ids.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {**self.counters, "size": len(self.ids)}
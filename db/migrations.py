@@ -0,0 +1,258 @@
+"""Версионированные миграции схемы.
+
+Каждая миграция - функция с номером версии, выполняется один раз в своей транзакции;
+номер применённой версии хранится в таблице schema_version. Применить миграции:
+    python -m db.migrations
+Проверить версию схемы одним запросом (код выхода 1, если схема устарела):
+    python -m db.migrations --check
+"""
+import argparse
+import sys
+from typing import Callable, NamedTuple
+
+from sqlalchemy import (
+    JSON, Column, Date, DateTime, ForeignKey, Index, Integer, MetaData, String, Table, Text, func, inspect, select, text
+)
+from sqlalchemy.engine import Connection
+from sqlalchemy.exc import DBAPIError
+
+from .models import FEEDBACK_PARTITIONED
+from .partitions import ensure_feedback_partitions
+from .rollup import rebuild_rollup
+
+schema_version = Table(
+    "schema_version", MetaData(),
+    Column("version", Integer, primary_key=True),
+    Column("description", String, nullable=False),
+    Column("applied_at", DateTime, default=func.now()),
+)
+
+
+class Migration(NamedTuple):
+    version: int
+    description: str
+    apply: Callable[[Connection], None]
+
+
+MIGRATIONS: list[Migration] = []
+
+
+def migration(version: int, description: str):
+    def register(apply: Callable[[Connection], None]):
+        assert not MIGRATIONS or MIGRATIONS[-1].version < version, "миграции объявляются по возрастанию версии"
+        MIGRATIONS.append(Migration(version, description, apply))
+        return apply
+
+    return register
+
+
+# Миграции описывают таблицы так, как их создавала своя версия схемы, а не моделями db.models:
+# модели меняются вместе с кодом, а уже выпущенная миграция должна создавать ровно то же, что и раньше
+
+@migration(1, "таблицы students, feedback, bot_state")
+def _initial(connection: Connection):
+    metadata = MetaData()
+    Table(
+        "students", metadata,
+        Column("id", Integer, primary_key=True),
+        Column("name", String),
+        Column("time", DateTime),
+    )
+    Table(
+        "feedback", metadata,
+        Column("id", Integer, primary_key=True, autoincrement=True),
+        Column("student_id", Integer, ForeignKey("students.id")),
+        Column("category", String),
+        Column("message", String),
+        Column("time", DateTime, primary_key=FEEDBACK_PARTITIONED, nullable=False),
+        Index("ix_feedback_category_time", "category", "time", "id"),
+        Index("ix_feedback_time", "time", "id"),
+        Index("ix_feedback_student_id", "student_id"),
+        **({"postgresql_partition_by": "RANGE (time)"} if FEEDBACK_PARTITIONED else {}),
+    )
+    Table(
+        "bot_state", metadata,
+        Column("key", String, primary_key=True),
+        Column("value", JSON, nullable=False),
+        Column("expires_at", DateTime, nullable=False, index=True),
+    )
+    # checkfirst: базы, созданные до миграций через create_all, уже содержат эти таблицы
+    metadata.create_all(connection)
+
+
+@migration(2, "индексы feedback по category, time и student_id")
+def _feedback_indexes(connection: Connection):
+    feedback = Table(
+        "feedback", MetaData(),
+        Column("id", Integer), Column("student_id", Integer), Column("category", String), Column("time", DateTime),
+    )
+    for index in (
+        Index("ix_feedback_category_time", feedback.c.category, feedback.c.time, feedback.c.id),
+        Index("ix_feedback_time", feedback.c.time, feedback.c.id),
+        Index("ix_feedback_student_id", feedback.c.student_id),
+    ):
+        index.create(connection, checkfirst=True)
+
+
+@migration(3, "feedback.time NOT NULL")
+def _feedback_time_not_null(connection: Connection):
+    # SQLite не меняет ограничения существующих столбцов, там NOT NULL есть только у новых таблиц
+    if connection.dialect.name != "postgresql":
+        return
+    connection.execute(text("UPDATE feedback SET time = now() WHERE time IS NULL"))
+    connection.execute(text("ALTER TABLE feedback ALTER COLUMN time SET NOT NULL"))
+
+
+@migration(4, "feedback.update_key для идемпотентной записи")
+def _feedback_update_key(connection: Connection):
+    if "update_key" not in {column["name"] for column in inspect(connection).get_columns("feedback")}:
+        connection.execute(text("ALTER TABLE feedback ADD COLUMN update_key VARCHAR"))
+    feedback = Table("feedback", MetaData(), Column("update_key", String))
+    # В секционированной таблице уникальный индекс обязан включать time
+    Index("ux_feedback_update_key", feedback.c.update_key, unique=not FEEDBACK_PARTITIONED).create(
+        connection, checkfirst=True
+    )
+
+
+@migration(5, "таблицы рассылок broadcast и broadcast_delivery")
+def _broadcasts(connection: Connection):
+    metadata = MetaData()
+    Table(
+        "broadcast", metadata,
+        Column("id", Integer, primary_key=True, autoincrement=True),
+        Column("text", Text, nullable=False),
+        Column("created_at", DateTime, nullable=False),
+        Column("finished_at", DateTime),
+    )
+    Table(
+        "broadcast_delivery", metadata,
+        Column("broadcast_id", Integer, ForeignKey("broadcast.id"), primary_key=True),
+        Column("student_id", Integer, primary_key=True),
+        Column("status", String, nullable=False),
+        Column("error", String),
+        Column("sent_at", DateTime),
+    )
+    metadata.create_all(connection)
+
+
+@migration(6, "feedback.duplicate_of для повторов обратной связи")
+def _feedback_duplicate_of(connection: Connection):
+    if "duplicate_of" not in {column["name"] for column in inspect(connection).get_columns("feedback")}:
+        connection.execute(text("ALTER TABLE feedback ADD COLUMN duplicate_of VARCHAR"))
+
+
+@migration(7, "события game_choice и счётчики feedback_rollup")
+def _rollup(connection: Connection):
+    metadata = MetaData()
+    # Только для внешнего ключа game_choice.student_id, students уже создана миграцией 1
+    Table("students", metadata, Column("id", Integer, primary_key=True))
+    game_choice = Table(
+        "game_choice", metadata,
+        Column("id", Integer, primary_key=True, autoincrement=True),
+        Column("student_id", Integer, ForeignKey("students.id")),
+        Column("image", Integer, nullable=False),
+        Column("part", Integer, nullable=False),
+        Column("time", DateTime, nullable=False),
+        Column("update_key", String, unique=True),
+    )
+    feedback_rollup = Table(
+        "feedback_rollup", metadata,
+        Column("day", Date, primary_key=True),
+        Column("kind", String, primary_key=True),
+        Column("item", String, primary_key=True),
+        Column("count", Integer, nullable=False),
+    )
+    metadata.create_all(connection, tables=[game_choice, feedback_rollup])
+    # Счётчики уже накопленной обратной связи: один полный проход сейчас вместо прохода на каждую сводку
+    rebuild_rollup(connection)
+
+
+@migration(8, "students.id, feedback.student_id и game_choice.student_id BIGINT")
+def _bigint_student_ids(connection: Connection):
+    # id чатов Telegram не помещаются в INTEGER PostgreSQL; в SQLite INTEGER и так 64-битный
+    if connection.dialect.name != "postgresql":
+        return
+    for table, column in (("feedback", "student_id"), ("game_choice", "student_id"), ("students", "id")):
+        connection.execute(text(f"ALTER TABLE {table} ALTER COLUMN {column} TYPE BIGINT"))
+
+
+
+@migration(9, "broadcast_delivery.student_id BIGINT")
+def _bigint_delivery_student_id(connection: Connection):
+    if connection.dialect.name != "postgresql":
+        return
+    connection.execute(text("ALTER TABLE broadcast_delivery ALTER COLUMN student_id TYPE BIGINT"))
+
+
+LATEST_VERSION = MIGRATIONS[-1].version
+# Ключ pg_advisory_xact_lock, под которым меняется схема
+SCHEMA_LOCK = 0x6D696772
+
+
+def current_version(engine) -> int:
+    """Версия схемы одним запросом; 0 - база ещё не размечена миграциями"""
+    try:
+        with engine.connect() as connection:
+            return connection.execute(select(func.max(schema_version.c.version))).scalar() or 0
+    except DBAPIError:
+        # Таблицы schema_version ещё нет
+        return 0
+
+
+def migrate(database) -> list[int]:
+    """Применяет недостающие миграции и возвращает номера применённых версий.
+
+    Экземпляры бота, стартующие одновременно, не мешают друг другу: в PostgreSQL каждая миграция
+    берёт pg_advisory_xact_lock и заново читает версию схемы, так что её применяет только один из них.
+    """
+    engine = database.engine
+    applied = []
+    current = current_version(engine)
+    for step in MIGRATIONS:
+        if step.version <= current:
+            continue
+        with engine.begin() as connection:
+            _lock_schema(connection)
+            schema_version.create(connection, checkfirst=True)
+            current = connection.execute(select(func.max(schema_version.c.version))).scalar() or 0
+            if step.version <= current:
+                continue
+            step.apply(connection)
+            connection.execute(schema_version.insert(), {"version": step.version, "description": step.description})
+        applied.append(step.version)
+    if FEEDBACK_PARTITIONED:
+        with engine.begin() as connection:
+            _lock_schema(connection)
+            ensure_feedback_partitions(connection)
+    return applied
+
+
+def _lock_schema(connection: Connection):
+    """Блокировка изменений схемы до конца транзакции. SQLite - база одного экземпляра бота, ей она не нужна"""
+    if connection.dialect.name == "postgresql":
+        connection.execute(select(func.pg_advisory_xact_lock(SCHEMA_LOCK)))
+
+
+def check_schema(database) -> bool:
+    version = current_version(database.engine)
+    if version != LATEST_VERSION:
+        print(f"Схема базы версии {version}, ожидается {LATEST_VERSION}: выполните python -m db.migrations")
+        return False
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Миграции схемы базы данных")
+    parser.add_argument("--check", action="store_true", help="только проверить версию схемы")
+    args = parser.parse_args()
+
+    from .database import db
+
+    if args.check:
+        sys.exit(0 if check_schema(db) else 1)
+    applied = migrate(db)
+    print(f"Применены миграции: {applied}" if applied else f"Схема актуальна (версия {LATEST_VERSION})")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,20 @@
-from sqlalchemy import Column, String, Integer, ForeignKey, DateTime
+import os
+
+from sqlalchemy import BigInteger, Column, Date, String, Integer, ForeignKey, DateTime, Index, JSON, Text
 from sqlalchemy.orm import relationship, declarative_base
 from sqlalchemy.sql import func
 
+# Только для PostgreSQL: feedback секционируется по месяцам (PARTITION BY RANGE (time)).
+# Ключ секционирования обязан входить в первичный ключ, поэтому он становится (id, time)
+FEEDBACK_PARTITIONED = os.getenv("FEEDBACK_PARTITIONED", "0") == "1"
+
 Base = declarative_base()
 
 class Students(Base):
     __tablename__ = "students"
 
-    id = Column(Integer, primary_key=True)
+    # id чата Telegram: бывает больше 2^31
+    id = Column(BigInteger, primary_key=True)
     name = Column(String)
     time = Column(DateTime, default=func.now())
 
@@ -15,11 +22,81 @@ class Students(Base):
 
 class Feedback(Base):
     __tablename__ = "feedback"
+    __table_args__ = (
+        # Отчёты по категории за период с постраничной выдачей по (time, id)
+        Index("ix_feedback_category_time", "category", "time", "id"),
+        # Выгрузки и подсчёты за период по всем категориям
+        Index("ix_feedback_time", "time", "id"),
+        Index("ix_feedback_student_id", "student_id"),
+        # Повторно доставленный апдейт не сохраняется дважды. В секционированной таблице уникальный
+        # индекс обязан включать time, поэтому там остаётся только защита журналом
+        Index("ux_feedback_update_key", "update_key", unique=not FEEDBACK_PARTITIONED),
+        {"postgresql_partition_by": "RANGE (time)"} if FEEDBACK_PARTITIONED else {},
+    )
 
-    id = Column(Integer, primary_key=True)
-    student_id = Column(Integer, ForeignKey("students.id"))
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    student_id = Column(BigInteger, ForeignKey("students.id"))
     category = Column(String)
     message = Column(String)
-    time = Column(DateTime, default=func.now())
+    time = Column(DateTime, default=func.now(), primary_key=FEEDBACK_PARTITIONED, nullable=False)
+    # "<chat_id>:<message_id>" сообщения, из которого взята обратная связь
+    update_key = Column(String)
+    # update_key более раннего сообщения того же студента в той же категории, которое это сообщение
+    # повторяет дословно или почти дословно (db.dedup); NULL - не повтор
+    duplicate_of = Column(String)
+
+    student = relationship("Students", back_populates="feedback")
+
+class BotState(Base):
+    """Состояние диалогов (обратная связь, выбранные карточки), общее для всех экземпляров бота"""
+    __tablename__ = "bot_state"
+
+    key = Column(String, primary_key=True)
+    value = Column(JSON, nullable=False)
+    expires_at = Column(DateTime, nullable=False, index=True)
+
+class Broadcast(Base):
+    """Рассылка всем студентам: текст и момент, когда все получатели обработаны"""
+    __tablename__ = "broadcast"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    text = Column(Text, nullable=False)
+    created_at = Column(DateTime, default=func.now(), nullable=False)
+    finished_at = Column(DateTime)
+
+class BroadcastDelivery(Base):
+    """Получатель рассылки. Строка появляется до отправки, поэтому прерванная рассылка никому не уходит дважды"""
+    __tablename__ = "broadcast_delivery"
+
+    broadcast_id = Column(Integer, ForeignKey("broadcast.id"), primary_key=True)
+    student_id = Column(BigInteger, primary_key=True)
+    # sending - взят в отправку, sent - доставлено, failed - Telegram отказал (например, бот заблокирован)
+    status = Column(String, nullable=False)
+    error = Column(String)
+    sent_at = Column(DateTime)
+
+class GameChoice(Base):
+    """Вариант, выбранный студентом на карточке игры"""
+    __tablename__ = "game_choice"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    student_id = Column(BigInteger, ForeignKey("students.id"))
+    image = Column(Integer, nullable=False)
+    part = Column(Integer, nullable=False)
+    time = Column(DateTime, default=func.now(), nullable=False)
+    # "choice:<id callback-запроса>": повторно доставленное нажатие не сохраняется дважды
+    update_key = Column(String, unique=True)
+
+class FeedbackRollup(Base):
+    """Счётчики по дням, которые пишущий поток увеличивает в той же транзакции, что и сами записи.
+
+    kind - feedback (item - категория), duplicate (категория, только повторы) или choice
+    (item - "<картинка>:<вариант>"). Строк здесь - дни на категории и варианты карточек,
+    поэтому сводка не зависит от размера feedback.
+    """
+    __tablename__ = "feedback_rollup"
 
-    student = relationship("Students", back_populates="feedback")
\ No newline at end of file
+    day = Column(Date, primary_key=True)
+    kind = Column(String, primary_key=True)
+    item = Column(String, primary_key=True)
+    count = Column(Integer, nullable=False)
@@ -0,0 +1,33 @@
+from datetime import date
+
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+
+from .models import Feedback, FEEDBACK_PARTITIONED
+
+
+def month_start(day: date, shift: int = 0) -> date:
+    month = day.year * 12 + day.month - 1 + shift
+    return date(month // 12, month % 12 + 1, 1)
+
+
+def ensure_feedback_partitions(connection: Connection, months_back: int = 1, months_ahead: int = 12,
+                               today: date | None = None):
+    """Создаёт помесячные секции feedback вокруг текущей даты и секцию DEFAULT.
+
+    Ничего не делает, если секционирование выключено или база не PostgreSQL. Запросы за период
+    с условием на time читают только нужные секции, а старые семестры можно отсоединять
+    (DETACH PARTITION) целиком, не трогая горячую секцию, в которую пишет бот.
+    """
+    if not FEEDBACK_PARTITIONED or connection.dialect.name != "postgresql":
+        return
+    table = Feedback.__tablename__
+    today = today or date.today()
+    for shift in range(-months_back, months_ahead + 1):
+        start, end = month_start(today, shift), month_start(today, shift + 1)
+        connection.execute(text(
+            f"CREATE TABLE IF NOT EXISTS {table}_{start:%Y_%m} PARTITION OF {table} "
+            f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+        ))
+    # Строки вне заранее созданных месяцев не теряются
+    connection.execute(text(f"CREATE TABLE IF NOT EXISTS {table}_default PARTITION OF {table} DEFAULT"))
@@ -0,0 +1,118 @@
+import threading
+from collections import Counter
+from datetime import date, timedelta
+
+from sqlalchemy import Date, String, cast, delete, func, literal, select
+from sqlalchemy.engine import Connection
+
+from .models import Feedback, FeedbackRollup, GameChoice
+
+
+def rollup_deltas(feedback: list, choices: list) -> Counter:
+    """Приращения счётчиков feedback_rollup по только что вставленным строкам: (день, вид, элемент) -> число
+
+    feedback - строки (time, category, duplicate_of), choices - строки (time, image, part).
+    """
+    deltas = Counter()
+    for created, category, duplicate_of in feedback:
+        deltas[(created.date(), "feedback", category)] += 1
+        if duplicate_of is not None:
+            deltas[(created.date(), "duplicate", category)] += 1
+    for created, image, part in choices:
+        deltas[(created.date(), "choice", f"{image}:{part}")] += 1
+    return deltas
+
+
+def rollup_rows(deltas: Counter) -> list[dict]:
+    # Один порядок строк у всех экземпляров бота: одновременные upsert не ждут друг друга по кругу
+    return [
+        {"day": day, "kind": kind, "item": item, "count": count} for (day, kind, item), count in sorted(deltas.items())
+    ]
+
+
+def rebuild_rollup(connection: Connection):
+    """Пересчитывает feedback_rollup полным проходом по feedback и game_choice (миграция, восстановление)"""
+    rollup = FeedbackRollup.__table__
+    connection.execute(delete(rollup))
+    columns = ["day", "kind", "item", "count"]
+    day = func.date(Feedback.time, type_=Date)
+    for kind, condition in (("feedback", None), ("duplicate", Feedback.duplicate_of.is_not(None))):
+        query = select(day, literal(kind), Feedback.category, func.count()).where(Feedback.category.is_not(None))
+        if condition is not None:
+            query = query.where(condition)
+        connection.execute(rollup.insert().from_select(columns, query.group_by(day, Feedback.category)))
+    day = func.date(GameChoice.time, type_=Date)
+    item = cast(GameChoice.image, String) + ":" + cast(GameChoice.part, String)
+    connection.execute(rollup.insert().from_select(
+        columns, select(day, literal("choice"), item, func.count()).group_by(day, GameChoice.image, GameChoice.part)
+    ))
+
+
+class Rollup:
+    """Счётчики feedback_rollup в памяти: сводка для администратора без запросов к базе.
+
+    Пишущий поток добавляет сюда то, что только что зафиксировал. С watch(interval) счётчики раз
+    в interval секунд перечитываются из feedback_rollup целиком, чтобы учесть записи других экземпляров
+    бота; таблица маленькая (дни на категории и варианты карточек), так что это не зависит от объёма feedback.
+    """
+
+    def __init__(self, database):
+        self.database = database
+        self.lock = threading.Lock()
+        self.days: dict[date, Counter] = {}  # день -> (вид, элемент) -> число
+        self.totals = Counter()  # (вид, элемент) -> число за всё время
+        self.loaded = False
+        self.stopped = threading.Event()
+        self.thread = None
+        self.counters = {"reloads": 0, "updates": 0}
+
+    def load(self):
+        with self.database.unit_of_work() as session:
+            rows = session.execute(self.database.statements.select_rollup).all()
+        days, totals = {}, Counter()
+        for day, kind, item, count in rows:
+            days.setdefault(day, Counter())[(kind, item)] += count
+            totals[(kind, item)] += count
+        with self.lock:
+            self.days, self.totals = days, totals
+            self.loaded = True
+            self.counters["reloads"] += 1
+
+    def add(self, deltas: Counter):
+        with self.lock:
+            for (day, kind, item), count in deltas.items():
+                self.days.setdefault(day, Counter())[(kind, item)] += count
+                self.totals[(kind, item)] += count
+            self.counters["updates"] += 1
+
+    def summary(self, days: int = 7, today: date | None = None) -> dict[str, Counter]:
+        """Счётчики (вид, элемент) за всё время, за сегодня и за последние days дней"""
+        today = today or date.today()
+        with self.lock:
+            recent = Counter()
+            for shift in range(days):
+                recent.update(self.days.get(today - timedelta(days=shift), {}))
+            return {"total": Counter(self.totals), "today": Counter(self.days.get(today, {})), "recent": recent}
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {**self.counters, "days": len(self.days), "items": len(self.totals)}
+
+    def watch(self, interval: float):
+        if self.thread is None and interval > 0:
+            self.stopped.clear()
+            self.thread = threading.Thread(target=self._watch, args=(interval,), name="feedback-rollup", daemon=True)
+            self.thread.start()
+
+    def close(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def _watch(self, interval: float):
+        while not self.stopped.wait(interval):
+            try:
+                self.load()
+            except Exception as e:
+                print(f"Ошибка перечитывания счётчиков обратной связи: {e}")
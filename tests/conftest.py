@@ -0,0 +1,12 @@
+import pytest
+
+from db.database import Database
+from db.migrations import migrate
+
+
+@pytest.fixture
+def database(tmp_path):
+    database = Database(f"sqlite:///{tmp_path / 'feedback.db'}")
+    migrate(database)
+    yield database
+    database.engine.dispose()
@@ -0,0 +1,54 @@
+import time
+
+from db.dedup import DuplicateIndex, normalize
+
+
+def test_normalize():
+    assert normalize("  Всё ПОНРАВИЛОСЬ!!! 👍 ") == "все понравилось"
+
+
+def test_exact_duplicates_after_normalization():
+    index = DuplicateIndex()
+    assert index.match(1, "liked", "Всё понравилось!", "1:1") is None
+    assert index.match(1, "liked", "всё   понравилось", "1:2") == "1:1"
+    assert index.match(1, "liked", "Все понравилось 👍", "1:3") == "1:1"
+    assert index.stats()["exact"] == 2
+
+
+def test_near_duplicates():
+    index = DuplicateIndex(threshold=0.7)
+    original = "Очень понравилась игра с карточками, особенно часть про выбор профессии и навыки"
+    assert index.match(1, "liked", original, "1:1") is None
+    assert index.match(1, "liked", original.replace("профессии", "професии") + "!", "1:2") == "1:1"
+    assert index.match(1, "liked", "Хотелось бы больше времени на обсуждение в группах", "1:3") is None
+    assert index.stats()["near"] == 1
+
+
+def test_duplicates_are_scoped_by_student_and_category():
+    index = DuplicateIndex()
+    assert index.match(1, "liked", "Понравилось", "1:1") is None
+    assert index.match(2, "liked", "Понравилось", "2:1") is None
+    assert index.match(1, "add", "Понравилось", "1:2") is None
+    assert len(index) == 3
+
+
+def test_discarded_messages_are_not_originals():
+    index = DuplicateIndex()
+    assert index.match(1, "liked", "Понравилось", "1:1") is None
+    index.discard(["1:1"])
+    assert index.match(1, "liked", "Понравилось", "1:2") is None
+    assert len(index) == 1
+
+
+def test_old_and_excess_entries_are_evicted():
+    index = DuplicateIndex(window=0.01)
+    index.match(1, "liked", "Понравилось", "1:1")
+    time.sleep(0.02)
+    assert index.match(1, "liked", "Понравилось", "1:2") is None
+
+    index = DuplicateIndex(max_entries=2)
+    for n, text in enumerate(("Понравилась игра", "Мало времени на обсуждение", "Хочу ещё карточек")):
+        index.match(1, "liked", text, f"1:{n}")
+    assert len(index) == 2
+    assert index.match(1, "liked", "Понравилась игра", "1:9") is None
+    assert index.stats()["evicted"] == 2
@@ -0,0 +1,68 @@
+import random
+import threading
+import time
+
+from bot.executor import ChatExecutor
+
+
+def test_updates_of_a_chat_run_in_order_and_one_at_a_time():
+    executor = ChatExecutor(workers=4)
+    executor.start()
+    lock = threading.Lock()
+    running, handled = {}, {}
+    overlaps, peak = [], [0]
+
+    def handle(chat_id, n):
+        with lock:
+            if running.get(chat_id):
+                overlaps.append(chat_id)
+            running[chat_id] = True
+            peak[0] = max(peak[0], sum(running.values()))
+        time.sleep(random.random() / 1000)
+        with lock:
+            running[chat_id] = False
+            handled.setdefault(chat_id, []).append(n)
+
+    for n in range(30):
+        for chat_id in range(6):
+            executor.submit(chat_id, handle, chat_id, n)
+    executor.close()
+
+    assert overlaps == []
+    assert handled == {chat_id: list(range(30)) for chat_id in range(6)}
+    assert peak[0] > 1
+
+
+def test_slow_chat_does_not_hold_other_chats():
+    executor = ChatExecutor(workers=2)
+    executor.start()
+    release, done = threading.Event(), threading.Event()
+    executor.submit(1, release.wait, 5)
+    executor.submit(1, lambda: None)
+    for n in range(10):
+        executor.submit(2, lambda: None)
+    executor.submit(2, done.set)
+    assert done.wait(5)
+    assert executor.stats()["queue_depth"] == 1
+    release.set()
+    executor.close()
+
+
+def test_close_drains_accepted_updates():
+    executor = ChatExecutor(workers=2)
+    handled = []
+
+    def fail():
+        raise ValueError("ошибка обработчика")
+
+    # Апдейты приняты до старта потоков и сразу за ними - остановка
+    for n in range(50):
+        executor.submit(n % 3, handled.append, n)
+    executor.submit(0, fail)
+    executor.start()
+    executor.close()
+
+    assert sorted(handled) == list(range(50))
+    stats = executor.stats()
+    assert (stats["submitted"], stats["done"], stats["failed"], stats["queue_depth"]) == (51, 50, 1, 0)
+    assert executor.threads == []
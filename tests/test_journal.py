@@ -0,0 +1,171 @@
+import asyncio
+import json
+import os
+import threading
+
+from sqlalchemy import func, select
+
+from db.database import AsyncDatabase
+from db.feedback_writer import AsyncFeedbackWriter, FeedbackWriter
+from db.journal import UpdateJournal
+from db.models import Feedback, FeedbackRollup
+
+
+def segments(directory) -> list[str]:
+    return sorted(name for name in os.listdir(directory) if name.startswith("journal-"))
+
+
+def feedback_count(database) -> int:
+    with database.unit_of_work() as session:
+        return session.execute(select(func.count()).select_from(Feedback)).scalar()
+
+
+def rollup_count(database) -> int:
+    with database.unit_of_work() as session:
+        return session.execute(
+            select(func.coalesce(func.sum(FeedbackRollup.count), 0)).where(FeedbackRollup.kind == "feedback")
+        ).scalar()
+
+
+def test_replay_after_crash_does_not_duplicate(database, tmp_path, monkeypatch):
+    journal = UpdateJournal(str(tmp_path / "journal"))
+    writer = FeedbackWriter(database, flush_interval=0.01, journal=journal)
+    # Падение между фиксацией транзакции и отметкой "done" в журнале
+    monkeypatch.setattr(journal, "commit", lambda keys: None)
+    writer.start()
+    assert writer.submit(1, "Студент", "liked", "Понравилось", "1:10")
+    writer.close()
+    assert feedback_count(database) == 1
+    monkeypatch.undo()
+
+    journal = UpdateJournal(str(tmp_path / "journal"))
+    writer = FeedbackWriter(database, flush_interval=0.01, journal=journal)
+    writer.start()
+    writer.close()
+
+    assert journal.stats()["replayed"] == 1
+    assert feedback_count(database) == 1
+    assert rollup_count(database) == 1
+    assert journal.stats()["pending"] == 0
+
+
+def test_done_keys_survive_restarts(tmp_path):
+    directory = str(tmp_path / "journal")
+    journal = UpdateJournal(directory)
+    journal.open()
+    assert journal.append("1:10", {"message": "Понравилось"})
+    journal.commit(["1:10"])
+    journal.close()
+
+    # Первый перезапуск переписывает журнал в новый сегмент, второй читает уже его
+    for _ in range(2):
+        journal = UpdateJournal(directory)
+        assert journal.open() == []
+        assert not journal.append("1:10", {"message": "Понравилось"})
+        journal.close()
+        assert len(segments(directory)) == 1
+
+
+def test_committed_segments_are_deleted(tmp_path):
+    directory = str(tmp_path / "journal")
+    journal = UpdateJournal(directory, segment_bytes=256)
+    journal.open()
+    keys = [f"1:{n}" for n in range(20)]
+    for key in keys:
+        journal.append(key, {"message": "x" * 50})
+    assert len(segments(directory)) > 2
+
+    # Сегмент с незафиксированной записью остаётся, остальные закрытые удаляются
+    journal.commit(keys[1:])
+    assert segments(directory)[0] == "journal-00000001.log"
+    assert len(segments(directory)) == 2
+
+    journal.commit(keys[:1])
+    assert segments(directory) == [f"journal-{journal.segment:08d}.log"]
+    journal.close()
+
+    reopened = UpdateJournal(directory)
+    assert reopened.open() == []
+    reopened.close()
+
+
+def test_close_keeps_journal_open_while_worker_flushes(database, tmp_path, monkeypatch):
+    journal = UpdateJournal(str(tmp_path / "journal"))
+    writer = FeedbackWriter(database, flush_interval=0.01, journal=journal)
+    release = threading.Event()
+    flush = writer._flush
+
+    def slow_flush(batch):
+        release.wait()
+        flush(batch)
+
+    monkeypatch.setattr(writer, "_flush", slow_flush)
+    writer.start()
+    writer.submit(1, "Студент", "liked", "Понравилось", "1:10")
+    writer.close(timeout=0.05)
+    assert journal.file is not None
+
+    release.set()
+    writer.close()
+    assert journal.file is None
+    assert feedback_count(database) == 1
+    assert journal.stats()["pending"] == 0
+
+
+def test_rejected_row_does_not_fail_the_batch(database, tmp_path):
+    directory = tmp_path / "journal"
+    journal = UpdateJournal(str(directory))
+    writer = FeedbackWriter(database, flush_interval=0.05, journal=journal)
+    writer.start()
+    writer.submit(1, "Студент", "liked", "Понравилось", "1:10")
+    # Выбор без варианта база не примет: part NOT NULL
+    writer.submit_choice(1, "Студент", 3, None, "1:11")
+    writer.submit(2, "Студентка", "liked", "Всё понятно", "2:12")
+    writer.close()
+
+    stats = writer.stats()
+    assert (stats["written"], stats["failed"], stats["rejected"]) == (2, 1, 1)
+    assert feedback_count(database) == 2
+    assert journal.stats()["pending"] == 0
+    rejected = [json.loads(line) for line in (directory / "rejected.jsonl").read_text(encoding="utf-8").splitlines()]
+    assert [(entry["k"], entry["r"]["part"]) for entry in rejected] == [("1:11", None)]
+
+    # Отвергнутая запись не перечитывается при следующем старте
+    journal = UpdateJournal(str(directory))
+    assert journal.open() == []
+    journal.close()
+
+
+def test_student_ids_above_int32(database, tmp_path):
+    writer = FeedbackWriter(database, flush_interval=0.01, journal=UpdateJournal(str(tmp_path / "journal")))
+    writer.start()
+    writer.submit(2 ** 40, "Студент", "liked", "Понравилось", f"{2 ** 40}:10")
+    writer.submit_choice(2 ** 40, "Студент", 3, 2, f"choice:{2 ** 40}")
+    writer.close()
+    assert (writer.stats()["written"], writer.stats()["choices"], writer.stats()["failed"]) == (1, 1, 0)
+
+
+def test_async_writer_keeps_journal_io_off_the_event_loop(database, tmp_path, monkeypatch):
+    journal = UpdateJournal(str(tmp_path / "journal"))
+    threads = []
+    for name in ("append", "commit", "reject"):
+        def record(*args, method=getattr(journal, name)):
+            threads.append(threading.current_thread())
+            return method(*args)
+
+        monkeypatch.setattr(journal, name, record)
+
+    async def run():
+        database = AsyncDatabase(f"sqlite+aiosqlite:///{tmp_path / 'feedback.db'}")
+        writer = AsyncFeedbackWriter(database, flush_interval=0.01, journal=journal)
+        writer.start()
+        await writer.submit(1, "Студент", "liked", "Понравилось", "1:10")
+        await writer.submit_choice(1, "Студент", 3, None, "1:11")
+        await writer.close()
+        await database.engine.dispose()
+        return writer.stats()
+
+    stats = asyncio.run(run())
+    assert (stats["written"], stats["rejected"]) == (1, 1)
+    assert journal.stats()["pending"] == 0
+    assert len(threads) >= 4 and threading.main_thread() not in threads
@@ -0,0 +1,18 @@
+from sqlalchemy import inspect
+
+from db.database import Database
+from db.migrations import LATEST_VERSION, current_version, migrate
+from db.models import Base
+
+
+def test_migrations_create_the_model_schema(tmp_path):
+    database = Database(f"sqlite:///{tmp_path / 'feedback.db'}")
+    assert migrate(database) == list(range(1, LATEST_VERSION + 1))
+    assert migrate(database) == []
+    assert current_version(database.engine) == LATEST_VERSION
+
+    schema = inspect(database.engine)
+    for table in Base.metadata.sorted_tables:
+        assert {column["name"] for column in schema.get_columns(table.name)} == set(table.columns.keys())
+        assert {index["name"] for index in schema.get_indexes(table.name)} >= {index.name for index in table.indexes}
+    database.engine.dispose()
@@ -0,0 +1,123 @@
+import asyncio
+import time
+
+from bot.outbound import BULK, HIGH, NORMAL, OutboundScheduler
+
+
+class TooManyRequests(Exception):
+    error_code = 429
+
+    def __init__(self, retry_after: float):
+        super().__init__("Too Many Requests")
+        self.result_json = {"parameters": {"retry_after": retry_after}}
+
+
+def flaky(calls: list, failures: int, retry_after: float = 0.05):
+    def send(text):
+        calls.append((text, time.monotonic()))
+        if len(calls) <= failures:
+            raise TooManyRequests(retry_after)
+        return text
+
+    return send
+
+
+def test_priority_lanes():
+    scheduler = OutboundScheduler(workers=1)
+    sent = []
+    # Всё уже в очереди к старту: порядок определяет только приоритет, внутри полосы - очередь
+    lanes = (("bulk1", BULK), ("normal1", NORMAL), ("high", HIGH), ("bulk2", BULK), ("normal2", NORMAL))
+    futures = [scheduler.submit(sent.append, (name,), priority=priority) for name, priority in lanes]
+    scheduler.start()
+    scheduler.close()
+    assert all(future.done() for future in futures)
+    assert sent == ["high", "normal1", "normal2", "bulk1", "bulk2"]
+    waits = scheduler.stats()["wait"]
+    assert {lane: wait["count"] for lane, wait in waits.items()} == {"high": 1, "normal": 2, "bulk": 2}
+
+
+def test_chat_limit_does_not_hold_other_chats():
+    scheduler = OutboundScheduler(chat_rate=10, chat_burst=1, workers=1)
+    sent = []
+    scheduler.start()
+    for chat_id in (1, 1, 2):
+        scheduler.submit(lambda chat_id=chat_id: sent.append((chat_id, time.monotonic())), chat_id=chat_id)
+    scheduler.close()
+    assert [chat_id for chat_id, _ in sent] == [1, 2, 1]
+    assert sent[2][1] - sent[0][1] >= 0.09
+
+
+def test_retries_after_429():
+    scheduler = OutboundScheduler()
+    scheduler.start()
+    calls = []
+    assert scheduler.submit(flaky(calls, failures=2), ("Привет",), chat_id=1).result(5) == "Привет"
+    scheduler.close()
+    assert len(calls) == 3
+    assert calls[1][1] - calls[0][1] >= 0.05 and calls[2][1] - calls[1][1] >= 0.05
+    stats = scheduler.stats()
+    assert (stats["sent"], stats["failed"], stats["retried_429"]) == (1, 0, 2)
+
+
+def test_gives_up_after_max_retries():
+    scheduler = OutboundScheduler(max_retries=1)
+    scheduler.start()
+    calls = []
+    future = scheduler.submit(flaky(calls, failures=5, retry_after=0.01), ("Привет",), chat_id=1)
+    assert isinstance(future.exception(5), TooManyRequests)
+    scheduler.close()
+    assert len(calls) == 2
+    assert scheduler.stats()["failed"] == 1
+
+
+def test_async_call_retries_after_429():
+    calls = []
+    send = flaky(calls, failures=1)
+
+    async def send_async(text):
+        return send(text)
+
+    async def run():
+        scheduler = OutboundScheduler()
+        scheduler.start()
+        result = await scheduler.call_async(send_async, ("Привет",), chat_id=1)
+        scheduler.close()
+        return result, scheduler.stats()
+
+    result, stats = asyncio.run(run())
+    assert result == "Привет"
+    assert (stats["sent"], stats["retried_429"]) == (1, 1)
+
+
+def test_cancelled_calls_are_not_sent():
+    scheduler = OutboundScheduler()
+    sent = []
+    cancelled = scheduler.submit(sent.append, ("отменён",), chat_id=1)
+    kept = scheduler.submit(sent.append, ("отправлен",), chat_id=1)
+    assert cancelled.cancel()
+    scheduler.start()
+    scheduler.close()
+    assert cancelled.cancelled() and kept.done()
+    assert sent == ["отправлен"]
+
+
+def test_cancelled_async_call_does_not_block_close():
+    sent = []
+
+    async def send(text):
+        sent.append(text)
+
+    async def run():
+        scheduler = OutboundScheduler()
+        # Планировщик ещё не запущен: вызов ждёт разрешения, когда его отменяют
+        task = asyncio.create_task(scheduler.call_async(send, ("отменён",), chat_id=1))
+        await asyncio.sleep(0)
+        task.cancel()
+        scheduler.start()
+        await scheduler.call_async(send, ("отправлен",), chat_id=2)
+        await asyncio.wait_for(asyncio.to_thread(scheduler.close), 5)
+        return task
+
+    task = asyncio.run(run())
+    assert task.cancelled()
+    assert sent == ["отправлен"]
@@ -0,0 +1,109 @@
+from collections import Counter
+from datetime import date, datetime
+from types import SimpleNamespace
+
+from sqlalchemy import select
+
+from bot.main import StatsHandler
+from db.dedup import DuplicateIndex
+from db.feedback_writer import FeedbackWriter
+from db.models import FeedbackRollup
+from db.rollup import Rollup, rebuild_rollup, rollup_deltas
+
+TODAY = date(2026, 3, 10)
+
+
+def rollup_table(database) -> set[tuple]:
+    with database.unit_of_work() as session:
+        return set(session.execute(
+            select(FeedbackRollup.day, FeedbackRollup.kind, FeedbackRollup.item, FeedbackRollup.count)
+        ).all())
+
+
+def test_rollup_deltas():
+    morning, evening = datetime(2026, 3, 10, 9), datetime(2026, 3, 10, 21)
+    deltas = rollup_deltas(
+        [(morning, "liked", None), (evening, "liked", "1:1"), (evening, "add", None)],
+        [(morning, 3, 2), (evening, 3, 2), (evening, 3, 1)],
+    )
+    assert deltas == Counter({
+        (TODAY, "feedback", "liked"): 2, (TODAY, "duplicate", "liked"): 1, (TODAY, "feedback", "add"): 1,
+        (TODAY, "choice", "3:2"): 2, (TODAY, "choice", "3:1"): 1,
+    })
+
+
+def test_writer_counters_match_a_full_rebuild(database):
+    rollup = Rollup(database)
+    writer = FeedbackWriter(database, flush_interval=0.01, dedup=DuplicateIndex(), rollup=rollup)
+    writer.start()
+    writer.submit(1, "Студент", "liked", "Понравилась игра", "1:1")
+    writer.submit(1, "Студент", "liked", "Понравилась игра!", "1:2")
+    writer.submit(2, "Студентка", "add", "Больше карточек", "2:1")
+    writer.submit_choice(1, "Студент", 3, 2, "choice:1")
+    writer.submit_choice(2, "Студентка", 3, 2, "choice:2")
+    # Повторно доставленное нажатие ничего не добавляет
+    writer.submit_choice(2, "Студентка", 3, 2, "choice:2")
+    writer.close()
+
+    incremental = rollup_table(database)
+    with database.engine.begin() as connection:
+        rebuild_rollup(connection)
+    assert rollup_table(database) == incremental
+
+    totals = rollup.summary()["total"]
+    assert totals == Counter({("feedback", "liked"): 2, ("duplicate", "liked"): 1, ("feedback", "add"): 1,
+                              ("choice", "3:2"): 2})
+    reloaded = Rollup(database)
+    reloaded.load()
+    assert reloaded.summary()["total"] == totals
+
+
+def test_summary_windows(database):
+    rollup = Rollup(database)
+    rollup.add(Counter({
+        (TODAY, "feedback", "liked"): 1,
+        (date(2026, 3, 4), "feedback", "liked"): 2,
+        (date(2026, 3, 3), "feedback", "add"): 4,
+    }))
+    summary = rollup.summary(days=7, today=TODAY)
+    assert summary["today"] == Counter({("feedback", "liked"): 1})
+    assert summary["recent"] == Counter({("feedback", "liked"): 3})
+    assert summary["total"] == Counter({("feedback", "liked"): 3, ("feedback", "add"): 4})
+
+
+class FakeBot:
+    def __init__(self):
+        self.sent = []
+
+    def send_message(self, chat_id, text, **kwargs):
+        self.sent.append((chat_id, text))
+
+
+def test_stats_handler(database):
+    rollup = Rollup(database)
+    rollup.add(Counter({
+        (date.today(), "feedback", "liked"): 3,
+        (date.today(), "duplicate", "liked"): 1,
+        (date.today(), "feedback", "add"): 1,
+        (date.today(), "choice", "1:1"): 1,
+        (date.today(), "choice", "1:2"): 3,
+    }))
+    content = SimpleNamespace(cards={
+        1: {"options": [{"label": "Врач"}, {"label": "Инженер <IT>"}]},
+        2: {"options": [{"label": "Учитель"}]},
+    })
+    bot = FakeBot()
+    handler = StatsHandler(bot, rollup, content, admins={42})
+
+    handler.handle(SimpleNamespace(from_user=SimpleNamespace(id=7), chat=SimpleNamespace(id=7)))
+    assert bot.sent == []
+
+    handler.handle(SimpleNamespace(from_user=SimpleNamespace(id=42), chat=SimpleNamespace(id=42)))
+    [(chat_id, text)] = bot.sent
+    assert chat_id == 42
+    lines = text.splitlines()
+    assert "Всего: 4, из них повторов: 1" in lines
+    assert "Что понравилось: 3" in lines and "Что можно добавить: 1" in lines
+    assert "Сегодня: 4, за 7 дней: 4" in lines
+    assert "Карточка 1: Инженер &lt;IT&gt; - 3 из 4 (75%)" in lines
+    assert "Карточка 2: выборов нет" in lines
@@ -0,0 +1,57 @@
+from types import SimpleNamespace
+
+import pytest
+
+from bot.router import CallbackPayload, Router, parse_callback
+
+
+@pytest.mark.parametrize("data, payload", [
+    ("part_3_2", CallbackPayload("part", 3, 2)),
+    ("next_3", CallbackPayload("next", 3)),
+    ("part_3", CallbackPayload("part", 3)),
+    ("part", CallbackPayload("part")),
+    ("cancel_feedback", CallbackPayload("cancel_feedback")),
+    ("part_x_2", CallbackPayload("part_x_2")),
+    ("part_3_x", CallbackPayload("part_3_x")),
+])
+def test_parse_callback(data, payload):
+    assert parse_callback(data) == payload
+
+
+@pytest.fixture
+def router():
+    calls = []
+    router = Router()
+    router.command("start", lambda message: calls.append(("start", message.text)))
+    router.text("Игра", lambda message: calls.append(("game", message.text)))
+    router.otherwise(lambda message: calls.append(("text", message.text)))
+    router.callback("cancel_feedback", lambda call, payload: calls.append(("cancel", payload)))
+    router.action("part", lambda call, payload: calls.append(("part", payload)), option=True)
+    router.action("next", lambda call, payload: calls.append(("next", payload)))
+    router.calls = calls
+    return router
+
+
+def test_dispatch_message(router):
+    for text in ("/start", "/start@feedback_bot", "Игра", "Всё понравилось", "/unknown"):
+        router.dispatch_message(SimpleNamespace(text=text))
+    assert router.calls == [
+        ("start", "/start"), ("start", "/start@feedback_bot"), ("game", "Игра"),
+        ("text", "Всё понравилось"), ("text", "/unknown"),
+    ]
+
+
+def test_dispatch_callback(router):
+    for data in ("cancel_feedback", "part_3_2", "next_3", "unknown_1"):
+        router.dispatch_callback(SimpleNamespace(data=data))
+    assert router.calls == [
+        ("cancel", CallbackPayload("cancel_feedback")),
+        ("part", CallbackPayload("part", 3, 2)),
+        ("next", CallbackPayload("next", 3)),
+    ]
+
+
+@pytest.mark.parametrize("data", ["part_3", "part", "next", "part_3_x", ""])
+def test_incomplete_game_callbacks_are_not_dispatched(router, data):
+    router.dispatch_callback(SimpleNamespace(data=data))
+    assert router.calls == []
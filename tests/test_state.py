@@ -0,0 +1,84 @@
+import time
+
+import pytest
+
+from bot.state import MemoryStateStore, PostgresStateStore
+
+
+def test_memory_store_expires_entries():
+    store = MemoryStateStore(ttl=60)
+    store.set("feedback:1", {"category": "liked"})
+    store.set("game:1", {"3": 2}, ttl=0.01)
+    time.sleep(0.02)
+    assert store.get("feedback:1") == {"category": "liked"}
+    assert store.get("game:1") is None
+    assert store.get_many(["feedback:1", "game:1"]) == {"feedback:1": {"category": "liked"}}
+    store.delete("feedback:1")
+    assert store.get("feedback:1") is None
+
+
+def test_memory_store_evicts_least_recently_updated():
+    store = MemoryStateStore(ttl=60, max_entries=2)
+    store.set("a", {})
+    store.set("b", {})
+    store.set("a", {"n": 1})
+    store.set("c", {})
+    assert store.get_many(["a", "b", "c"]) == {"a": {"n": 1}, "c": {}}
+
+
+@pytest.fixture
+def stores(database):
+    # Сброс в базу только явным flush: фоновый поток ждёт дольше теста
+    stores = [PostgresStateStore(database, ttl=60, cache_ttl=60, flush_interval=3600) for _ in range(2)]
+    yield stores
+    for store in stores:
+        store.close()
+
+
+def test_postgres_store_shares_state_after_flush(stores):
+    first, second = stores
+    first.set("game:1", {"3": 2})
+    assert first.get("game:1") == {"3": 2}
+    assert second.get("game:1") is None
+    first.flush()
+    # Отсутствие ключа закэшировано на cache_ttl, prefetch перечитывает его из базы
+    assert second.get("game:1") is None
+    second.prefetch(["game:1", "feedback:1"])
+    assert second.get_many(["game:1", "feedback:1"]) == {"game:1": {"3": 2}}
+
+    first.delete("game:1")
+    first.flush()
+    second.prefetch(["game:1"])
+    assert second.get("game:1") is None
+
+
+def test_postgres_store_hides_expired_rows(stores):
+    first, second = stores
+    first.set("feedback:1", {"category": "liked"}, ttl=0.01)
+    first.flush()
+    time.sleep(0.02)
+    second.prefetch(["feedback:1"])
+    assert second.get("feedback:1") is None
+    first.sweep()
+    first.prefetch(["feedback:1"])
+    assert first.get("feedback:1") is None
+
+
+def test_postgres_store_keeps_a_failed_flush_readable(stores, database, monkeypatch):
+    first, second = stores
+    first.set("game:1", {"3": 2})
+
+    def unavailable():
+        raise ConnectionError("база недоступна")
+
+    monkeypatch.setattr(database, "unit_of_work", unavailable)
+    first.flush()
+    # Несохранённая запись читается из памяти, prefetch за ней в базу не ходит
+    first.prefetch(["game:1"])
+    assert first.get("game:1") == {"3": 2}
+
+    monkeypatch.undo()
+    first.set("feedback:1", {"category": "add"})
+    first.flush()
+    second.prefetch(["game:1", "feedback:1"])
+    assert second.get_many(["game:1", "feedback:1"]) == {"game:1": {"3": 2}, "feedback:1": {"category": "add"}}
@@ -0,0 +1,102 @@
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+from fastapi.testclient import TestClient
+
+from bot.webhook import SECRET_HEADER, create_app
+
+SECRET = "secret"
+
+
+def message_update(update_id: int) -> dict:
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id, "date": 0, "text": "Привет",
+            "chat": {"id": 1, "type": "private"}, "from": {"id": 1, "is_bot": False, "first_name": "Студент"},
+        },
+    }
+
+
+class FakeBot:
+    """Синхронный бот: обработка апдейта ждёт release, если он задан"""
+
+    def __init__(self):
+        self.updates = []
+        self.started = threading.Event()
+        self.release = None
+        self.shutdowns = 0
+        stats = SimpleNamespace(stats=lambda: {"queue_depth": 0})
+        self.bot = SimpleNamespace(process_new_updates=self.process_new_updates)
+        self.feedback_writer = SimpleNamespace(stats=stats.stats, database=SimpleNamespace(pool_stats=dict))
+        self.scheduler = stats
+        self.executor = None
+
+    def startup(self):
+        pass
+
+    def shutdown(self):
+        self.shutdowns += 1
+
+    def process_new_updates(self, updates):
+        self.started.set()
+        if self.release is not None:
+            self.release.wait(5)
+        self.updates.extend(update.update_id for update in updates)
+
+
+@pytest.fixture
+def feedback_bot():
+    return FakeBot()
+
+
+def test_app_requires_a_secret(feedback_bot):
+    with pytest.raises(ValueError):
+        create_app(feedback_bot, "")
+
+
+def test_rejects_wrong_secret(feedback_bot):
+    with TestClient(create_app(feedback_bot, SECRET)) as client:
+        assert client.post("/webhook", json=message_update(1)).status_code == 401
+        assert client.post("/webhook", json=message_update(1), headers={SECRET_HEADER: "wrong"}).status_code == 401
+        assert client.post("/webhook", json=message_update(1), headers={SECRET_HEADER: SECRET}).json() == {"ok": True}
+    assert feedback_bot.updates == [1]
+
+
+@pytest.mark.parametrize("body", [b"not json", b"[]", b"{}"])
+def test_malformed_update_is_400(feedback_bot, body):
+    with TestClient(create_app(feedback_bot, SECRET)) as client:
+        response = client.post("/webhook", content=body, headers={SECRET_HEADER: SECRET})
+    assert response.status_code == 400
+    assert feedback_bot.updates == []
+
+
+def test_shutdown_drains_inflight_updates(feedback_bot):
+    feedback_bot.release = threading.Event()
+    client = TestClient(create_app(feedback_bot, SECRET))
+    client.__enter__()
+    responses = []
+    request = threading.Thread(target=lambda: responses.append(
+        client.post("/webhook", json=message_update(1), headers={SECRET_HEADER: SECRET})
+    ))
+    request.start()
+    assert feedback_bot.started.wait(5)
+    stopping = threading.Thread(target=client.__exit__, args=(None, None, None))
+    stopping.start()
+
+    # Пока первый апдейт обрабатывается, новые получают 503, а обработчики бота ещё не остановлены
+    deadline = time.monotonic() + 5
+    while client.get("/health").status_code != 503:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+    assert client.post("/webhook", json=message_update(2), headers={SECRET_HEADER: SECRET}).status_code == 503
+    assert feedback_bot.shutdowns == 0
+
+    feedback_bot.release.set()
+    request.join(5)
+    stopping.join(5)
+    assert [response.status_code for response in responses] == [200]
+    assert feedback_bot.updates == [1]
+    assert feedback_bot.shutdowns == 1